@@ -0,0 +1,726 @@
+"""
+Pruebas de rendimiento de update_weather.py con datos sintéticos.
+
+Genera archivos GeoJSON con el tamaño que se quiera (por ejemplo, los
+~8.100 municipios de toda España) sin necesidad de descargar los límites
+reales, y mide el coste de las distintas fases del proceso.
+
+Incluye además un sustituto local de los endpoints /data/2.5/weather y
+/data/2.5/forecast de OpenWeatherMap, con latencia, tasa de errores y de
+respuestas 429 y tamaño de las respuestas configurables, de modo que el proceso completo se puede
+medir sin gastar cupo de la API real ni depender de la red.
+
+Uso desde la línea de comandos:
+    python benchmark.py generar data/sintetico.geojson --municipios 8100
+    python benchmark.py memoria --municipios 8100
+    python benchmark.py json --municipios 8100
+    python benchmark.py servidor --puerto 8765 --latencia 80 --tasa-429 0.01
+    python benchmark.py extremo --tamanos 179 1000 8000 --json resultados.json
+    python benchmark.py extremo --referencia resultados.json
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import esquema
+import update_weather
+
+
+# Esquina suroeste de la rejilla sintética y lado de cada municipio (grados)
+ORIGEN_SINTETICO = (-9.3, 36.0)
+LADO_MUNICIPIO = 0.05
+
+
+def generar_geojson_sintetico(ruta, municipios, vertices_por_lado=25, cada_multipoligono=7):
+    """
+    Escribe un GeoJSON sintético con `municipios` features en una rejilla.
+
+    Cada municipio es un cuadrado con sus lados densificados, de modo que
+    los vecinos comparten fronteras vértice a vértice como en los límites
+    reales del IGN. Uno de cada `cada_multipoligono` municipios es un
+    MultiPolygon con un pequeño exclave. Las features se escriben de una
+    en una, sin construir el documento completo en memoria.
+
+    Args:
+        ruta: Ruta del archivo que se genera
+        municipios: Número de features
+        vertices_por_lado: Vértices de cada lado del cuadrado
+        cada_multipoligono: Frecuencia de los MultiPolygon (0 para ninguno)
+
+    Returns:
+        Tamaño del archivo generado en bytes
+    """
+    columnas = int(municipios ** 0.5) + 1
+    x_origen, y_origen = ORIGEN_SINTETICO
+
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for i in range(municipios):
+            fila, columna = divmod(i, columnas)
+            x0 = x_origen + columna * LADO_MUNICIPIO
+            y0 = y_origen + fila * LADO_MUNICIPIO
+            esquinas = [(x0, y0), (x0 + LADO_MUNICIPIO, y0), (x0 + LADO_MUNICIPIO, y0 + LADO_MUNICIPIO),
+                        (x0, y0 + LADO_MUNICIPIO), (x0, y0)]
+
+            anillo = []
+            for (xa, ya), (xb, yb) in zip(esquinas, esquinas[1:]):
+                for k in range(vertices_por_lado):
+                    t = k / vertices_por_lado
+                    anillo.append([round(xa + (xb - xa) * t, 7), round(ya + (yb - ya) * t, 7)])
+            anillo.append(anillo[0])
+
+            if cada_multipoligono and i % cada_multipoligono == 0:
+                d = LADO_MUNICIPIO / 5
+                exclave = [[x0 + d, y0 + d], [x0 + 2 * d, y0 + d], [x0 + 2 * d, y0 + 2 * d], [x0 + d, y0 + d]]
+                geometria = {'type': 'MultiPolygon', 'coordinates': [[anillo], [exclave]]}
+            else:
+                geometria = {'type': 'Polygon', 'coordinates': [anillo]}
+
+            # NATCODE: 34 + comunidad + provincia + código INE (provincia + 3
+            # cifras). Los municipios se reparten en 52 provincias consecutivas.
+            provincia = 1 + i * 52 // municipios
+            natcode = f"3400{provincia:02d}{provincia:02d}{i % 1000:03d}"
+            feature = {
+                'type': 'Feature',
+                'properties': {'NAMEUNIT': f'Municipio {i}', 'NATCODE': natcode},
+                'geometry': geometria
+            }
+            if i:
+                f.write(',\n')
+            json.dump(feature, f, separators=(',', ':'))
+        f.write('\n]}\n')
+
+    return os.path.getsize(ruta)
+
+
+# ============================================================================
+# MEMORIA DE LA LECTURA DEL GEOJSON
+# ============================================================================
+
+def _centroides_documento_completo(ruta):
+    """Lectura clásica: se carga el documento entero y se calculan los centroides en bloque."""
+    with open(ruta, 'r', encoding='utf-8') as f:
+        geojson_data = json.load(f)
+    return sum(1 for _ in update_weather.iterar_centroides(geojson_data['features']))
+
+
+def _centroides_incremental(ruta):
+    """Lectura incremental: features y centroides fluyen por lotes."""
+    return sum(1 for _ in update_weather.iterar_centroides(update_weather.iterar_features(ruta)))
+
+
+def medir(funcion, *args):
+    """
+    Ejecuta una función midiendo el tiempo y el pico de memoria reservada
+    por Python durante la llamada (con tracemalloc).
+
+    Returns:
+        Tupla (resultado, segundos, pico en bytes)
+    """
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        resultado = funcion(*args)
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resultado, segundos, pico
+
+
+def prueba_memoria(municipios, vertices_por_lado, ruta=None):
+    """Compara el pico de memoria de la lectura completa y la incremental."""
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = ruta or os.path.join(directorio, 'sintetico.geojson')
+        if not os.path.exists(ruta):
+            tamano = generar_geojson_sintetico(ruta, municipios, vertices_por_lado)
+        else:
+            tamano = os.path.getsize(ruta)
+        print(f"📂 GeoJSON sintético: {municipios} municipios, {tamano / 1e6:.1f} MB")
+        print()
+        print(f"{'Lectura':<22}{'Municipios':>12}{'Tiempo':>10}{'Pico memoria':>16}")
+
+        for nombre, funcion in (('Documento completo', _centroides_documento_completo),
+                                ('Incremental', _centroides_incremental)):
+            total, segundos, pico = medir(funcion, ruta)
+            print(f"{nombre:<22}{total:>12}{segundos:>9.2f}s{pico / 1e6:>13.1f} MB")
+
+
+def _decodificar_diccionarios(respuestas):
+    """Decodificación clásica: json.loads y diccionarios anidados completos."""
+    return [json.loads(cuerpo) for cuerpo in respuestas]
+
+
+def _decodificar_registros(respuestas):
+    """Decodificación con esquema.py: backend rápido y registros validados."""
+    return [esquema.ObservacionOWM.desde_respuesta(esquema.decodificar_json(cuerpo)) for cuerpo in respuestas]
+
+
+def prueba_json(municipios):
+    """
+    Compara la decodificación de las respuestas de la API y la codificación
+    de la salida con el módulo json estándar y con esquema.py (con orjson
+    si está instalado).
+    """
+    respuestas = [
+        json.dumps(datos_clima_simulados(40 + n * 1e-3, -3.7 - n * 1e-3)).encode('utf-8')
+        for n in range(municipios)
+    ]
+    print(f"📦 {municipios} respuestas simuladas, {sum(map(len, respuestas)) / 1e6:.1f} MB "
+          f"(backend: {'orjson' if esquema.JSON_RAPIDO else 'json estándar'})")
+    print()
+    print(f"{'Decodificación':<22}{'Tiempo':>10}{'Memoria retenida':>20}")
+    for nombre, funcion in (('Diccionarios', _decodificar_diccionarios), ('Registros', _decodificar_registros)):
+        # El tiempo se mide sin tracemalloc, que ralentiza mucho el código en Python
+        inicio = time.perf_counter()
+        observaciones = funcion(respuestas)
+        segundos = time.perf_counter() - inicio
+        # Memoria que ocupan los resultados mientras se conservan
+        tracemalloc.start()
+        retenidos = funcion(respuestas)
+        retenida, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del retenidos
+        print(f"{nombre:<22}{segundos:>9.3f}s{retenida / 1e6:>17.1f} MB")
+
+    indices = update_weather.obtener_motor_indice().evaluar(observaciones)
+    salida = {
+        'metadata': {'total_municipios': municipios},
+        'municipios': {
+            f"{n:05d}": update_weather.construir_datos_municipio(
+                {'nombre': f"Municipio {n}", 'codigo_ine': f"{n:05d}", 'lat': 40.0, 'lon': -3.7},
+                observacion, indice
+            )
+            for n, (observacion, indice) in enumerate(zip(observaciones, indices))
+        }
+    }
+    print()
+    print(f"{'Codificación':<22}{'Tiempo':>10}{'Tamaño':>20}")
+    for nombre, funcion in (
+        ('json estándar', lambda: json.dumps(salida, ensure_ascii=False, indent=2).encode('utf-8')),
+        ('esquema.py', lambda: esquema.codificar_json(salida, sangria=2)),
+    ):
+        inicio = time.perf_counter()
+        contenido = funcion()
+        segundos = time.perf_counter() - inicio
+        print(f"{nombre:<22}{segundos:>9.3f}s{len(contenido) / 1e6:>17.1f} MB")
+
+
+# ============================================================================
+# SUSTITUTO LOCAL DE LA API DE OPENWEATHERMAP
+# ============================================================================
+
+DISTRIBUCIONES_LATENCIA = ('fija', 'uniforme', 'lognormal')
+CARGAS_RESPUESTA = ('completa', 'minima')
+
+
+def datos_clima_simulados(lat, lon, carga='completa', semilla=0):
+    """
+    Genera una respuesta con el formato de /data/2.5/weather para un punto.
+
+    Los valores dependen solo de las coordenadas y de la semilla, así que
+    un mismo municipio recibe siempre los mismos datos. Están repartidos
+    para que aparezcan todos los niveles y consejos del índice (frío, calor,
+    viento, lluvia y alguna nevada).
+
+    Args:
+        lat, lon: Coordenadas consultadas
+        carga: 'completa' devuelve todos los campos de la API real;
+               'minima' solo los que usa update_weather.py
+        semilla: Cambia los valores generados
+    """
+    azar = random.Random(f"{semilla}:{round(lat, 4)}:{round(lon, 4)}")
+    temp = round(azar.uniform(-5, 40), 2)
+    datos = {
+        'weather': [{'id': 803, 'main': 'Clouds', 'description': 'nubes rotas', 'icon': '04d'}],
+        'main': {
+            'temp': temp,
+            'feels_like': round(temp + azar.uniform(-8, 8), 2),
+            'humidity': azar.randint(15, 100)
+        },
+        'wind': {'speed': round(azar.expovariate(1 / 5), 2)}
+    }
+    precipitacion = azar.random()
+    if precipitacion < 0.02 and temp < 2:
+        datos['snow'] = {'1h': round(azar.uniform(0.1, 3), 2)}
+    elif precipitacion < 0.25:
+        datos['rain'] = {'1h': round(azar.expovariate(1 / 2), 2)}
+
+    if carga == 'completa':
+        ahora = int(time.time())
+        datos['main'].update({
+            'temp_min': round(temp - azar.uniform(0, 2), 2),
+            'temp_max': round(temp + azar.uniform(0, 2), 2),
+            'pressure': azar.randint(995, 1035),
+            'sea_level': azar.randint(995, 1035),
+            'grnd_level': azar.randint(900, 960)
+        })
+        datos['wind'].update({'deg': azar.randint(0, 359), 'gust': round(datos['wind']['speed'] * 1.5, 2)})
+        datos.update({
+            'coord': {'lon': round(lon, 4), 'lat': round(lat, 4)},
+            'base': 'stations',
+            'visibility': 10000,
+            'clouds': {'all': azar.randint(0, 100)},
+            'dt': ahora,
+            'sys': {'type': 2, 'id': 2007545, 'country': 'ES', 'sunrise': ahora - 21600, 'sunset': ahora + 21600},
+            'timezone': 3600,
+            'id': azar.randint(3100000, 3130000),
+            'name': 'Municipio',
+            'cod': 200
+        })
+    return datos
+
+
+# Franjas de la previsión: cada 3 horas, hasta 5 días
+PASO_PREVISION = 3 * 3600
+FRANJAS_PREVISION = 40
+
+
+def prevision_simulada(lat, lon, franjas=FRANJAS_PREVISION, carga='completa', semilla=0):
+    """
+    Genera una respuesta con el formato de /data/2.5/forecast para un punto.
+
+    Como datos_clima_simulados(), los valores dependen solo de las
+    coordenadas y de la semilla (y de la hora de inicio, que es la próxima
+    franja de 3 horas). La temperatura sigue el ciclo del día y cada punto
+    tiene algún episodio de lluvia de unas horas, para que la puntuación
+    cambie a lo largo de la previsión.
+
+    Args:
+        lat, lon: Coordenadas consultadas
+        franjas: Número de franjas (parámetro `cnt` de la API)
+        carga: 'completa' devuelve todos los campos de la API real;
+               'minima' solo los que usa prevision.py
+        semilla: Cambia los valores generados
+    """
+    azar = random.Random(f"{semilla}:prevision:{round(lat, 4)}:{round(lon, 4)}")
+    inicio = (int(time.time()) // PASO_PREVISION + 1) * PASO_PREVISION
+    temp_media = azar.uniform(0, 32)
+    viento = azar.expovariate(1 / 4)
+    lluvia_desde = azar.randrange(max(1, franjas))
+    lluvia_hasta = lluvia_desde + azar.randint(1, 4)
+
+    lista = []
+    for n in range(franjas):
+        dt = inicio + n * PASO_PREVISION
+        hora = (dt // 3600) % 24
+        temp = round(temp_media + 7 * math.sin(2 * math.pi * (hora - 9) / 24) + azar.uniform(-1, 1), 2)
+        viento = max(0.0, viento + azar.uniform(-2, 2))
+        franja = {
+            'dt': dt,
+            'main': {
+                'temp': temp,
+                'feels_like': round(temp + azar.uniform(-4, 4), 2),
+                'humidity': azar.randint(20, 100)
+            },
+            'weather': [{'id': 803, 'main': 'Clouds', 'description': 'nubes rotas', 'icon': '04d'}],
+            'wind': {'speed': round(viento, 2)}
+        }
+        if lluvia_desde <= n < lluvia_hasta:
+            franja['rain'] = {'3h': round(azar.expovariate(1 / 4), 2)}
+            franja['weather'] = [{'id': 500, 'main': 'Rain', 'description': 'lluvia ligera', 'icon': '10d'}]
+        if carga == 'completa':
+            franja['main'].update({'temp_min': temp, 'temp_max': temp, 'pressure': azar.randint(995, 1035)})
+            franja['wind'].update({'deg': azar.randint(0, 359), 'gust': round(viento * 1.5, 2)})
+            franja.update({
+                'clouds': {'all': azar.randint(0, 100)},
+                'visibility': 10000,
+                'pop': 1 if 'rain' in franja else round(azar.uniform(0, 0.3), 2),
+                'sys': {'pod': 'd' if 7 <= hora < 20 else 'n'},
+                'dt_txt': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt))
+            })
+        lista.append(franja)
+
+    datos = {'cod': '200', 'message': 0, 'cnt': franjas, 'list': lista}
+    if carga == 'completa':
+        datos['city'] = {'id': azar.randint(3100000, 3130000), 'name': 'Municipio',
+                         'coord': {'lat': round(lat, 4), 'lon': round(lon, 4)}, 'country': 'ES',
+                         'timezone': 3600}
+    return datos
+
+
+class ServidorOWMSimulado:
+    """
+    Servidor HTTP local que imita los endpoints /data/2.5/weather y
+    /data/2.5/forecast de OpenWeatherMap.
+
+    Cada petición espera una latencia tomada de la distribución elegida y
+    puede fallar con un error 500 (`tasa_error`) o con un 429 con cabecera
+    Retry-After (`tasa_429`), como cuando se supera el cupo del plan. Las
+    respuestas correctas se generan con datos_clima_simulados() y
+    prevision_simulada().
+
+    Se puede usar como gestor de contexto:
+        with ServidorOWMSimulado(latencia_ms=50) as servidor:
+            os.environ['OPENWEATHER_API_BASE'] = servidor.url_base
+    """
+
+    def __init__(self, puerto=0, latencia_ms=50.0, distribucion='lognormal', dispersion=0.5,
+                 tasa_error=0.0, tasa_429=0.0, carga='completa', semilla=0):
+        if distribucion not in DISTRIBUCIONES_LATENCIA:
+            raise ValueError(f"Distribución de latencia no soportada: {distribucion}")
+        if carga not in CARGAS_RESPUESTA:
+            raise ValueError(f"Tipo de respuesta no soportado: {carga}")
+
+        self.latencia_ms = latencia_ms
+        self.distribucion = distribucion
+        self.dispersion = dispersion
+        self.tasa_error = tasa_error
+        self.tasa_429 = tasa_429
+        self.carga = carga
+        self.semilla = semilla
+
+        self.peticiones = 0
+        self.respuestas = {}
+        self._azar = random.Random(semilla)
+        self._cerrojo = threading.Lock()
+        self._hilo = None
+
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                servidor._atender(self)
+
+        self._http = ThreadingHTTPServer(('127.0.0.1', puerto), Manejador)
+        self._http.daemon_threads = True
+
+    @property
+    def puerto(self):
+        return self._http.server_address[1]
+
+    @property
+    def url_base(self):
+        """Valor para OPENWEATHER_API_BASE."""
+        return f"http://127.0.0.1:{self.puerto}/data/2.5"
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *args):
+        self.detener()
+
+    def iniciar(self, en_segundo_plano=True):
+        """Empieza a atender peticiones (en un hilo aparte o en el actual)."""
+        if not en_segundo_plano:
+            self._http.serve_forever()
+            return
+        self._hilo = threading.Thread(target=self._http.serve_forever, daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+    def reiniciar_contadores(self):
+        with self._cerrojo:
+            self.peticiones = 0
+            self.respuestas = {}
+
+    def _sortear(self):
+        """Devuelve la latencia (en segundos) y el sorteo de error de una petición."""
+        with self._cerrojo:
+            self.peticiones += 1
+            if self.distribucion == 'fija':
+                latencia = self.latencia_ms
+            elif self.distribucion == 'uniforme':
+                latencia = self._azar.uniform(0, 2 * self.latencia_ms)
+            else:
+                # Lognormal con mediana latencia_ms: la mayoría de peticiones
+                # son rápidas y unas pocas tardan mucho más
+                latencia = self.latencia_ms * math.exp(self._azar.gauss(0, self.dispersion))
+            return latencia / 1000, self._azar.random()
+
+    def _responder(self, manejador, codigo, cuerpo=b'', cabeceras=()):
+        with self._cerrojo:
+            self.respuestas[codigo] = self.respuestas.get(codigo, 0) + 1
+        manejador.send_response(codigo)
+        for nombre, valor in cabeceras:
+            manejador.send_header(nombre, valor)
+        manejador.send_header('Content-Length', str(len(cuerpo)))
+        manejador.end_headers()
+        manejador.wfile.write(cuerpo)
+
+    def _atender(self, manejador):
+        url = urlparse(manejador.path)
+        if url.path not in ('/data/2.5/weather', '/data/2.5/forecast'):
+            self._responder(manejador, 404, b'{"cod":"404","message":"Not found"}')
+            return
+
+        latencia, sorteo = self._sortear()
+        time.sleep(latencia)
+
+        if sorteo < self.tasa_429:
+            self._responder(manejador, 429, b'{"cod":429,"message":"Too many requests"}', [('Retry-After', '1')])
+            return
+        if sorteo < self.tasa_429 + self.tasa_error:
+            self._responder(manejador, 500, b'{"cod":500,"message":"Internal error"}')
+            return
+
+        try:
+            consulta = parse_qs(url.query)
+            lat = float(consulta['lat'][0])
+            lon = float(consulta['lon'][0])
+            franjas = min(int(consulta.get('cnt', [FRANJAS_PREVISION])[0]), FRANJAS_PREVISION)
+        except (KeyError, ValueError):
+            self._responder(manejador, 400, b'{"cod":"400","message":"wrong latitude"}')
+            return
+
+        if url.path.endswith('/forecast'):
+            datos = prevision_simulada(lat, lon, franjas, self.carga, self.semilla)
+        else:
+            datos = datos_clima_simulados(lat, lon, self.carga, self.semilla)
+        cuerpo = json.dumps(datos).encode('utf-8')
+        self._responder(manejador, 200, cuerpo, [('Content-Type', 'application/json; charset=utf-8')])
+
+
+# ============================================================================
+# PRUEBA DE EXTREMO A EXTREMO
+# ============================================================================
+
+# Tamaños por defecto: la Comunidad de Madrid, una región grande y España
+TAMANOS_EXTREMO = (179, 1000, 8000)
+
+# Archivos de salida cuyo tamaño se mide
+ARCHIVOS_SALIDA = (
+    update_weather.OUTPUT_FILE,
+    update_weather.OUTPUT_FILE_COLUMNAR,
+    f"{update_weather.OUTPUT_FILE_COLUMNAR}.gz",
+    *(nivel['archivo'] for nivel in update_weather.GEOMETRIA_NIVELES),
+    update_weather.CENTROIDES_FILE
+)
+
+
+def ejecutar_actualizacion(directorio, entorno):
+    """
+    Ejecuta update_weather.py en un proceso aparte dentro de `directorio`.
+
+    Returns:
+        Tupla (segundos, pico de memoria residente en bytes, código de salida)
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(update_weather.__file__)), 'update_weather.py')
+    inicio = time.perf_counter()
+    with open(os.path.join(directorio, 'salida.log'), 'wb') as registro:
+        proceso = subprocess.Popen([sys.executable, script], cwd=directorio, env=entorno,
+                                   stdout=registro, stderr=subprocess.STDOUT)
+        # wait4 devuelve el consumo de recursos de este proceso en concreto
+        _, estado, recursos = os.wait4(proceso.pid, 0)
+        proceso.returncode = os.waitstatus_to_exitcode(estado)
+    segundos = time.perf_counter() - inicio
+    # ru_maxrss está en KB en Linux
+    return segundos, recursos.ru_maxrss * 1024, proceso.returncode
+
+
+def prueba_extremo(tamanos, servidor, concurrencia, vertices_por_lado=10):
+    """
+    Mide el proceso completo (lectura, consultas, puntuación y escritura)
+    con GeoJSON sintéticos de varios tamaños contra el servidor simulado.
+
+    Cada tamaño se ejecuta dos veces: la primera genera la geometría y el
+    índice de centroides (ejecución inicial) y la segunda los reutiliza,
+    como ocurre en las ejecuciones programadas (ejecución recurrente).
+
+    Returns:
+        Lista de diccionarios con los resultados de cada ejecución
+    """
+    entorno = dict(os.environ)
+    entorno.update({
+        'OPENWEATHER_API_KEY': 'benchmark',
+        'OPENWEATHER_API_BASE': servidor.url_base,
+        'OPENWEATHER_PETICIONES_POR_MINUTO': '1000000',
+        'OPENWEATHER_CONCURRENCIA': str(concurrencia),
+        'OPENWEATHER_CACHE_TTL': '0',
+        'HISTORICO_ACTIVO': '0',
+        'FORZAR_ESCRITURA': '1'
+    })
+
+    resultados = []
+    for tamano in tamanos:
+        with tempfile.TemporaryDirectory() as directorio:
+            os.makedirs(os.path.join(directorio, 'data'))
+            generar_geojson_sintetico(os.path.join(directorio, update_weather.GEOJSON_FILE),
+                                      tamano, vertices_por_lado)
+
+            for ejecucion in ('inicial', 'recurrente'):
+                servidor.reiniciar_contadores()
+                segundos, memoria, codigo = ejecutar_actualizacion(directorio, entorno)
+                if codigo != 0:
+                    with open(os.path.join(directorio, 'salida.log'), encoding='utf-8', errors='replace') as f:
+                        print(f.read()[-2000:])
+                    raise RuntimeError(f"update_weather.py terminó con código {codigo} ({tamano} municipios)")
+
+                tamano_salida = sum(
+                    os.path.getsize(os.path.join(directorio, archivo))
+                    for archivo in ARCHIVOS_SALIDA if os.path.exists(os.path.join(directorio, archivo))
+                )
+                try:
+                    with open(os.path.join(directorio, update_weather.METRICAS_FILE), encoding='utf-8') as f:
+                        metricas = json.load(f)
+                except (OSError, ValueError):
+                    metricas = None
+
+                resultado = {
+                    'municipios': tamano,
+                    'ejecucion': ejecucion,
+                    'segundos': round(segundos, 3),
+                    'peticiones': servidor.peticiones,
+                    'peticiones_por_segundo': round(servidor.peticiones / segundos, 1),
+                    'respuestas': dict(sorted(servidor.respuestas.items())),
+                    'memoria_maxima_mb': round(memoria / 1e6, 1),
+                    'tamano_salida_kb': round(tamano_salida / 1024, 1)
+                }
+                if metricas is not None:
+                    # Desglose de la propia ejecución (ver metricas.py)
+                    resultado['latencia_ms'] = metricas['peticiones']['latencia_ms']
+                    resultado['fases_segundos'] = metricas['fases_segundos']
+                resultados.append(resultado)
+                print(f"{tamano:>10}  {ejecucion:<11}{resultado['segundos']:>9.2f}s"
+                      f"{resultado['peticiones_por_segundo']:>10.1f}{resultado['memoria_maxima_mb']:>11.1f} MB"
+                      f"{resultado['tamano_salida_kb']:>12.1f} KB")
+    return resultados
+
+
+def comparar_con_referencia(resultados, referencia, tolerancia):
+    """
+    Compara el tiempo y la memoria de cada ejecución con una referencia
+    guardada con --json.
+
+    Returns:
+        Lista de textos describiendo las regresiones (vacía si no hay ninguna)
+    """
+    anteriores = {(r['municipios'], r['ejecucion']): r for r in referencia['resultados']}
+    regresiones = []
+    for resultado in resultados:
+        anterior = anteriores.get((resultado['municipios'], resultado['ejecucion']))
+        if anterior is None:
+            continue
+        for campo in ('segundos', 'memoria_maxima_mb', 'tamano_salida_kb'):
+            if anterior[campo] and resultado[campo] > anterior[campo] * (1 + tolerancia):
+                regresiones.append(
+                    f"{resultado['municipios']} municipios ({resultado['ejecucion']}): {campo} "
+                    f"{anterior[campo]} -> {resultado[campo]}"
+                )
+    return regresiones
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Pruebas de rendimiento con datos sintéticos')
+    subparsers = parser.add_subparsers(dest='prueba', required=True)
+
+    generar = subparsers.add_parser('generar', help='Genera un GeoJSON sintético')
+    generar.add_argument('ruta')
+    generar.add_argument('--municipios', type=int, default=8100)
+    generar.add_argument('--vertices', type=int, default=25, help='Vértices por lado de cada municipio')
+
+    memoria = subparsers.add_parser('memoria', help='Pico de memoria al leer el GeoJSON')
+    memoria.add_argument('--municipios', type=int, default=8100)
+    memoria.add_argument('--vertices', type=int, default=25, help='Vértices por lado de cada municipio')
+    memoria.add_argument('--geojson', help='Usar este archivo en lugar de generar uno')
+
+    prueba_json_parser = subparsers.add_parser('json', help='Decodificación de respuestas y codificación de la salida')
+    prueba_json_parser.add_argument('--municipios', type=int, default=8100)
+
+    def opciones_servidor(subparser):
+        subparser.add_argument('--latencia', type=float, default=50, help='Latencia media en milisegundos')
+        subparser.add_argument('--distribucion', choices=DISTRIBUCIONES_LATENCIA, default='lognormal')
+        subparser.add_argument('--dispersion', type=float, default=0.5, help='Sigma de la distribución lognormal')
+        subparser.add_argument('--tasa-error', type=float, default=0.0, help='Fracción de respuestas 500')
+        subparser.add_argument('--tasa-429', type=float, default=0.0, help='Fracción de respuestas 429')
+        subparser.add_argument('--carga', choices=CARGAS_RESPUESTA, default='completa')
+        subparser.add_argument('--semilla', type=int, default=0)
+
+    servidor = subparsers.add_parser('servidor', help='Arranca el sustituto local de la API')
+    servidor.add_argument('--puerto', type=int, default=8765)
+    opciones_servidor(servidor)
+
+    extremo = subparsers.add_parser('extremo', help='Proceso completo contra el sustituto local de la API')
+    extremo.add_argument('--tamanos', type=int, nargs='+', default=list(TAMANOS_EXTREMO))
+    extremo.add_argument('--concurrencia', type=int, default=update_weather.PETICIONES_CONCURRENTES)
+    extremo.add_argument('--vertices', type=int, default=10, help='Vértices por lado de cada municipio')
+    extremo.add_argument('--json', help='Guardar los resultados en este archivo')
+    extremo.add_argument('--referencia', help='Comparar con los resultados guardados en este archivo')
+    extremo.add_argument('--tolerancia', type=float, default=0.2,
+                         help='Empeoramiento máximo respecto a la referencia (0.2 = 20%%)')
+    opciones_servidor(extremo)
+
+    args = parser.parse_args()
+
+    if args.prueba == 'generar':
+        tamano = generar_geojson_sintetico(args.ruta, args.municipios, args.vertices)
+        print(f"✅ {args.ruta}: {args.municipios} municipios, {tamano / 1e6:.1f} MB")
+    elif args.prueba == 'memoria':
+        if args.geojson and not os.path.exists(args.geojson):
+            print(f"❌ ERROR: No se encontró el archivo {args.geojson}")
+            sys.exit(1)
+        prueba_memoria(args.municipios, args.vertices, args.geojson)
+    elif args.prueba == 'json':
+        prueba_json(args.municipios)
+    else:
+        opciones = dict(latencia_ms=args.latencia, distribucion=args.distribucion, dispersion=args.dispersion,
+                        tasa_error=args.tasa_error, tasa_429=args.tasa_429, carga=args.carga,
+                        semilla=args.semilla)
+
+        if args.prueba == 'servidor':
+            servidor = ServidorOWMSimulado(args.puerto, **opciones)
+            print(f"🌐 API simulada en {servidor.url_base} (Ctrl+C para terminar)")
+            try:
+                servidor.iniciar(en_segundo_plano=False)
+            except KeyboardInterrupt:
+                servidor.detener()
+            return
+
+        referencia = None
+        if args.referencia:
+            try:
+                with open(args.referencia, 'r', encoding='utf-8') as f:
+                    referencia = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"❌ ERROR: No se pudo leer la referencia {args.referencia}: {e}")
+                sys.exit(1)
+
+        print(f"{'Municipios':>10}  {'Ejecución':<11}{'Tiempo':>10}{'Pet./s':>10}{'Memoria':>14}{'Salida':>15}")
+        with ServidorOWMSimulado(**opciones) as servidor:
+            resultados = prueba_extremo(args.tamanos, servidor, args.concurrencia, args.vertices)
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'servidor': opciones, 'concurrencia': args.concurrencia,
+                           'resultados': resultados}, f, ensure_ascii=False, indent=2)
+            print(f"✅ Resultados guardados en: {args.json}")
+
+        if referencia is not None:
+            regresiones = comparar_con_referencia(resultados, referencia, args.tolerancia)
+            if regresiones:
+                print(f"❌ Regresiones respecto a {args.referencia}:")
+                for regresion in regresiones:
+                    print(f"   {regresion}")
+                sys.exit(1)
+            print(f"✅ Sin regresiones respecto a {args.referencia}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Esquema de las respuestas de OpenWeatherMap y codificación JSON.
+
+Cada respuesta de la API se valida una sola vez al recibirla y se reduce a
+un registro ObservacionOWM con los ocho campos que usa el índice, en lugar
+de conservar el diccionario anidado completo (coordenadas, nubes, sistema,
+etc.) y de volver a recorrerlo en cada paso. Una respuesta con una forma
+inesperada se rechaza en ese momento con RespuestaInvalida y cuenta como
+municipio con error, sin llegar a la puntuación ni a la caché.
+
+La lectura y escritura de JSON usa orjson si está instalado, que es varias
+veces más rápido que el módulo json estándar, y este en caso contrario
+(JSON_RAPIDO=0 fuerza el módulo estándar). Los documentos de las dos
+variantes son equivalentes al decodificarlos, pero no siempre tienen los
+mismos bytes: orjson escribe algunos números de otra forma (0.00001 en vez
+de 1e-05, 1e16 en vez de 1e+16) y NaN o infinito como null, y no admite
+NaN al leer. Las salidas del proyecto no contienen valores no finitos, y
+las que deben ser estables byte a byte (la geometría) usan siempre el
+módulo estándar.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import json
+import math
+import os
+
+try:
+    import orjson
+except ImportError:  # El backend orjson es opcional
+    orjson = None
+
+
+JSON_RAPIDO = orjson is not None and os.environ.get('JSON_RAPIDO', '1') == '1'
+
+
+# ============================================================================
+# CODIFICACIÓN JSON
+# ============================================================================
+
+def decodificar_json(contenido):
+    """Decodifica un documento JSON a partir de bytes o de un str."""
+    if JSON_RAPIDO:
+        return orjson.loads(contenido)
+    return json.loads(contenido)
+
+
+def leer_json(ruta):
+    """Lee y decodifica un archivo JSON."""
+    with open(ruta, 'rb') as f:
+        return decodificar_json(f.read())
+
+
+def codificar_json(valor, sangria=None):
+    """
+    Codifica un valor como JSON en UTF-8.
+
+    Args:
+        valor: Valor a codificar
+        sangria: None para la salida minificada o el número de espacios de
+                 sangría (orjson solo admite 2; con otro valor se usa el
+                 módulo estándar)
+
+    Returns:
+        Bytes con el documento, equivalente al de
+        json.dumps(valor, ensure_ascii=False, ...) (ver la nota sobre
+        orjson al principio del módulo)
+    """
+    if JSON_RAPIDO and sangria in (None, 2):
+        try:
+            return orjson.dumps(valor, option=orjson.OPT_INDENT_2 if sangria else 0)
+        except TypeError:
+            pass  # Claves no str o enteros enormes: el módulo estándar sí los admite
+    separadores = (',', ':') if sangria is None else None
+    return json.dumps(valor, ensure_ascii=False, indent=sangria, separators=separadores).encode('utf-8')
+
+
+def codificar_json_en_flujo(documento, sangria=2):
+    """
+    Codifica un diccionario como JSON con sangría en bloques: uno por cada
+    entrada de los diccionarios de primer nivel (por ejemplo, uno por
+    municipio), para escribirlo a medida que se genera.
+
+    Returns:
+        Generador de bytes cuya concatenación es igual a
+        codificar_json(documento, sangria)
+    """
+    if not documento:
+        yield b'{}'
+        return
+
+    espacios = b' ' * sangria
+
+    def valor_sangrado(valor, nivel):
+        # Las cadenas JSON no contienen saltos de línea sin escapar, así que
+        # sangrar cada línea del valor codificado es seguro
+        return codificar_json(valor, sangria).replace(b'\n', b'\n' + espacios * nivel)
+
+    for n, (clave, valor) in enumerate(documento.items()):
+        yield (b',\n' if n else b'{\n') + espacios + codificar_json(clave) + b': '
+        if isinstance(valor, dict) and valor:
+            for m, (subclave, subvalor) in enumerate(valor.items()):
+                yield ((b',\n' if m else b'{\n') + espacios * 2 + codificar_json(subclave) + b': '
+                       + valor_sangrado(subvalor, 2))
+            yield b'\n' + espacios + b'}'
+        else:
+            yield valor_sangrado(valor, 1)
+    yield b'\n}'
+
+
+# ============================================================================
+# RESPUESTAS DE OPENWEATHERMAP
+# ============================================================================
+
+class RespuestaInvalida(ValueError):
+    """La respuesta de la API no tiene la forma esperada."""
+
+
+def _numero(valor, campo):
+    # bool es subclase de int, pero un true en la temperatura es un error
+    if (type(valor) is not float and type(valor) is not int) or not math.isfinite(valor):
+        raise RespuestaInvalida(f"{campo} no es un número: {valor!r}")
+    return valor
+
+
+def _precipitacion(grupo, periodo, horas, campo):
+    """Precipitación en mm/h de un grupo `rain` o `snow` (0 si no está)."""
+    if grupo is None:
+        return 0
+    if not isinstance(grupo, dict):
+        raise RespuestaInvalida(f"{campo} no es un objeto: {grupo!r}")
+    valor = grupo.get(periodo)
+    if valor is None:
+        return 0
+    valor = _numero(valor, f"{campo}.{periodo}")
+    return valor / horas if horas != 1 else valor
+
+
+class ObservacionOWM:
+    """
+    Condiciones meteorológicas de un punto, validadas.
+
+    Los valores se guardan tal como llegan de la API (sin convertir enteros
+    a float) para que la salida no cambie; solo la precipitación se expresa
+    siempre en mm/h.
+
+    Atributos:
+        temp, sensacion: Temperatura y sensación térmica en °C
+        humedad: Humedad relativa en %
+        viento: Velocidad del viento en m/s (como la API)
+        lluvia, nieve: Precipitación en mm/h (0 si no hay)
+        descripcion, icono: Descripción en español y código de icono
+    """
+
+    __slots__ = ('temp', 'sensacion', 'humedad', 'viento', 'lluvia', 'nieve', 'descripcion', 'icono')
+
+    def __init__(self, temp, sensacion, humedad, viento, lluvia=0, nieve=0, descripcion='', icono=''):
+        self.temp = temp
+        self.sensacion = sensacion
+        self.humedad = humedad
+        self.viento = viento
+        self.lluvia = lluvia
+        self.nieve = nieve
+        self.descripcion = descripcion
+        self.icono = icono
+
+    @classmethod
+    def desde_respuesta(cls, datos, periodo_precipitacion='1h'):
+        """
+        Valida una respuesta de /weather (o una franja de /forecast) y crea
+        el registro.
+
+        Args:
+            datos: Respuesta JSON decodificada
+            periodo_precipitacion: Campo de lluvia y nieve que se lee: '1h'
+                                   en las condiciones actuales, '3h' en las
+                                   franjas de la previsión
+
+        Raises:
+            RespuestaInvalida: Si falta algún campo o no tiene el tipo esperado
+        """
+        try:
+            principal = datos['main']
+            tiempo = datos['weather'][0]
+            temp = principal['temp']
+            sensacion = principal['feels_like']
+            humedad = principal['humidity']
+            viento = datos['wind']['speed']
+            descripcion = tiempo['description']
+            icono = tiempo['icon']
+        except KeyError as e:
+            raise RespuestaInvalida(f"falta el campo {e}") from None
+        except (IndexError, TypeError):
+            raise RespuestaInvalida("estructura inesperada") from None
+
+        if not isinstance(descripcion, str) or not isinstance(icono, str):
+            raise RespuestaInvalida("weather.description y weather.icon deben ser texto")
+        horas = int(periodo_precipitacion.rstrip('h'))
+        return cls(
+            _numero(temp, 'main.temp'),
+            _numero(sensacion, 'main.feels_like'),
+            _numero(humedad, 'main.humidity'),
+            _numero(viento, 'wind.speed'),
+            _precipitacion(datos.get('rain'), periodo_precipitacion, horas, 'rain'),
+            _precipitacion(datos.get('snow'), periodo_precipitacion, horas, 'snow'),
+            descripcion,
+            icono
+        )
+
+    @classmethod
+    def desde_valor(cls, valor):
+        """Devuelve `valor` si ya es un registro y, si no, lo valida como respuesta."""
+        if type(valor) is cls:
+            return valor
+        return cls.desde_respuesta(valor)
+
+    def a_respuesta(self):
+        """
+        Diccionario con la forma de una respuesta de /weather, solo con los
+        campos del registro (para guardarlo en la caché en disco).
+        """
+        datos = {
+            'main': {'temp': self.temp, 'feels_like': self.sensacion, 'humidity': self.humedad},
+            'wind': {'speed': self.viento},
+            'weather': [{'description': self.descripcion, 'icon': self.icono}]
+        }
+        if self.lluvia:
+            datos['rain'] = {'1h': self.lluvia}
+        if self.nieve:
+            datos['snow'] = {'1h': self.nieve}
+        return datos
+
+    def __eq__(self, otro):
+        if type(otro) is not type(self):
+            return NotImplemented
+        return all(getattr(self, campo) == getattr(otro, campo) for campo in self.__slots__)
+
+    # Los atributos se pueden modificar, así que el registro no es hashable
+    __hash__ = None
+
+    def __repr__(self):
+        campos = ', '.join(f"{campo}={getattr(self, campo)!r}" for campo in self.__slots__)
+        return f"ObservacionOWM({campos})"
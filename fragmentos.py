@@ -0,0 +1,395 @@
+"""
+Ejecución fragmentada de la actualización meteorológica en varios procesos.
+
+update_weather.py procesa todos los municipios en un único proceso. Con
+muchos municipios (varias provincias o toda España) el tiempo de CPU de
+puntuar y serializar crece con el total, así que este módulo reparte los
+municipios en fragmentos, por provincia (según el NATCODE) o por hash de su
+código, y procesa cada fragmento en un proceso distinto con su parte del
+cupo de peticiones por minuto de la API.
+
+Cada fragmento escribe su propio resultado en data/fragmentos/ y un
+manifiesto registra el estado de todos ellos. Cuando todos han terminado,
+el paso de fusión reúne sus resultados en el orden original de los
+municipios y genera los mismos archivos de salida que la ejecución normal.
+Si un fragmento falla, se puede reintentar solo ese fragmento.
+
+Uso desde la línea de comandos:
+    python fragmentos.py ejecutar --modo provincia --procesos 4
+    python fragmentos.py ejecutar --modo hash --fragmentos 16
+    python fragmentos.py reintentar
+    python fragmentos.py fusionar
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import esquema as esquema_mod
+import metricas as metricas_mod
+import update_weather as uw
+
+
+# Directorio de los resultados de cada fragmento y del manifiesto (no se
+# versionan en git)
+FRAGMENTOS_DIR = os.environ.get('FRAGMENTOS_DIR', 'data/fragmentos')
+MANIFIESTO_FILE = os.path.join(FRAGMENTOS_DIR, 'manifiesto.json')
+VERSION_MANIFIESTO = 1
+
+# Número de procesos simultáneos (por defecto, uno por núcleo)
+FRAGMENTOS_PROCESOS = int(os.environ.get('FRAGMENTOS_PROCESOS', os.cpu_count() or 1))
+
+MODOS_FRAGMENTACION = ('provincia', 'hash')
+
+
+# ============================================================================
+# REPARTO DE MUNICIPIOS EN FRAGMENTOS
+# ============================================================================
+
+def clave_fragmento(clave, modo='provincia', numero=8):
+    """
+    Devuelve el identificador del fragmento al que pertenece un municipio.
+
+    Args:
+        clave: Clave del municipio (su NATCODE, o `sin-codigo-N`)
+        modo: 'provincia' agrupa por el código de provincia del NATCODE
+              (34 + comunidad + provincia + código INE); 'hash' reparte de
+              forma uniforme en `numero` fragmentos
+        numero: Número de fragmentos en el modo 'hash'
+    """
+    if modo == 'provincia':
+        if len(clave) == 11 and clave.isdigit():
+            return clave[4:6]
+        return 'otros'
+    resumen = hashlib.sha1(clave.encode('utf-8')).digest()
+    return f"{int.from_bytes(resumen[:4], 'big') % numero:03d}"
+
+
+def planificar_fragmentos(municipios, modo='provincia', numero=8):
+    """
+    Reparte las entradas del índice de centroides en fragmentos.
+
+    Cada entrada se copia con su clave de municipio calculada a partir de
+    su posición en el GeoJSON, de modo que el resultado es el mismo que en
+    la ejecución no fragmentada.
+
+    Returns:
+        Diccionario {identificador: lista de entradas}, ordenado por identificador
+    """
+    fragmentos = {}
+    for indice, municipio in enumerate(municipios):
+        clave = uw.clave_municipio(municipio['codigo_ine'], indice)
+        identificador = clave_fragmento(clave, modo, numero)
+        fragmentos.setdefault(identificador, []).append(dict(municipio, clave=clave))
+    return dict(sorted(fragmentos.items()))
+
+
+def ruta_fragmento(identificador, directorio=FRAGMENTOS_DIR):
+    return os.path.join(directorio, f"fragmento_{identificador}.json")
+
+
+def ruta_cache_fragmento(identificador):
+    """Cada fragmento tiene su propia caché para que los procesos no se pisen."""
+    base, extension = os.path.splitext(uw.CACHE_FILE)
+    return f"{base}.{identificador}{extension}"
+
+
+# ============================================================================
+# PROCESAMIENTO DE UN FRAGMENTO (EN UN PROCESO DEL GRUPO)
+# ============================================================================
+
+def procesar_fragmento(identificador, municipios, peticiones_por_minuto, concurrencia,
+                       directorio=FRAGMENTOS_DIR):
+    """
+    Consulta y puntúa los municipios de un fragmento y guarda su resultado.
+
+    Se ejecuta en un proceso del grupo, con su propio limitador de tasa
+    (con la parte del cupo que le corresponde), su propia caché y su
+    propia sesión HTTP.
+
+    Returns:
+        Diccionario con el resumen del fragmento para el manifiesto
+    """
+    inicio = time.monotonic()
+    # Los procesos del grupo se reutilizan entre fragmentos
+    uw.metricas_ejecucion.reiniciar()
+    limitador = uw.LimitadorTasa(peticiones_por_minuto, uw.RAFAGA_PETICIONES)
+    cache = uw.crear_cache(ruta_cache_fragmento(identificador))
+
+    resultado = uw.consultar_municipios(municipios, limitador, cache, len(municipios),
+                                        concurrencia=concurrencia, detallado=False)
+    uw.guardar_cache(cache)
+
+    contenido = esquema_mod.codificar_json({
+        'fragmento': identificador,
+        'procesados': resultado['procesados'],
+        'errores': resultado['errores'],
+        'observaciones': resultado['observaciones']
+    })
+
+    ruta = ruta_fragmento(identificador, directorio)
+    uw._escribir_atomico(ruta, contenido)
+
+    return {
+        'archivo': os.path.basename(ruta),
+        'sha256': hashlib.sha256(contenido).hexdigest(),
+        'procesados': len(resultado['procesados']),
+        'errores': len(resultado['errores']),
+        'duracion_segundos': round(time.monotonic() - inicio, 2),
+        'metricas': uw.metricas_ejecucion.resumen()
+    }
+
+
+# ============================================================================
+# MANIFIESTO
+# ============================================================================
+
+def nuevo_manifiesto(hash_geojson, modo, numero, fragmentos):
+    return {
+        'version': VERSION_MANIFIESTO,
+        'hash_geojson': hash_geojson,
+        'modo': modo,
+        'numero': numero,
+        'creado': datetime.now().isoformat(),
+        'fragmentos': {
+            identificador: {'estado': 'pendiente', 'intentos': 0, 'municipios': len(municipios)}
+            for identificador, municipios in fragmentos.items()
+        }
+    }
+
+
+def leer_manifiesto(ruta=MANIFIESTO_FILE):
+    """Devuelve el manifiesto de la última ejecución fragmentada, o None si no existe."""
+    try:
+        manifiesto = esquema_mod.leer_json(ruta)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifiesto, dict) or manifiesto.get('version') != VERSION_MANIFIESTO:
+        return None
+    return manifiesto
+
+
+def guardar_manifiesto(manifiesto, ruta=MANIFIESTO_FILE):
+    uw._escribir_atomico(ruta, esquema_mod.codificar_json(manifiesto, sangria=2))
+
+
+def limpiar_fragmentos(directorio=FRAGMENTOS_DIR):
+    """Borra los resultados de una ejecución fragmentada anterior."""
+    os.makedirs(directorio, exist_ok=True)
+    for nombre in os.listdir(directorio):
+        if nombre.startswith('fragmento_') and nombre.endswith('.json'):
+            os.remove(os.path.join(directorio, nombre))
+
+
+def fragmentos_pendientes(manifiesto, con_errores=False):
+    """Identificadores de los fragmentos que no han terminado (o que tuvieron errores)."""
+    return [
+        identificador for identificador, fragmento in manifiesto['fragmentos'].items()
+        if fragmento['estado'] != 'completado' or (con_errores and fragmento.get('errores'))
+    ]
+
+
+# ============================================================================
+# EJECUCIÓN Y FUSIÓN
+# ============================================================================
+
+def ejecutar_fragmentos(fragmentos, manifiesto, procesos=FRAGMENTOS_PROCESOS,
+                        directorio=FRAGMENTOS_DIR, ruta_manifiesto=MANIFIESTO_FILE):
+    """
+    Procesa los fragmentos dados en un grupo de procesos, actualizando el
+    manifiesto a medida que cada uno termina.
+
+    El cupo de peticiones por minuto y la concurrencia se reparten a partes
+    iguales entre los procesos que se ejecutan a la vez, así que el total
+    nunca supera el de la ejecución normal.
+
+    Returns:
+        Lista de identificadores de los fragmentos que han fallado
+    """
+    procesos = max(1, min(procesos, len(fragmentos)))
+    peticiones_por_minuto = max(1, uw.PETICIONES_POR_MINUTO // procesos)
+    concurrencia = max(1, uw.PETICIONES_CONCURRENTES // procesos)
+    os.makedirs(directorio, exist_ok=True)
+
+    print(f"🧩 {len(fragmentos)} fragmentos en {procesos} procesos "
+          f"({peticiones_por_minuto} peticiones/minuto y {concurrencia} simultáneas por proceso)")
+
+    fallidos = []
+    with ProcessPoolExecutor(max_workers=procesos) as grupo:
+        futuros = {
+            grupo.submit(procesar_fragmento, identificador, municipios,
+                         peticiones_por_minuto, concurrencia, directorio): identificador
+            for identificador, municipios in fragmentos.items()
+        }
+        for futuro in as_completed(futuros):
+            identificador = futuros[futuro]
+            fragmento = manifiesto['fragmentos'][identificador]
+            fragmento['intentos'] += 1
+            try:
+                fragmento.update(futuro.result())
+                fragmento['estado'] = 'completado'
+                fragmento.pop('error', None)
+                print(f"   ✓ Fragmento {identificador}: {fragmento['procesados']} municipios, "
+                      f"{fragmento['errores']} errores ({fragmento['duracion_segundos']} s)")
+            except Exception as e:
+                fragmento['estado'] = 'fallido'
+                fragmento['error'] = str(e)
+                fallidos.append(identificador)
+                print(f"   ✗ Fragmento {identificador}: {e}")
+            guardar_manifiesto(manifiesto, ruta_manifiesto)
+
+    return fallidos
+
+
+def fusionar_fragmentos(manifiesto, municipios, directorio=FRAGMENTOS_DIR, parcial=False):
+    """
+    Reúne los resultados de los fragmentos en el orden original de los
+    municipios.
+
+    Args:
+        manifiesto: Manifiesto de la ejecución fragmentada
+        municipios: Entradas del índice de centroides, en el orden del GeoJSON
+        directorio: Directorio de los resultados de los fragmentos
+        parcial: Si es True, los municipios de fragmentos sin completar se
+                 cuentan como errores en lugar de impedir la fusión
+
+    Returns:
+        Diccionario con el mismo formato que uw.consultar_municipios()
+
+    Raises:
+        ValueError: Si falta algún fragmento (y no se pide una fusión
+                    parcial) o su archivo no coincide con el manifiesto
+    """
+    pendientes = fragmentos_pendientes(manifiesto)
+    if pendientes and not parcial:
+        raise ValueError(f"Hay fragmentos sin completar: {', '.join(pendientes)}")
+
+    procesados = {}
+    errores = {}
+    observaciones = {}
+    for identificador, fragmento in manifiesto['fragmentos'].items():
+        if fragmento['estado'] != 'completado':
+            continue
+        with open(os.path.join(directorio, fragmento['archivo']), 'rb') as f:
+            contenido = f.read()
+        if hashlib.sha256(contenido).hexdigest() != fragmento['sha256']:
+            raise ValueError(f"El resultado del fragmento {identificador} no coincide con el manifiesto")
+        datos = esquema_mod.decodificar_json(contenido)
+        procesados.update(datos['procesados'])
+        errores.update(datos['errores'])
+        observaciones.update((obs['codigo_ine'], obs) for obs in datos['observaciones'])
+
+    resultado = {'procesados': {}, 'errores': {}, 'observaciones': [], 'informe_rejilla': None}
+    for indice, municipio in enumerate(municipios):
+        clave = uw.clave_municipio(municipio['codigo_ine'], indice)
+        if clave in procesados:
+            resultado['procesados'][clave] = procesados[clave]
+            resultado['observaciones'].append(observaciones[clave])
+        else:
+            resultado['errores'][clave] = errores.get(clave, municipio['nombre'])
+    return resultado
+
+
+def _cargar_indice():
+    """Prepara el índice de centroides completo (regenerándolo si hace falta)."""
+    hash_geojson, municipios, _, indice_nuevo = uw.preparar_municipios()
+    if indice_nuevo is not None:
+        municipios = list(municipios)
+        uw.guardar_indice_centroides(municipios, hash_geojson)
+    return hash_geojson, municipios
+
+
+def _fusionar_y_guardar(manifiesto, municipios, parcial=False):
+    try:
+        resultado = fusionar_fragmentos(manifiesto, municipios, parcial=parcial)
+    except (OSError, ValueError) as e:
+        print(f"❌ ERROR al fusionar los fragmentos: {e}")
+        sys.exit(1)
+    if uw.guardar_resultados(resultado) is None:
+        sys.exit(1)
+    # Las consultas se hicieron en los procesos del grupo: sus métricas están
+    # en el manifiesto y se combinan con las de la fusión
+    metricas = metricas_mod.combinar_resumenes(
+        [uw.metricas_ejecucion.resumen()]
+        + [fragmento['metricas'] for fragmento in manifiesto['fragmentos'].values()
+           if fragmento['estado'] == 'completado' and 'metricas' in fragmento]
+    )
+    uw.mostrar_resumen(resultado, metricas=metricas)
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Actualización meteorológica repartida en varios procesos')
+    subparsers = parser.add_subparsers(dest='accion', required=True)
+
+    ejecutar = subparsers.add_parser('ejecutar', help='Reparte los municipios y procesa todos los fragmentos')
+    ejecutar.add_argument('--modo', choices=MODOS_FRAGMENTACION, default='provincia')
+    ejecutar.add_argument('--fragmentos', type=int, default=8, help='Número de fragmentos en el modo hash')
+    ejecutar.add_argument('--procesos', type=int, default=FRAGMENTOS_PROCESOS)
+
+    reintentar = subparsers.add_parser('reintentar', help='Vuelve a procesar los fragmentos fallidos')
+    reintentar.add_argument('--con-errores', action='store_true',
+                            help='Reintenta también los fragmentos que terminaron con municipios sin datos')
+    reintentar.add_argument('--procesos', type=int, default=FRAGMENTOS_PROCESOS)
+
+    fusionar = subparsers.add_parser('fusionar', help='Reúne los resultados de los fragmentos')
+    fusionar.add_argument('--parcial', action='store_true',
+                          help='Fusiona aunque falten fragmentos (sus municipios cuentan como errores)')
+
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🚀 ACTUALIZACIÓN FRAGMENTADA DE DATOS METEOROLÓGICOS")
+    print("=" * 70)
+
+    if args.accion != 'fusionar' and not uw.OPENWEATHER_API_KEY:
+        print("❌ ERROR CRÍTICO: No se encontró OPENWEATHER_API_KEY")
+        print("   La variable de entorno debe configurarse antes de ejecutar el script")
+        sys.exit(1)
+
+    hash_geojson, municipios = _cargar_indice()
+
+    if args.accion == 'ejecutar':
+        if args.fragmentos < 1:
+            print("❌ ERROR: El número de fragmentos debe ser al menos 1")
+            sys.exit(1)
+        fragmentos = planificar_fragmentos(municipios, args.modo, args.fragmentos)
+        manifiesto = nuevo_manifiesto(hash_geojson, args.modo, args.fragmentos, fragmentos)
+        limpiar_fragmentos()
+        guardar_manifiesto(manifiesto)
+    else:
+        manifiesto = leer_manifiesto()
+        if manifiesto is None:
+            print(f"❌ ERROR: No se encontró el manifiesto {MANIFIESTO_FILE}")
+            sys.exit(1)
+        if manifiesto['hash_geojson'] != hash_geojson:
+            print("❌ ERROR: El GeoJSON ha cambiado desde la ejecución fragmentada; vuelve a ejecutarla")
+            sys.exit(1)
+        fragmentos = planificar_fragmentos(municipios, manifiesto['modo'], manifiesto['numero'])
+
+    if args.accion in ('ejecutar', 'reintentar'):
+        pendientes = fragmentos_pendientes(manifiesto, getattr(args, 'con_errores', False))
+        if pendientes:
+            fallidos = ejecutar_fragmentos({i: fragmentos[i] for i in pendientes}, manifiesto, args.procesos)
+            if fallidos:
+                print(f"❌ Fragmentos fallidos: {', '.join(fallidos)}")
+                print("   Reinténtalos con: python fragmentos.py reintentar")
+                sys.exit(1)
+        else:
+            print("ℹ️  No hay fragmentos pendientes")
+
+    _fusionar_y_guardar(manifiesto, municipios, getattr(args, 'parcial', False))
+
+
+if __name__ == "__main__":
+    main()
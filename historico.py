@@ -0,0 +1,235 @@
+"""
+Almacén histórico de observaciones meteorológicas por municipio.
+
+Cada ejecución de update_weather.py sobrescribe el archivo de datos, así que
+sin este almacén la única forma de consultar el pasado sería recorrer los
+commits del repositorio. Aquí cada ejecución añade sus observaciones a una
+base de datos SQLite local, con índices por municipio y por instante, de
+modo que consultas como "el municipio X en los últimos N días" o "todos los
+municipios en el instante T" se resuelven en milisegundos incluso con años
+de datos cada 3 horas.
+
+Uso desde la línea de comandos:
+    python historico.py municipio 34132828079 --dias 7
+    python historico.py instante 2025-01-12T15:00
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+
+# Ruta por defecto de la base de datos (no se versiona en git)
+HISTORICO_FILE = os.environ.get('HISTORICO_FILE', 'data/historico.sqlite')
+
+# Columnas de cada observación, en el orden en que se guardan
+CAMPOS_OBSERVACION = [
+    'temperatura', 'sensacion', 'humedad', 'viento', 'lluvia', 'puntuacion', 'nivel'
+]
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS ejecuciones (
+    ts INTEGER PRIMARY KEY,          -- Instante de la ejecución (segundos Unix)
+    municipios INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS observaciones (
+    codigo_ine TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    temperatura REAL,
+    sensacion REAL,
+    humedad REAL,
+    viento REAL,                     -- km/h
+    lluvia REAL,                     -- mm/h
+    puntuacion INTEGER,
+    nivel TEXT,
+    PRIMARY KEY (codigo_ine, ts)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_observaciones_ts ON observaciones (ts);
+"""
+
+
+class HistoricoObservaciones:
+    """
+    Acceso al almacén histórico de observaciones.
+
+    La tabla de observaciones se organiza por (codigo_ine, ts), de modo que
+    la serie de un municipio se lee de forma contigua, y un índice adicional
+    por ts resuelve las consultas de todos los municipios en un instante.
+
+    Se puede usar como gestor de contexto:
+        with HistoricoObservaciones() as historico:
+            historico.serie_municipio('34132828079', dias=7)
+    """
+
+    def __init__(self, ruta=HISTORICO_FILE):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self.ruta = ruta
+        self._conexion = sqlite3.connect(ruta)
+        self._conexion.row_factory = sqlite3.Row
+        self._conexion.execute('PRAGMA journal_mode=WAL')
+        self._conexion.execute('PRAGMA synchronous=NORMAL')
+        self._conexion.executescript(ESQUEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cerrar()
+
+    def cerrar(self):
+        self._conexion.close()
+
+    def registrar_ejecucion(self, ts, observaciones):
+        """
+        Añade las observaciones de una ejecución.
+
+        Las observaciones que traen su propio `ts` (las que una ejecución
+        reanudada reutiliza de otra interrumpida) se guardan con ese instante
+        y cuentan como una ejecución aparte.
+
+        Args:
+            ts: Instante de la ejecución, como datetime o segundos Unix
+            observaciones: Iterable de diccionarios con `codigo_ine`, los
+                           campos de CAMPOS_OBSERVACION y, opcionalmente, `ts`
+
+        Returns:
+            Número de observaciones guardadas. Si ya existía una ejecución
+            con el mismo instante, se sustituye entera: sus observaciones
+            anteriores se borran aunque falte algún municipio en la nueva.
+        """
+        ts = _a_segundos(ts)
+        filas = [
+            (obs['codigo_ine'], _a_segundos(obs['ts']) if obs.get('ts') is not None else ts,
+             *(obs.get(campo) for campo in CAMPOS_OBSERVACION))
+            for obs in observaciones
+        ]
+        por_instante = {}
+        for fila in filas:
+            por_instante[fila[1]] = por_instante.get(fila[1], 0) + 1
+        por_instante = por_instante or {ts: 0}
+
+        with self._conexion:
+            for instante, municipios in por_instante.items():
+                self._conexion.execute("DELETE FROM observaciones WHERE ts = ?", (instante,))
+                self._conexion.execute(
+                    "INSERT OR REPLACE INTO ejecuciones (ts, municipios) VALUES (?, ?)",
+                    (instante, municipios)
+                )
+            self._conexion.executemany(
+                f"INSERT OR REPLACE INTO observaciones (codigo_ine, ts, {', '.join(CAMPOS_OBSERVACION)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(CAMPOS_OBSERVACION))})",
+                filas
+            )
+        return len(filas)
+
+    def serie_municipio(self, codigo_ine, dias=7, hasta=None):
+        """
+        Devuelve las observaciones de un municipio en los últimos `dias`.
+
+        Args:
+            codigo_ine: Código INE (NATCODE) del municipio
+            dias: Número de días hacia atrás
+            hasta: Fin del periodo (datetime o segundos Unix); por defecto, ahora
+
+        Returns:
+            Lista de diccionarios ordenada por instante
+        """
+        fin = _a_segundos(hasta) if hasta is not None else int(time.time())
+        inicio = fin - int(dias * 86400)
+        cursor = self._conexion.execute(
+            f"SELECT ts, {', '.join(CAMPOS_OBSERVACION)} FROM observaciones "
+            "WHERE codigo_ine = ? AND ts > ? AND ts <= ? ORDER BY ts",
+            (codigo_ine, inicio, fin)
+        )
+        return [dict(fila) for fila in cursor]
+
+    def instantanea(self, instante):
+        """
+        Devuelve las observaciones de todos los municipios en la última
+        ejecución anterior o igual a `instante`.
+
+        Returns:
+            Tupla (ts, {codigo_ine: observación}); ts es None si no hay
+            ninguna ejecución anterior a ese instante
+        """
+        fila = self._conexion.execute(
+            "SELECT MAX(ts) FROM ejecuciones WHERE ts <= ?", (_a_segundos(instante),)
+        ).fetchone()
+        ts = fila[0]
+        if ts is None:
+            return None, {}
+
+        cursor = self._conexion.execute(
+            f"SELECT codigo_ine, {', '.join(CAMPOS_OBSERVACION)} FROM observaciones WHERE ts = ?",
+            (ts,)
+        )
+        return ts, {f['codigo_ine']: {c: f[c] for c in CAMPOS_OBSERVACION} for f in cursor}
+
+    def ejecuciones(self):
+        """Número de ejecuciones registradas y rango de fechas que cubren."""
+        total, primera, ultima = self._conexion.execute(
+            "SELECT COUNT(*), MIN(ts), MAX(ts) FROM ejecuciones"
+        ).fetchone()
+        return {'total': total, 'primera': primera, 'ultima': ultima}
+
+
+def _a_segundos(instante):
+    """Convierte un datetime o una cadena ISO 8601 a segundos Unix."""
+    if isinstance(instante, str):
+        instante = datetime.fromisoformat(instante)
+    if isinstance(instante, datetime):
+        return int(instante.timestamp())
+    return int(instante)
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Consulta el histórico de observaciones meteorológicas')
+    parser.add_argument('--archivo', default=HISTORICO_FILE, help='Ruta de la base de datos')
+    subparsers = parser.add_subparsers(dest='consulta', required=True)
+
+    consulta_municipio = subparsers.add_parser('municipio', help='Serie de un municipio')
+    consulta_municipio.add_argument('codigo_ine')
+    consulta_municipio.add_argument('--dias', type=float, default=7)
+
+    consulta_instante = subparsers.add_parser('instante', help='Todos los municipios en un instante')
+    consulta_instante.add_argument('fecha', help='Fecha en formato ISO 8601 (ej: 2025-01-12T15:00)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.archivo):
+        print(f"❌ ERROR: No se encontró el histórico {args.archivo}")
+        sys.exit(1)
+
+    with HistoricoObservaciones(args.archivo) as historico:
+        if args.consulta == 'municipio':
+            for obs in historico.serie_municipio(args.codigo_ine, args.dias):
+                fecha = datetime.fromtimestamp(obs['ts']).strftime('%d/%m/%Y %H:%M')
+                print(f"{fecha}  {obs['temperatura']:5.1f}°C  {obs['viento']:5.1f} km/h  "
+                      f"{obs['lluvia'] or 0:4.1f} mm/h  {obs['puntuacion']:3d} pts ({obs['nivel']})")
+        else:
+            ts, observaciones = historico.instantanea(args.fecha)
+            if ts is None:
+                print("ℹ️  No hay observaciones anteriores a esa fecha")
+                return
+            print(f"📅 Ejecución del {datetime.fromtimestamp(ts).strftime('%d/%m/%Y %H:%M')}")
+            for codigo, obs in observaciones.items():
+                print(f"{codigo}  {obs['temperatura']:5.1f}°C  {obs['puntuacion']:3d} pts ({obs['nivel']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""
+Índice espacial de los municipios para localizar puntos.
+
+Responde a "¿en qué municipio está el punto (lat, lon) y qué tiempo hace
+allí?" para miles de puntos a la vez (posiciones de usuarios, lugares de
+eventos...) sin recorrer todos los polígonos en cada consulta.
+
+Los polígonos se reparten en una rejilla uniforme según su caja
+envolvente. Para cada punto solo se comprueban los polígonos de su celda
+cuya caja lo contiene, y la comprobación exacta se hace por el método del
+rayo (regla par-impar, que tiene en cuenta los huecos). La búsqueda por
+lotes está vectorizada con NumPy, de modo que cada punto cuesta unos pocos
+microsegundos.
+
+El índice se construye a partir del GeoJSON y se guarda en disco (formato
+.npz de NumPy) junto con el hash del GeoJSON, así que solo se reconstruye
+cuando cambian los límites municipales.
+
+Uso desde la línea de comandos:
+    python indice_espacial.py construir
+    python indice_espacial.py buscar 40.4168 -3.7038 40.4818 -3.3641
+    python indice_espacial.py buscar --archivo puntos.csv
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+
+import numpy as np
+
+
+# Ruta por defecto del índice (no se versiona en git: se regenera a partir
+# del GeoJSON cuando hace falta)
+INDICE_ESPACIAL_FILE = os.environ.get('INDICE_ESPACIAL_FILE', 'data/indice_espacial.npz')
+VERSION_INDICE_ESPACIAL = 1  # Incrementar si cambia el formato del archivo
+
+# Celdas de la rejilla por polígono (más celdas, menos candidatos por punto)
+CELDAS_POR_POLIGONO = 4
+
+# Tamaño máximo de la matriz puntos x aristas que se evalúa de una vez
+MAXIMO_ELEMENTOS_BLOQUE = 1 << 20
+
+
+def _poligonos(geometry):
+    """Devuelve la lista de polígonos de una geometría Polygon o MultiPolygon."""
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    raise ValueError(f"Tipo de geometría no soportado: {geometry['type']}")
+
+
+class IndiceEspacial:
+    """
+    Índice de polígonos municipales sobre una rejilla uniforme.
+
+    Los anillos de todos los polígonos se guardan seguidos en un único
+    array de vértices; cada polígono (una parte de un MultiPolygon cuenta
+    como un polígono) sabe qué anillos le pertenecen y a qué municipio
+    corresponde. Cada celda de la rejilla guarda los polígonos cuya caja
+    envolvente la toca.
+
+    Uso:
+        indice = IndiceEspacial.cargar()
+        indice.buscar(40.4168, -3.7038)            # -> '34132828079'
+        indice.buscar_lote(latitudes, longitudes)  # -> lista de claves o None
+    """
+
+    def __init__(self, claves, nombres, vertices, anillo_inicio, poligono_anillo_inicio,
+                 poligono_municipio, cajas, rejilla, celda_inicio, celda_poligonos, hash_geojson=''):
+        self.claves = list(claves)
+        self.nombres = list(nombres)
+        self.vertices = vertices
+        self.anillo_inicio = anillo_inicio
+        self.poligono_anillo_inicio = poligono_anillo_inicio
+        self.poligono_municipio = poligono_municipio
+        self.cajas = cajas
+        self.rejilla = rejilla
+        self.celda_inicio = celda_inicio
+        self.celda_poligonos = celda_poligonos
+        self.hash_geojson = hash_geojson
+
+        x0, y0, paso_x, paso_y, columnas, filas = rejilla
+        self._origen = (x0, y0)
+        self._paso = (paso_x, paso_y)
+        self._forma = (int(columnas), int(filas))
+
+        # Aristas de cada anillo: cada vértice con el siguiente, y el último
+        # con el primero (si el anillo ya está cerrado esa arista es un punto
+        # y no afecta al método del rayo)
+        siguiente = np.arange(1, len(vertices) + 1)
+        siguiente[anillo_inicio[1:] - 1] = anillo_inicio[:-1]
+        self._x1, self._y1 = vertices[:, 0], vertices[:, 1]
+        self._x2, self._y2 = vertices[siguiente, 0], vertices[siguiente, 1]
+        self._arista_inicio = anillo_inicio[poligono_anillo_inicio]
+
+    # ------------------------------------------------------------------------
+    # Construcción y persistencia
+    # ------------------------------------------------------------------------
+
+    @classmethod
+    def construir(cls, features, clave_municipio, hash_geojson=''):
+        """
+        Construye el índice a partir de un iterable de features GeoJSON.
+
+        Args:
+            features: Iterable de features (se recorre una sola vez, así que
+                      puede ser un lector incremental)
+            clave_municipio: Función (feature, índice) -> clave del municipio,
+                             la misma que usan los datos meteorológicos
+            hash_geojson: Hash del GeoJSON, para saber si el índice está al día
+
+        Las features con geometría no válida se omiten.
+        """
+        claves, nombres = [], []
+        bloques_vertices = []
+        anillo_inicio = [0]
+        poligono_anillo_inicio = [0]
+        poligono_municipio = []
+        cajas = []
+
+        for indice, feature in enumerate(features):
+            try:
+                poligonos = _poligonos(feature['geometry'])
+            except (ValueError, KeyError, TypeError):
+                continue
+
+            municipio = len(claves)
+            anadidos = 0
+            for poligono in poligonos:
+                anillos = [np.asarray(anillo, dtype=np.float64)[:, :2] for anillo in poligono if len(anillo) >= 3]
+                if not anillos:
+                    continue
+                for anillo in anillos:
+                    bloques_vertices.append(anillo)
+                    anillo_inicio.append(anillo_inicio[-1] + len(anillo))
+                poligono_anillo_inicio.append(len(anillo_inicio) - 1)
+                poligono_municipio.append(municipio)
+                exterior = anillos[0]
+                cajas.append((*exterior.min(axis=0), *exterior.max(axis=0)))
+                anadidos += 1
+
+            if anadidos:
+                claves.append(clave_municipio(feature, indice))
+                nombres.append(feature.get('properties', {}).get('NAMEUNIT', 'Desconocido'))
+
+        if not cajas:
+            raise ValueError("No hay ninguna geometría válida para construir el índice")
+
+        vertices = np.concatenate(bloques_vertices)
+        cajas = np.asarray(cajas, dtype=np.float64)
+        rejilla, celda_inicio, celda_poligonos = cls._repartir_en_rejilla(cajas)
+
+        return cls(
+            claves, nombres, vertices,
+            np.asarray(anillo_inicio, dtype=np.int64),
+            np.asarray(poligono_anillo_inicio, dtype=np.int64),
+            np.asarray(poligono_municipio, dtype=np.int64),
+            cajas, rejilla, celda_inicio, celda_poligonos, hash_geojson
+        )
+
+    @staticmethod
+    def _repartir_en_rejilla(cajas):
+        """
+        Reparte las cajas de los polígonos en una rejilla uniforme con unas
+        CELDAS_POR_POLIGONO celdas por polígono.
+
+        Returns:
+            Tupla (rejilla, celda_inicio, celda_poligonos): los parámetros de
+            la rejilla (x0, y0, paso_x, paso_y, columnas, filas) y la lista
+            de polígonos de cada celda en formato comprimido (los de la celda
+            c son celda_poligonos[celda_inicio[c]:celda_inicio[c + 1]])
+        """
+        x0, y0 = cajas[:, 0].min(), cajas[:, 1].min()
+        ancho = max(cajas[:, 2].max() - x0, 1e-9)
+        alto = max(cajas[:, 3].max() - y0, 1e-9)
+        celdas = max(1, CELDAS_POR_POLIGONO * len(cajas))
+        columnas = max(1, round(math.sqrt(celdas * ancho / alto)))
+        filas = max(1, round(celdas / columnas))
+        paso_x, paso_y = ancho / columnas, alto / filas
+
+        def rango(minimo, maximo, origen, paso, total):
+            primero = np.clip(np.floor((minimo - origen) / paso).astype(np.int64), 0, total - 1)
+            ultimo = np.clip(np.floor((maximo - origen) / paso).astype(np.int64), 0, total - 1)
+            return primero, ultimo
+
+        col_min, col_max = rango(cajas[:, 0], cajas[:, 2], x0, paso_x, columnas)
+        fil_min, fil_max = rango(cajas[:, 1], cajas[:, 3], y0, paso_y, filas)
+
+        pares_celda, pares_poligono = [], []
+        for poligono in range(len(cajas)):
+            cols = np.arange(col_min[poligono], col_max[poligono] + 1)
+            fils = np.arange(fil_min[poligono], fil_max[poligono] + 1)
+            pares_celda.append((fils[:, None] * columnas + cols[None, :]).ravel())
+            pares_poligono.append(np.full(len(cols) * len(fils), poligono, dtype=np.int64))
+
+        pares_celda = np.concatenate(pares_celda)
+        pares_poligono = np.concatenate(pares_poligono)
+        orden = np.argsort(pares_celda, kind='stable')
+        cuenta = np.bincount(pares_celda, minlength=columnas * filas)
+        celda_inicio = np.concatenate([[0], np.cumsum(cuenta)]).astype(np.int64)
+
+        rejilla = np.array([x0, y0, paso_x, paso_y, columnas, filas], dtype=np.float64)
+        return rejilla, celda_inicio, pares_poligono[orden]
+
+    def guardar(self, ruta=INDICE_ESPACIAL_FILE):
+        """Guarda el índice en un archivo .npz (escritura atómica)."""
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        ruta_temporal = f"{ruta}.tmp"
+        with open(ruta_temporal, 'wb') as f:
+            np.savez_compressed(
+                f,
+                version=np.array(VERSION_INDICE_ESPACIAL),
+                hash_geojson=np.array(self.hash_geojson),
+                claves=np.array(self.claves, dtype=str),
+                nombres=np.array(self.nombres, dtype=str),
+                vertices=self.vertices,
+                anillo_inicio=self.anillo_inicio,
+                poligono_anillo_inicio=self.poligono_anillo_inicio,
+                poligono_municipio=self.poligono_municipio,
+                cajas=self.cajas,
+                rejilla=self.rejilla,
+                celda_inicio=self.celda_inicio,
+                celda_poligonos=self.celda_poligonos
+            )
+        os.replace(ruta_temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta=INDICE_ESPACIAL_FILE):
+        """
+        Carga un índice guardado con guardar().
+
+        Raises:
+            OSError: Si el archivo no existe o no se puede leer
+            ValueError: Si el archivo es de otra versión del formato
+        """
+        with np.load(ruta, allow_pickle=False) as datos:
+            if int(datos['version']) != VERSION_INDICE_ESPACIAL:
+                raise ValueError(f"El índice espacial {ruta} es de otra versión; hay que reconstruirlo")
+            return cls(
+                datos['claves'].tolist(), datos['nombres'].tolist(), datos['vertices'],
+                datos['anillo_inicio'], datos['poligono_anillo_inicio'], datos['poligono_municipio'],
+                datos['cajas'], datos['rejilla'], datos['celda_inicio'], datos['celda_poligonos'],
+                str(datos['hash_geojson'])
+            )
+
+    # ------------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------------
+
+    def _contiene(self, poligono, x, y):
+        """Método del rayo (regla par-impar) para los puntos (x, y) y un polígono."""
+        inicio = self._arista_inicio[poligono]
+        fin = self._arista_inicio[poligono + 1]
+        x1, y1 = self._x1[inicio:fin], self._y1[inicio:fin]
+        x2, y2 = self._x2[inicio:fin], self._y2[inicio:fin]
+
+        dentro = np.zeros(len(x), dtype=bool)
+        bloque = max(1, MAXIMO_ELEMENTOS_BLOQUE // max(fin - inicio, 1))
+        for desde in range(0, len(x), bloque):
+            px = x[desde:desde + bloque, None]
+            py = y[desde:desde + bloque, None]
+            cruza = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                corte = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            cruces = np.count_nonzero(cruza & (px < corte), axis=1)
+            dentro[desde:desde + bloque] = cruces % 2 == 1
+        return dentro
+
+    def localizar_lote(self, latitudes, longitudes):
+        """
+        Localiza un lote de puntos.
+
+        Returns:
+            Array con la posición en `self.claves` del municipio que contiene
+            cada punto, o -1 si no está en ninguno
+        """
+        x = np.asarray(longitudes, dtype=np.float64).ravel()
+        y = np.asarray(latitudes, dtype=np.float64).ravel()
+        resultado = np.full(len(x), -1, dtype=np.int64)
+        if not len(x):
+            return resultado
+
+        # Celda de cada punto (los que caen fuera de la rejilla no están en
+        # ningún municipio)
+        columnas, filas = self._forma
+        col = np.floor((x - self._origen[0]) / self._paso[0])
+        fil = np.floor((y - self._origen[1]) / self._paso[1])
+        en_rejilla = (col >= 0) & (col < columnas) & (fil >= 0) & (fil < filas)
+        puntos = np.nonzero(en_rejilla)[0]
+        celdas = (fil[puntos] * columnas + col[puntos]).astype(np.int64)
+
+        # Pares (punto, polígono candidato) según la celda de cada punto
+        inicio = self.celda_inicio[celdas]
+        cuenta = self.celda_inicio[celdas + 1] - inicio
+        pares_punto = np.repeat(puntos, cuenta)
+        desplazamiento = np.arange(cuenta.sum()) - np.repeat(np.cumsum(cuenta) - cuenta, cuenta)
+        pares_poligono = self.celda_poligonos[np.repeat(inicio, cuenta) + desplazamiento]
+
+        # Descartar los candidatos cuya caja no contiene el punto
+        caja = self.cajas[pares_poligono]
+        px, py = x[pares_punto], y[pares_punto]
+        en_caja = (px >= caja[:, 0]) & (px <= caja[:, 2]) & (py >= caja[:, 1]) & (py <= caja[:, 3])
+        pares_punto, pares_poligono = pares_punto[en_caja], pares_poligono[en_caja]
+
+        # Comprobación exacta, agrupando los puntos de cada polígono
+        orden = np.argsort(pares_poligono, kind='stable')
+        pares_punto, pares_poligono = pares_punto[orden], pares_poligono[orden]
+        cortes = np.flatnonzero(np.diff(pares_poligono)) + 1
+        for desde, hasta in zip(np.concatenate([[0], cortes]), np.concatenate([cortes, [len(pares_poligono)]])):
+            if desde == hasta:
+                continue
+            poligono = pares_poligono[desde]
+            candidatos = pares_punto[desde:hasta]
+            dentro = self._contiene(poligono, x[candidatos], y[candidatos])
+            resultado[candidatos[dentro]] = self.poligono_municipio[poligono]
+        return resultado
+
+    def buscar_lote(self, latitudes, longitudes):
+        """Devuelve la clave del municipio de cada punto, o None si no está en ninguno."""
+        return [self.claves[i] if i >= 0 else None for i in self.localizar_lote(latitudes, longitudes).tolist()]
+
+    def buscar(self, lat, lon):
+        """Devuelve la clave del municipio que contiene el punto, o None."""
+        return self.buscar_lote([lat], [lon])[0]
+
+
+def indice_actualizado(hash_geojson, ruta=INDICE_ESPACIAL_FILE):
+    """Indica si el índice guardado en `ruta` corresponde al GeoJSON actual."""
+    try:
+        with np.load(ruta, allow_pickle=False) as datos:
+            return (int(datos['version']) == VERSION_INDICE_ESPACIAL
+                    and str(datos['hash_geojson']) == hash_geojson)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def condiciones_en_puntos(indice, latitudes, longitudes, datos_clima):
+    """
+    Combina la búsqueda espacial con los datos meteorológicos.
+
+    Args:
+        indice: IndiceEspacial
+        latitudes, longitudes: Coordenadas de los puntos
+        datos_clima: Contenido de weather_data.json
+
+    Returns:
+        Lista con, para cada punto, un diccionario con la clave, el nombre,
+        el clima y el índice de buen tiempo del municipio (None en los
+        campos que falten), o None si el punto no está en ningún municipio
+    """
+    municipios = datos_clima.get('municipios', {})
+    resultados = []
+    for posicion in indice.localizar_lote(latitudes, longitudes).tolist():
+        if posicion < 0:
+            resultados.append(None)
+            continue
+        clave = indice.claves[posicion]
+        datos = municipios.get(clave, {})
+        resultados.append({
+            'clave': clave,
+            'nombre': indice.nombres[posicion],
+            'clima': datos.get('clima'),
+            'indice': datos.get('indice')
+        })
+    return resultados
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def _leer_puntos(args):
+    """Coordenadas de la línea de comandos o de un CSV con columnas lat,lon."""
+    if args.archivo:
+        latitudes, longitudes = [], []
+        with open(args.archivo, newline='', encoding='utf-8') as f:
+            for fila in csv.reader(f):
+                try:
+                    latitudes.append(float(fila[0]))
+                    longitudes.append(float(fila[1]))
+                except (ValueError, IndexError):
+                    continue  # Cabecera o línea vacía
+        return latitudes, longitudes
+    if len(args.coordenadas) % 2:
+        print("❌ ERROR: Las coordenadas deben ir en parejas: lat lon [lat lon ...]")
+        sys.exit(1)
+    return args.coordenadas[0::2], args.coordenadas[1::2]
+
+
+def main():
+    # Importación diferida: update_weather importa este módulo
+    import esquema as esquema_mod
+    import update_weather as uw
+
+    parser = argparse.ArgumentParser(description='Índice espacial de los municipios')
+    parser.add_argument('--archivo-indice', default=INDICE_ESPACIAL_FILE, help='Ruta del índice')
+    subparsers = parser.add_subparsers(dest='accion', required=True)
+
+    subparsers.add_parser('construir', help='Construye el índice a partir del GeoJSON')
+
+    buscar = subparsers.add_parser('buscar', help='Municipio y condiciones en unas coordenadas')
+    buscar.add_argument('coordenadas', type=float, nargs='*', help='lat lon [lat lon ...]')
+    buscar.add_argument('--archivo', help='CSV con una pareja lat,lon por línea')
+
+    args = parser.parse_args()
+
+    if args.accion == 'construir':
+        try:
+            hash_geojson = uw.calcular_hash_archivo(uw.GEOJSON_FILE)
+            uw.generar_indice_espacial(uw.LectorFeatures(uw.GEOJSON_FILE), hash_geojson, args.archivo_indice)
+        except FileNotFoundError:
+            print(f"❌ ERROR: No se encontró el archivo {uw.GEOJSON_FILE}")
+            sys.exit(1)
+        return
+
+    try:
+        indice = IndiceEspacial.cargar(args.archivo_indice)
+    except (OSError, ValueError) as e:
+        print(f"❌ ERROR: No se pudo cargar el índice espacial: {e}")
+        print("   Constrúyelo con: python indice_espacial.py construir")
+        sys.exit(1)
+
+    try:
+        datos_clima = esquema_mod.leer_json(uw.OUTPUT_FILE)
+    except (OSError, ValueError):
+        datos_clima = {}
+
+    latitudes, longitudes = _leer_puntos(args)
+    for lat, lon, resultado in zip(latitudes, longitudes,
+                                   condiciones_en_puntos(indice, latitudes, longitudes, datos_clima)):
+        if resultado is None:
+            print(f"{lat:.5f}, {lon:.5f}  fuera de los municipios del índice")
+        elif resultado['indice'] is None:
+            print(f"{lat:.5f}, {lon:.5f}  {resultado['nombre']} ({resultado['clave']}): sin datos meteorológicos")
+        else:
+            clima, indice_tiempo = resultado['clima'], resultado['indice']
+            print(f"{lat:.5f}, {lon:.5f}  {resultado['nombre']} ({resultado['clave']}): "
+                  f"{clima['temperatura']}°C, {clima['descripcion']}, "
+                  f"{indice_tiempo['puntuacion']} pts ({indice_tiempo['nivel']})")
+
+
+if __name__ == "__main__":
+    main()
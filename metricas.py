@@ -0,0 +1,201 @@
+"""
+Métricas de rendimiento de una ejecución de update_weather.py.
+
+Recoge, de forma segura entre hilos, el tiempo de cada fase del proceso, la
+latencia de cada petición a la API (con percentiles e histograma), los
+recuentos de timeouts, errores HTTP y reintentos, y los bytes escritos en
+cada archivo. Al terminar la ejecución el resumen se guarda como JSON
+(data/metricas.json) para poder comparar ejecuciones y localizar qué fase
+se ha vuelto lenta.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Límites superiores (en milisegundos) de los intervalos del histograma de
+# latencias. El último intervalo recoge todo lo que supera el último límite.
+LIMITES_HISTOGRAMA_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentil(valores_ordenados, p):
+    """Percentil `p` (0-100) de una lista ordenada, por el método del rango más cercano."""
+    if not valores_ordenados:
+        return None
+    posicion = max(0, -(-len(valores_ordenados) * p // 100) - 1)
+    return valores_ordenados[min(posicion, len(valores_ordenados) - 1)]
+
+
+class MetricasEjecucion:
+    """
+    Acumulador de métricas de una ejecución.
+
+    Uso:
+        metricas = MetricasEjecucion()
+        with metricas.fase('consultas'):
+            ...
+        metricas.registrar_peticion(0.083, 200)
+        metricas.contar('reintentos')
+        metricas.registrar_escritura('data/weather_data.json', 51234)
+        resumen = metricas.resumen()
+    """
+
+    def __init__(self):
+        self._cerrojo = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._cerrojo:
+            self._inicio = time.perf_counter()
+            self._fases = {}
+            self._latencias = []
+            self._codigos = {}
+            self._contadores = {}
+            self._escrituras = {}
+
+    @contextmanager
+    def fase(self, nombre):
+        """Mide el tiempo de un bloque y lo suma al de la fase `nombre`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracion = time.perf_counter() - inicio
+            with self._cerrojo:
+                self._fases[nombre] = self._fases.get(nombre, 0.0) + duracion
+
+    def registrar_peticion(self, segundos, codigo):
+        """
+        Registra una petición a la API.
+
+        Args:
+            segundos: Tiempo hasta recibir la respuesta (o hasta el fallo)
+            codigo: Código HTTP de la respuesta, o un texto como 'timeout'
+                    o 'error_red' si no hubo respuesta
+        """
+        with self._cerrojo:
+            self._latencias.append(segundos)
+            self._codigos[str(codigo)] = self._codigos.get(str(codigo), 0) + 1
+
+    def contar(self, nombre, cantidad=1):
+        with self._cerrojo:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + cantidad
+
+    def registrar_escritura(self, ruta, tamano):
+        with self._cerrojo:
+            self._escrituras[ruta] = self._escrituras.get(ruta, 0) + tamano
+
+    def resumen(self):
+        """Devuelve todas las métricas como un diccionario serializable en JSON."""
+        with self._cerrojo:
+            latencias_ms = sorted(segundos * 1000 for segundos in self._latencias)
+            cuentas = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+            for latencia in latencias_ms:
+                intervalo = 0
+                while intervalo < len(LIMITES_HISTOGRAMA_MS) and latencia > LIMITES_HISTOGRAMA_MS[intervalo]:
+                    intervalo += 1
+                cuentas[intervalo] += 1
+
+            latencia = {f'p{p}': _redondear(percentil(latencias_ms, p)) for p in PERCENTILES}
+            latencia['media'] = _redondear(sum(latencias_ms) / len(latencias_ms)) if latencias_ms else None
+            latencia['maxima'] = _redondear(latencias_ms[-1]) if latencias_ms else None
+
+            codigos = dict(sorted(self._codigos.items()))
+            return {
+                'duracion_segundos': round(time.perf_counter() - self._inicio, 3),
+                'fases_segundos': {fase: round(segundos, 3) for fase, segundos in self._fases.items()},
+                'peticiones': {
+                    'total': len(latencias_ms),
+                    'por_codigo': codigos,
+                    'timeouts': codigos.get('timeout', 0),
+                    'errores_http': sum(n for codigo, n in codigos.items() if codigo.isdigit() and int(codigo) >= 400),
+                    'errores_red': codigos.get('error_red', 0),
+                    'latencia_ms': latencia,
+                    'histograma_ms': {
+                        'limites': LIMITES_HISTOGRAMA_MS,
+                        'cuentas': cuentas
+                    }
+                },
+                'contadores': dict(sorted(self._contadores.items())),
+                'bytes_escritos': {
+                    'total': sum(self._escrituras.values()),
+                    'por_archivo': dict(sorted(self._escrituras.items()))
+                }
+            }
+
+
+def combinar_resumenes(resumenes):
+    """
+    Combina los resúmenes de varias ejecuciones (por ejemplo, los de los
+    fragmentos de fragmentos.py) en uno con el mismo formato.
+
+    Los recuentos, histogramas, bytes escritos y tiempos de fase se suman
+    (los tiempos de fase son, por tanto, el tiempo acumulado de todos los
+    procesos), la duración es la mayor y la latencia media se pondera por
+    el número de peticiones. Los percentiles no se pueden reconstruir a
+    partir de los de cada parte, así que solo se conservan si todas las
+    peticiones vienen de un mismo resumen; si no, quedan a None.
+    """
+    fases, codigos, contadores, escrituras = {}, {}, {}, {}
+    cuentas = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+    con_peticiones = []
+    suma_latencias = 0.0
+    duracion = 0.0
+    for resumen in resumenes:
+        duracion = max(duracion, resumen['duracion_segundos'])
+        for fase, segundos in resumen['fases_segundos'].items():
+            fases[fase] = fases.get(fase, 0.0) + segundos
+        for nombre, cantidad in resumen['contadores'].items():
+            contadores[nombre] = contadores.get(nombre, 0) + cantidad
+        for ruta, tamano in resumen['bytes_escritos']['por_archivo'].items():
+            escrituras[ruta] = escrituras.get(ruta, 0) + tamano
+        peticiones = resumen['peticiones']
+        for codigo, cantidad in peticiones['por_codigo'].items():
+            codigos[codigo] = codigos.get(codigo, 0) + cantidad
+        for intervalo, cantidad in enumerate(peticiones['histograma_ms']['cuentas']):
+            cuentas[intervalo] += cantidad
+        if peticiones['total']:
+            con_peticiones.append(peticiones)
+            suma_latencias += peticiones['latencia_ms']['media'] * peticiones['total']
+
+    total = sum(peticiones['total'] for peticiones in con_peticiones)
+    if len(con_peticiones) == 1:
+        latencia = dict(con_peticiones[0]['latencia_ms'])
+    else:
+        latencia = {f'p{p}': None for p in PERCENTILES}
+        latencia['media'] = _redondear(suma_latencias / total) if total else None
+        latencia['maxima'] = max((peticiones['latencia_ms']['maxima'] for peticiones in con_peticiones),
+                                 default=None)
+
+    codigos = dict(sorted(codigos.items()))
+    return {
+        'duracion_segundos': round(duracion, 3),
+        'fases_segundos': {fase: round(segundos, 3) for fase, segundos in fases.items()},
+        'peticiones': {
+            'total': total,
+            'por_codigo': codigos,
+            'timeouts': codigos.get('timeout', 0),
+            'errores_http': sum(n for codigo, n in codigos.items() if codigo.isdigit() and int(codigo) >= 400),
+            'errores_red': codigos.get('error_red', 0),
+            'latencia_ms': latencia,
+            'histograma_ms': {
+                'limites': LIMITES_HISTOGRAMA_MS,
+                'cuentas': cuentas
+            }
+        },
+        'contadores': dict(sorted(contadores.items())),
+        'bytes_escritos': {
+            'total': sum(escrituras.values()),
+            'por_archivo': dict(sorted(escrituras.items()))
+        }
+    }
+
+
+def _redondear(valor):
+    return None if valor is None else round(valor, 1)
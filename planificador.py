@@ -0,0 +1,352 @@
+"""
+Planificador de actualización continua y escalonada.
+
+En lugar de consultar todos los municipios de golpe cada 3 horas y dejar
+los datos sin actualizar el resto del tiempo, este modo se queda en marcha
+y reparte las consultas de forma uniforme a lo largo del intervalo, con el
+mismo número de peticiones. El estado actual se mantiene en memoria y se
+vuelca periódicamente a OUTPUT_FILE (con la misma escritura atómica y
+sensible a cambios que la ejecución normal).
+
+Cada vez que toca consultar se elige el municipio con mayor prioridad, que
+crece con el tiempo transcurrido desde su última actualización multiplicado
+por un peso de volatilidad: los municipios con la puntuación cerca del
+límite de un nivel, con precipitación en curso o cuya puntuación cambió en
+la última consulta se actualizan más a menudo, y los estables menos, sin
+superar nunca PLANIFICADOR_ANTIGUEDAD_MAXIMA.
+
+Uso:
+    python planificador.py                 # Hasta Ctrl+C o SIGTERM
+    python planificador.py --duracion 600  # Durante 10 minutos
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import json
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import update_weather as uw
+
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+# Intervalo en el que se reparte el presupuesto de peticiones (el mismo que
+# el del cron del workflow) y peticiones por intervalo (0 = una por
+# municipio, el mismo coste que una ejecución completa)
+PLANIFICADOR_INTERVALO = float(os.environ.get('PLANIFICADOR_INTERVALO', '10800'))
+PLANIFICADOR_PRESUPUESTO = int(os.environ.get('PLANIFICADOR_PRESUPUESTO', '0'))
+
+# Ningún municipio pasa más de este tiempo sin actualizarse, por estable que sea
+PLANIFICADOR_ANTIGUEDAD_MAXIMA = float(os.environ.get(
+    'PLANIFICADOR_ANTIGUEDAD_MAXIMA', str(2 * PLANIFICADOR_INTERVALO)
+))
+
+# Segundos entre dos volcados del estado a OUTPUT_FILE
+PLANIFICADOR_ESCRITURA = float(os.environ.get('PLANIFICADOR_ESCRITURA', '300'))
+
+# Pesos de volatilidad (un municipio estable pesa 1)
+MARGEN_LIMITE_NIVEL = 5   # Puntos de distancia a un límite de nivel que cuentan como "cerca"
+PESO_LIMITE_NIVEL = 2.0   # Peso extra en el propio límite (disminuye con la distancia)
+PESO_PRECIPITACION = 2.0  # Peso extra con lluvia, nieve o tormenta en curso
+PESO_CAMBIO = 1.0         # Peso extra si la puntuación cambió 10 puntos o más
+CAMBIO_REFERENCIA = 10
+
+# Iconos de OpenWeatherMap con precipitación: chubascos, lluvia, tormenta, nieve
+ICONOS_PRECIPITACION = ('09', '10', '11', '13')
+
+
+# ============================================================================
+# PRIORIDADES
+# ============================================================================
+
+def peso_volatilidad(datos, anteriores=None, limites_nivel=(70, 40)):
+    """
+    Peso de volatilidad de un municipio a partir de sus datos en OUTPUT_FILE.
+
+    Args:
+        datos: Datos actuales del municipio (con `clima` e `indice`)
+        anteriores: Datos de la consulta anterior, o None
+        limites_nivel: Puntuaciones mínimas de cada nivel
+
+    Returns:
+        Peso mayor o igual que 1
+    """
+    peso = 1.0
+    puntuacion = datos['indice']['puntuacion']
+
+    distancia = min((abs(puntuacion - limite) for limite in limites_nivel), default=math.inf)
+    if distancia < MARGEN_LIMITE_NIVEL:
+        peso += PESO_LIMITE_NIVEL * (1 - distancia / MARGEN_LIMITE_NIVEL)
+
+    if datos['clima'].get('icono', '')[:2] in ICONOS_PRECIPITACION:
+        peso += PESO_PRECIPITACION
+
+    if anteriores is not None:
+        cambio = abs(puntuacion - anteriores['indice']['puntuacion'])
+        peso += PESO_CAMBIO * min(1.0, cambio / CAMBIO_REFERENCIA)
+
+    return peso
+
+
+class PlanificadorRefresco:
+    """
+    Decide qué municipio se consulta en cada momento.
+
+    La prioridad de cada municipio es el tiempo desde su última
+    actualización multiplicado por su peso de volatilidad; los que superan
+    la antigüedad máxima pasan por delante de todos. Las prioridades se
+    calculan en bloque con NumPy, así que elegir entre miles de municipios
+    cuesta microsegundos.
+
+    Es seguro usarlo desde varios hilos a la vez.
+    """
+
+    def __init__(self, numero_municipios, antiguedad_maxima=PLANIFICADOR_ANTIGUEDAD_MAXIMA):
+        self.antiguedad_maxima = antiguedad_maxima
+        self.ultima = np.full(numero_municipios, -math.inf)  # Nunca actualizado
+        self.peso = np.ones(numero_municipios)
+        self.en_curso = np.zeros(numero_municipios, dtype=bool)
+        self._cerrojo = threading.Lock()
+
+    def siguiente(self, ahora):
+        """
+        Devuelve la posición del municipio que hay que consultar y lo marca
+        como en curso, o None si todos están ya en curso.
+        """
+        with self._cerrojo:
+            antiguedad = ahora - self.ultima
+            prioridad = np.where(antiguedad >= self.antiguedad_maxima, math.inf, antiguedad * self.peso)
+            prioridad[self.en_curso] = -math.inf
+            posicion = int(np.argmax(prioridad))
+            if self.en_curso[posicion]:
+                return None
+            self.en_curso[posicion] = True
+            return posicion
+
+    def registrar(self, posicion, ahora, peso=None):
+        """
+        Registra la consulta de un municipio. Si ha fallado (peso None) se
+        conserva su peso y vuelve a la cola como si se hubiera actualizado,
+        para que un municipio que falla siempre no agote el presupuesto.
+        """
+        with self._cerrojo:
+            self.en_curso[posicion] = False
+            self.ultima[posicion] = ahora
+            if peso is not None:
+                self.peso[posicion] = peso
+
+
+# ============================================================================
+# EJECUCIÓN CONTINUA
+# ============================================================================
+
+def _cargar_municipios():
+    """
+    Lista de entradas del índice de centroides (con su clave), generando el
+    índice si los límites municipales han cambiado.
+    """
+    hash_geojson, municipios, _, indice_nuevo = uw.preparar_municipios()
+    municipios = list(municipios)
+    if indice_nuevo is not None:
+        uw.guardar_indice_centroides(municipios, hash_geojson)
+
+    validos = []
+    for posicion, municipio in enumerate(municipios):
+        if 'error' in municipio:
+            print(f"⚠️  Se omite {municipio['nombre']}: {municipio['error']}")
+            continue
+        clave = municipio.get('clave') or uw.clave_municipio(municipio['codigo_ine'], posicion)
+        validos.append(dict(municipio, clave=clave))
+    return validos
+
+
+def _antiguedad_salida_anterior():
+    """Segundos desde la última escritura de ESTADO_FILE, o None si no se sabe."""
+    try:
+        with open(uw.ESTADO_FILE, 'r', encoding='utf-8') as f:
+            estado = json.load(f)
+        return max(0.0, (datetime.now() - datetime.fromisoformat(estado['ultima_actualizacion'])).total_seconds())
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def ejecutar_planificador(duracion=None, intervalo=PLANIFICADOR_INTERVALO,
+                          presupuesto=PLANIFICADOR_PRESUPUESTO, periodo_escritura=PLANIFICADOR_ESCRITURA,
+                          parada=None):
+    """
+    Ejecuta el planificador hasta que se active `parada` o pase `duracion`.
+
+    Args:
+        duracion: Segundos de ejecución, o None para no detenerse
+        intervalo: Segundos en los que se reparte el presupuesto
+        presupuesto: Peticiones por intervalo (0 = una por municipio)
+        periodo_escritura: Segundos entre dos volcados a OUTPUT_FILE
+        parada: threading.Event que detiene el planificador al activarse
+    """
+    parada = parada or threading.Event()
+
+    if not uw.OPENWEATHER_API_KEY:
+        print("❌ ERROR CRÍTICO: No se encontró OPENWEATHER_API_KEY")
+        sys.exit(1)
+
+    uw.metricas_ejecucion.reiniciar()
+    municipios = _cargar_municipios()
+    if not municipios:
+        print("❌ ERROR: No hay ningún municipio que consultar")
+        sys.exit(1)
+    claves = [m['clave'] for m in municipios]
+
+    presupuesto = presupuesto or len(municipios)
+    separacion = intervalo / presupuesto
+    limites_nivel = [n['minimo'] for n in uw.obtener_motor_indice().niveles if n['minimo'] is not None]
+    planificador = PlanificadorRefresco(len(municipios))
+
+    # El estado de partida es la última salida publicada, con su antigüedad
+    ahora = time.monotonic()
+    actuales = {}
+    anterior = uw.cargar_salida_anterior()
+    antiguedad = _antiguedad_salida_anterior()
+    if antiguedad is None:
+        antiguedad = intervalo
+    if anterior is not None:
+        for posicion, clave in enumerate(claves):
+            if clave in anterior['municipios']:
+                actuales[clave] = anterior['municipios'][clave]
+                planificador.registrar(posicion, ahora - antiguedad,
+                                       peso_volatilidad(actuales[clave], limites_nivel=limites_nivel))
+
+    print("=" * 70)
+    print("🔁 PLANIFICADOR DE ACTUALIZACIÓN CONTINUA")
+    print("=" * 70)
+    print(f"📍 {len(municipios)} municipios ({len(actuales)} con datos previos)")
+    print(f"⏱️  {presupuesto} peticiones cada {intervalo / 60:.0f} minutos "
+          f"(una cada {separacion:.1f} s), volcado cada {periodo_escritura:.0f} s")
+    print("-" * 70)
+
+    cerrojo = threading.Lock()
+    errores = {}
+    observaciones = []
+    pendientes = [0]  # Actualizaciones desde el último volcado
+    # El limitador general sigue protegiendo el cupo del plan (reintentos incluidos)
+    limitador = uw.LimitadorTasa(uw.PETICIONES_POR_MINUTO, uw.RAFAGA_PETICIONES)
+
+    def consultar(posicion):
+        municipio = municipios[posicion]
+        clave = municipio['clave']
+        peso = None
+        try:
+            datos_clima = uw.obtener_datos_clima(municipio['lat'], municipio['lon'], municipio['nombre'], limitador)
+            if datos_clima:
+                indice = uw.calcular_indice_tiempo(datos_clima)
+                datos = uw.construir_datos_municipio(municipio, datos_clima, indice)
+                with cerrojo:
+                    peso = peso_volatilidad(datos, actuales.get(clave), limites_nivel)
+                    actuales[clave] = datos
+                    errores.pop(clave, None)
+                    observaciones.append(uw.construir_observacion(clave, datos_clima, indice))
+                    pendientes[0] += 1
+                print(f"    ✓ {municipio['nombre']}: {indice['nivel']} ({indice['puntuacion']} pts, peso {peso:.1f})")
+        except Exception as e:
+            print(f"    ✗ Error inesperado en {municipio['nombre']}: {e}")
+        finally:
+            if peso is None:
+                with cerrojo:
+                    if clave not in actuales:
+                        errores[clave] = municipio['nombre']
+            planificador.registrar(posicion, time.monotonic(), peso)
+
+    def volcar():
+        with cerrojo:
+            resultado = {
+                'procesados': {clave: actuales[clave] for clave in claves if clave in actuales},
+                'errores': dict(errores),
+                'observaciones': observaciones[:],
+                'informe_rejilla': None
+            }
+            observaciones.clear()
+            pendientes[0] = 0
+        with uw.metricas_ejecucion.fase('escritura'):
+            estado = uw.guardar_resultados(resultado)
+        if estado is None:
+            # Se vuelve a intentar en el próximo volcado; el estado sigue en memoria
+            with cerrojo:
+                pendientes[0] += len(resultado['procesados'])
+                observaciones[:0] = resultado['observaciones']
+        uw.guardar_metricas()
+        # Las métricas de cada archivo cubren el periodo desde el volcado anterior
+        uw.metricas_ejecucion.reiniciar()
+
+    inicio = time.monotonic()
+    proximo_envio = inicio
+    proximo_volcado = inicio + periodo_escritura
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, uw.PETICIONES_CONCURRENTES)) as ejecutor:
+            while not parada.is_set():
+                ahora = time.monotonic()
+                if duracion is not None and ahora - inicio >= duracion:
+                    break
+
+                if ahora >= proximo_volcado:
+                    if pendientes[0]:
+                        volcar()
+                    proximo_volcado = ahora + periodo_escritura
+
+                if ahora >= proximo_envio:
+                    posicion = planificador.siguiente(ahora)
+                    if posicion is not None:
+                        ejecutor.submit(consultar, posicion)
+                    # Sin adelantar envíos atrasados: el presupuesto se reparte
+                    # de forma uniforme aunque el proceso se haya retrasado
+                    proximo_envio = max(proximo_envio + separacion, ahora)
+
+                espera = min(proximo_envio, proximo_volcado) - time.monotonic()
+                if duracion is not None:
+                    espera = min(espera, inicio + duracion - time.monotonic())
+                parada.wait(max(0.0, espera))
+    finally:
+        print("-" * 70)
+        print("⏹️  Deteniendo el planificador...")
+        if pendientes[0]:
+            volcar()
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Actualización continua y escalonada de los municipios')
+    parser.add_argument('--duracion', type=float, help='Segundos de ejecución (por defecto, sin límite)')
+    parser.add_argument('--intervalo', type=float, default=PLANIFICADOR_INTERVALO,
+                        help='Segundos en los que se reparte el presupuesto de peticiones')
+    parser.add_argument('--presupuesto', type=int, default=PLANIFICADOR_PRESUPUESTO,
+                        help='Peticiones por intervalo (0 = una por municipio)')
+    parser.add_argument('--escritura', type=float, default=PLANIFICADOR_ESCRITURA,
+                        help='Segundos entre dos volcados a OUTPUT_FILE')
+    args = parser.parse_args()
+
+    # SIGTERM (p. ej. al parar el servicio) detiene el planificador de forma
+    # ordenada, igual que Ctrl+C, volcando antes el estado pendiente
+    parada = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parada.set())
+    try:
+        ejecutar_planificador(args.duracion, args.intervalo, args.presupuesto, args.escritura, parada)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Modo previsión: índice de buen tiempo para los próximos días.
+
+Descarga de OpenWeatherMap la previsión en franjas de 3 horas
+(/data/2.5/forecast) del mismo punto que se consulta para cada municipio y
+puntúa todas las franjas con el mismo motor de reglas y CRITERIOS que las
+condiciones actuales, en una sola pasada vectorizada.
+
+El resultado se guarda en PREVISION_FILE de forma compacta, como matrices
+[franja][municipio] de puntuaciones y niveles, para que la página web pueda
+recorrer la previsión con un deslizador sin descargar nada más. La
+precipitación de la previsión llega acumulada en 3 horas y se pasa a mm/h
+antes de puntuar, igual que en la observación actual.
+
+Como la ejecución normal, respeta OPENWEATHER_API_BASE, así que funciona
+contra el servidor simulado de benchmark.py. Cada ejecución hace una
+petición más por municipio.
+
+Uso:
+    python prevision.py               # Todas las franjas disponibles (5 días)
+    python prevision.py --franjas 8   # Solo las próximas 24 horas
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import esquema as esquema_mod
+import update_weather as uw
+
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+PREVISION_FILE = os.environ.get('PREVISION_FILE', 'data/prevision.json')
+
+# Franjas de 3 horas que se piden a la API (40 = 5 días, el máximo del plan gratuito)
+PREVISION_FRANJAS = int(os.environ.get('PREVISION_FRANJAS', '40'))
+PASO_HORAS = 3
+
+
+# ============================================================================
+# CONSULTA DE LA PREVISIÓN
+# ============================================================================
+
+def obtener_prevision(lat, lon, nombre_municipio, limitador=None, franjas=PREVISION_FRANJAS):
+    """
+    Obtiene la previsión en franjas de 3 horas de un punto.
+
+    Usa los mismos reintentos, límite de tasa y métricas que
+    obtener_datos_clima().
+
+    Returns:
+        Lista de franjas (cada una con `dt` y los mismos campos que una
+        respuesta de /weather), o None si la petición ha fallado
+    """
+    params = {
+        'lat': lat,
+        'lon': lon,
+        'appid': uw.OPENWEATHER_API_KEY,
+        'units': 'metric',
+        'lang': 'es',
+        'cnt': franjas
+    }
+    datos = uw.consultar_api('forecast', params, nombre_municipio, limitador)
+    if not datos or not isinstance(datos.get('list'), list) or not datos['list']:
+        return None
+    return datos['list']
+
+
+def _consultar_municipio(municipio, limitador, franjas):
+    """
+    Descarga la previsión de un municipio y la reduce en el momento a los
+    instantes y las variables del índice, para no guardar en memoria las
+    respuestas completas de todos los municipios.
+
+    Returns:
+        Tupla (instantes, variables), o None si no hay previsión
+    """
+    try:
+        lista = obtener_prevision(municipio['lat'], municipio['lon'], municipio['nombre'], limitador, franjas)
+        if lista is None:
+            return None
+        instantes = np.array([franja['dt'] for franja in lista], dtype=np.int64)
+        observaciones = [esquema_mod.ObservacionOWM.desde_respuesta(franja, f'{PASO_HORAS}h') for franja in lista]
+        return instantes, uw.extraer_variables(observaciones)
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"    ✗ Previsión con formato inesperado en {municipio['nombre']}: {e}")
+        return None
+
+
+# ============================================================================
+# PUNTUACIÓN DE TODAS LAS FRANJAS
+# ============================================================================
+
+def puntuar_prevision(previsiones, motor=None):
+    """
+    Puntúa a la vez todas las franjas de todos los municipios.
+
+    Args:
+        previsiones: Lista con una tupla (instantes, variables) por
+                     municipio, o None si no hay previsión
+        motor: MotorIndice con el que puntuar (por defecto, el de
+               obtener_motor_indice())
+
+    Returns:
+        Diccionario con:
+        - instantes: array con la unión ordenada de los instantes (unix)
+        - puntuacion, nivel: matrices [franja][municipio] de enteros, con
+          -1 donde el municipio no tiene esa franja
+        - temperatura: matriz [franja][municipio] con NaN en los huecos
+    """
+    motor = motor or uw.obtener_motor_indice()
+    con_datos = [(columna, p) for columna, p in enumerate(previsiones) if p is not None]
+
+    if not con_datos:
+        vacia = np.empty((0, len(previsiones)), dtype=np.int64)
+        return {'instantes': np.empty(0, dtype=np.int64), 'puntuacion': vacia, 'nivel': vacia.copy(),
+                'temperatura': vacia.astype(np.float64)}
+
+    instantes = np.unique(np.concatenate([p[0] for _, p in con_datos]))
+    filas = np.concatenate([np.searchsorted(instantes, p[0]) for _, p in con_datos])
+    columnas = np.concatenate([np.full(len(p[0]), columna) for columna, p in con_datos])
+    variables = {
+        variable: np.concatenate([p[1][variable] for _, p in con_datos])
+        for variable in con_datos[0][1][1]
+    }
+    puntos = motor.puntuar(variables)
+
+    forma = (len(instantes), len(previsiones))
+    puntuacion = np.full(forma, -1, dtype=np.int64)
+    nivel = np.full(forma, -1, dtype=np.int64)
+    temperatura = np.full(forma, np.nan)
+    puntuacion[filas, columnas] = puntos['puntuacion']
+    nivel[filas, columnas] = puntos['nivel']
+    temperatura[filas, columnas] = variables['temp']
+
+    return {'instantes': instantes, 'puntuacion': puntuacion, 'nivel': nivel, 'temperatura': temperatura}
+
+
+def _matriz_a_listas(matriz, hueco):
+    """Convierte una matriz en listas de listas con None en los huecos."""
+    return [[None if v == hueco or v != v else v for v in fila] for fila in matriz.tolist()]
+
+
+def construir_salida_prevision(claves, puntos, municipios_con_error, motor=None):
+    """
+    Construye el contenido de PREVISION_FILE.
+
+    Los niveles se guardan como índice en la lista `niveles` para que las
+    matrices ocupen poco; la página web obtiene de ahí el color y el mensaje.
+    """
+    motor = motor or uw.obtener_motor_indice()
+    temperatura = np.round(puntos['temperatura'], 1)
+    return {
+        'metadata': {
+            'generado': datetime.now().isoformat(),
+            'paso_horas': PASO_HORAS,
+            'franjas': len(puntos['instantes']),
+            'total_municipios': len(claves) - len(municipios_con_error),
+            'municipios_con_error': len(municipios_con_error),
+            'fuente_clima': 'OpenWeatherMap'
+        },
+        'instantes': puntos['instantes'].tolist(),
+        'niveles': [
+            {'nivel': n['nivel'], 'color': n['color'], 'mensaje': n['mensaje']}
+            for n in motor.niveles
+        ],
+        'claves': claves,
+        'puntuacion': _matriz_a_listas(puntos['puntuacion'], -1),
+        'nivel': _matriz_a_listas(puntos['nivel'], -1),
+        'temperatura': _matriz_a_listas(temperatura, None)
+    }
+
+
+def guardar_prevision(salida, ruta=PREVISION_FILE):
+    """
+    Escribe la previsión minificada (y sus variantes precomprimidas con
+    SALIDA_PRECOMPRIMIDA=1, como la salida columnar).
+
+    Returns:
+        Diccionario {ruta: tamaño en bytes} de los archivos escritos
+    """
+    return uw.escribir_con_variantes(ruta, esquema_mod.codificar_json(salida))
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+def ejecutar_prevision(franjas=PREVISION_FRANJAS, ruta=PREVISION_FILE):
+    """
+    Descarga, puntúa y guarda la previsión de todos los municipios.
+
+    Returns:
+        El contenido escrito en `ruta`
+    """
+    if not uw.OPENWEATHER_API_KEY:
+        print("❌ ERROR CRÍTICO: No se encontró OPENWEATHER_API_KEY")
+        sys.exit(1)
+
+    print("=" * 70)
+    print("🔮 PREVISIÓN DEL ÍNDICE DE BUEN TIEMPO")
+    print("=" * 70)
+
+    uw.metricas_ejecucion.reiniciar()
+    inicio = time.perf_counter()
+
+    hash_geojson, municipios, _, indice_nuevo = uw.preparar_municipios()
+    municipios = list(municipios)
+    if indice_nuevo is not None:
+        uw.guardar_indice_centroides(municipios, hash_geojson)
+
+    claves = []
+    validos = []
+    for posicion, municipio in enumerate(municipios):
+        if 'error' in municipio:
+            print(f"⚠️  Se omite {municipio['nombre']}: {municipio['error']}")
+            continue
+        claves.append(municipio.get('clave') or uw.clave_municipio(municipio['codigo_ine'], posicion))
+        validos.append(municipio)
+
+    print(f"📍 {len(validos)} municipios, {franjas} franjas de {PASO_HORAS} horas")
+    print("-" * 70)
+
+    limitador = uw.LimitadorTasa(uw.PETICIONES_POR_MINUTO, uw.RAFAGA_PETICIONES)
+    with uw.metricas_ejecucion.fase('consultas'):
+        with ThreadPoolExecutor(max_workers=max(1, uw.PETICIONES_CONCURRENTES)) as ejecutor:
+            previsiones = list(ejecutor.map(lambda m: _consultar_municipio(m, limitador, franjas), validos))
+
+    municipios_con_error = {
+        clave: municipio['nombre']
+        for clave, municipio, prevision in zip(claves, validos, previsiones) if prevision is None
+    }
+
+    with uw.metricas_ejecucion.fase('indice'):
+        puntos = puntuar_prevision(previsiones)
+
+    salida = construir_salida_prevision(claves, puntos, municipios_con_error)
+    with uw.metricas_ejecucion.fase('escritura'):
+        tamanos = guardar_prevision(salida, ruta)
+
+    # Las métricas se muestran pero no se guardan: METRICAS_FILE es de la
+    # ejecución normal
+    metricas = uw.metricas_ejecucion.resumen()
+    print("-" * 70)
+    for destino, tamano in tamanos.items():
+        print(f"✅ Previsión guardada en: {destino} ({tamano / 1024:.1f} KB)")
+    print(f"📊 {len(validos) - len(municipios_con_error)} municipios con previsión, "
+          f"{len(municipios_con_error)} con error, {len(puntos['instantes'])} franjas")
+    print(f"🌐 Peticiones a la API: {metricas['peticiones']['total']}, "
+          f"{metricas['contadores'].get('reintentos', 0)} reintentos")
+    print("⏱️  Tiempo por fase: " + ", ".join(
+        f"{fase} {segundos:.2f} s" for fase, segundos in metricas['fases_segundos'].items()
+    ) + f" (total {time.perf_counter() - inicio:.2f} s)")
+    return salida
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Previsión del índice de buen tiempo en franjas de 3 horas')
+    parser.add_argument('--franjas', type=int, default=PREVISION_FRANJAS,
+                        help='Franjas de 3 horas a consultar (máximo 40)')
+    parser.add_argument('--salida', default=PREVISION_FILE, help='Archivo de salida')
+    args = parser.parse_args()
+    ejecutar_prevision(args.franjas, args.salida)
+
+
+if __name__ == "__main__":
+    main()
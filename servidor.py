@@ -0,0 +1,565 @@
+"""
+Servidor HTTP local de los datos meteorológicos.
+
+La página web descarga data/weather_data.json completo en cada carga aunque
+no haya cambiado nada. Este módulo sirve los datos generados por
+update_weather.py desde memoria, con un servidor asyncio en un solo
+proceso, y ofrece además consultas más pequeñas:
+
+    GET /api/municipios              Todos los municipios (como weather_data.json)
+    GET /api/municipios/<clave>      Un municipio
+    GET /api/niveles/<nivel>         Los municipios de un nivel (verde, amarillo...)
+    GET /api/caja?lat_min=..&lon_min=..&lat_max=..&lon_max=..
+                                     Los municipios cuyo centroide está en la caja
+    GET /api/estado                  Estado de la última ejecución
+    GET /  y  /data/<archivo>        La página web y los archivos de data/
+
+Todas las respuestas llevan ETag (una petición con If-None-Match que
+coincide recibe un 304 sin cuerpo) y se sirven comprimidas en brotli o
+gzip según Accept-Encoding. Las respuestas fijas se preparan y comprimen
+una sola vez al cargar los datos, así que servir una petición es buscar en
+un diccionario y escribir bytes. De los archivos de data/ que tienen
+variantes precomprimidas (SALIDA_PRECOMPRIMIDA=1) se sirven esas. Lo que
+no se puede preparar de antemano (los archivos que cambian y las cajas de
+coordenadas) se lee y se comprime en un hilo aparte, sin detener el resto
+de conexiones.
+
+Cuando una ejecución nueva reescribe los archivos de datos, el servidor
+los vuelve a cargar en segundo plano y sustituye el conjunto en memoria de
+una sola vez (también con SIGHUP); las peticiones en curso terminan con
+los datos anteriores.
+
+Uso:
+    python servidor.py                       # http://127.0.0.1:8080
+    python servidor.py --host 0.0.0.0 --puerto 8000
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import math
+import os
+import signal
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+import esquema as esquema_mod
+import update_weather as uw
+
+try:
+    import brotli
+except ImportError:  # La compresión brotli es opcional
+    brotli = None
+
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SERVIDOR_HOST = os.environ.get('SERVIDOR_HOST', '127.0.0.1')
+SERVIDOR_PUERTO = int(os.environ.get('SERVIDOR_PUERTO', '8080'))
+
+# Segundos entre dos comprobaciones de si han cambiado los archivos de datos
+SERVIDOR_RECARGA = float(os.environ.get('SERVIDOR_RECARGA', '5'))
+
+# Los cuerpos más pequeños se sirven sin comprimir (no compensa)
+TAMANO_MINIMO_COMPRESION = 1024
+
+# Nivel de gzip de las respuestas de caja: se generan en cada petición
+# nueva y casi nunca se repiten, así que no compensa comprimirlas al máximo
+GZIP_NIVEL_CAJA = 1
+
+# Archivos estáticos que se pueden servir (relativos al directorio de
+# trabajo, como las rutas de update_weather.py) y su tipo de contenido
+DIRECTORIO_RAIZ = '.'
+TIPOS_ESTATICOS = {
+    '.html': 'text/html; charset=utf-8',
+    '.json': 'application/json',
+    '.topojson': 'application/json'
+}
+
+TIPO_JSON = 'application/json'
+
+MENSAJES_HTTP = {
+    200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 411: 'Length Required', 500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+
+# ============================================================================
+# RESPUESTAS PREPARADAS
+# ============================================================================
+
+def _json_compacto(valor):
+    return esquema_mod.codificar_json(valor)
+
+
+class Respuesta:
+    """
+    Cuerpo de una respuesta con su ETag y sus variantes comprimidas.
+
+    El ETag se calcula a partir del contenido, así que un municipio que no
+    ha cambiado conserva su ETag aunque se carguen datos nuevos. Es un ETag
+    débil porque las variantes comprimidas comparten el mismo valor.
+    """
+
+    __slots__ = ('cuerpo', 'gzip', 'br', 'etag', 'tipo')
+
+    def __init__(self, cuerpo, tipo=TIPO_JSON, comprimir=True, variantes=None):
+        """
+        Args:
+            variantes: Tupla (gzip, br) ya comprimida (por ejemplo, los
+                       archivos precomprimidos de data/), con None en las
+                       que falten; si se da, no se comprime nada
+        """
+        self.cuerpo = cuerpo
+        self.tipo = tipo
+        self.etag = f'W/"{hashlib.sha1(cuerpo).hexdigest()[:20]}"'
+        self.gzip = self.br = None
+        if variantes is not None:
+            self.gzip, self.br = variantes
+        elif comprimir and len(cuerpo) >= TAMANO_MINIMO_COMPRESION:
+            self.gzip = gzip.compress(cuerpo, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(cuerpo, quality=11)
+
+    def variante(self, codificaciones):
+        """Devuelve (cuerpo, Content-Encoding o None) según las codificaciones aceptadas."""
+        if self.br is not None and 'br' in codificaciones:
+            return self.br, 'br'
+        if self.gzip is not None and 'gzip' in codificaciones:
+            return self.gzip, 'gzip'
+        return self.cuerpo, None
+
+
+def _respuesta_error(mensaje):
+    return Respuesta(_json_compacto({'error': mensaje}), comprimir=False)
+
+
+class ConjuntoDatos:
+    """
+    Datos de una ejecución preparados para servirlos.
+
+    Las respuestas de municipios, niveles y estado se generan al crear el
+    conjunto; las de caja se calculan en cada petición filtrando los
+    centroides con NumPy, se comprimen solo con gzip rápido y se guardan en
+    un pequeño diccionario por si se repiten.
+    """
+
+    MAXIMO_CAJAS_GUARDADAS = 256
+
+    def __init__(self, datos, estado=None):
+        municipios = datos.get('municipios', {})
+        self.municipios = municipios
+        self.respuestas = {'/api/municipios': Respuesta(_json_compacto(datos))}
+
+        por_nivel = {nivel['nivel']: {} for nivel in uw.obtener_motor_indice().niveles}
+        for clave, municipio in municipios.items():
+            self.respuestas[f'/api/municipios/{clave}'] = Respuesta(_json_compacto(dict(municipio, clave=clave)))
+            por_nivel.setdefault(municipio['indice']['nivel'], {})[clave] = municipio
+        for nivel, seleccion in por_nivel.items():
+            self.respuestas[f'/api/niveles/{nivel}'] = Respuesta(
+                _json_compacto({'nivel': nivel, 'municipios': seleccion})
+            )
+        if estado is not None:
+            self.respuestas['/api/estado'] = Respuesta(_json_compacto(estado))
+
+        self._claves = list(municipios)
+        self._lat = np.array([m['coordenadas']['lat'] for m in municipios.values()], dtype=np.float64)
+        self._lon = np.array([m['coordenadas']['lon'] for m in municipios.values()], dtype=np.float64)
+        self._cajas = {}
+
+    @classmethod
+    def desde_archivos(cls, ruta_datos=uw.OUTPUT_FILE, ruta_estado=uw.ESTADO_FILE):
+        """
+        Carga los archivos generados por update_weather.py.
+
+        Raises:
+            OSError, ValueError: Si el archivo de datos no existe o no es válido
+        """
+        datos = esquema_mod.leer_json(ruta_datos)
+        try:
+            estado = esquema_mod.leer_json(ruta_estado)
+        except (OSError, ValueError):
+            estado = None
+        return cls(datos, estado)
+
+    @staticmethod
+    def limites_caja(consulta):
+        """
+        Límites (lat_min, lon_min, lat_max, lon_max) de una consulta de caja.
+
+        Args:
+            consulta: Diccionario de parámetros de la URL
+
+        Raises:
+            ValueError: Si falta algún parámetro o no es un número válido
+        """
+        try:
+            limites = tuple(float(consulta[nombre][0]) for nombre in ('lat_min', 'lon_min', 'lat_max', 'lon_max'))
+        except (KeyError, ValueError):
+            raise ValueError("La caja necesita lat_min, lon_min, lat_max y lon_max numéricos")
+        if not all(math.isfinite(valor) for valor in limites):
+            raise ValueError("Los límites de la caja deben ser números finitos")
+        return limites
+
+    def caja_guardada(self, limites):
+        """Respuesta de una caja ya calculada, o None."""
+        return self._cajas.get(limites)
+
+    def guardar_caja(self, limites, respuesta):
+        """
+        Guarda la respuesta de una caja. Solo se llama desde el bucle de
+        eventos, así que el diccionario no necesita cerrojo.
+        """
+        if len(self._cajas) >= self.MAXIMO_CAJAS_GUARDADAS:
+            self._cajas.clear()
+        self._cajas[limites] = respuesta
+
+    def caja(self, limites):
+        """
+        Calcula la respuesta con los municipios cuyo centroide está dentro de
+        la caja. Se llama fuera del bucle de eventos y no modifica el
+        conjunto; la respuesta se guarda después con guardar_caja().
+        """
+        lat_min, lon_min, lat_max, lon_max = limites
+        dentro = np.flatnonzero((self._lat >= lat_min) & (self._lat <= lat_max)
+                                & (self._lon >= lon_min) & (self._lon <= lon_max))
+        seleccion = {self._claves[i]: self.municipios[self._claves[i]] for i in dentro.tolist()}
+        cuerpo = _json_compacto({'municipios': seleccion})
+        comprimido = None
+        if len(cuerpo) >= TAMANO_MINIMO_COMPRESION:
+            comprimido = gzip.compress(cuerpo, compresslevel=GZIP_NIVEL_CAJA, mtime=0)
+        return Respuesta(cuerpo, variantes=(comprimido, None))
+
+
+class ArchivosEstaticos:
+    """
+    Caché en memoria de la página web y de los archivos de data/, que se
+    recarga cuando cambia el tamaño o la fecha de modificación del archivo.
+
+    Si junto a un archivo están sus variantes precomprimidas (`.gz` y `.br`,
+    generadas con SALIDA_PRECOMPRIMIDA=1) y no son más antiguas que él, se
+    sirven esas en lugar de volver a comprimirlo.
+
+    La lectura y la compresión se hacen en un hilo aparte para no detener
+    el bucle de eventos; las peticiones simultáneas del mismo archivo
+    esperan a la misma carga.
+    """
+
+    def __init__(self, raiz=DIRECTORIO_RAIZ):
+        self.raiz = os.path.realpath(raiz)
+        self._cache = {}
+        self._cargando = {}
+
+    async def obtener(self, ruta_url):
+        """Respuesta del archivo, o None si no existe o no se puede servir."""
+        relativa = 'index.html' if ruta_url == '/' else ruta_url.lstrip('/')
+        if not (relativa == 'index.html' or relativa.startswith('data/')):
+            return None
+        tipo = TIPOS_ESTATICOS.get(os.path.splitext(relativa)[1])
+        ruta = os.path.realpath(os.path.join(self.raiz, relativa))
+        if tipo is None or not ruta.startswith(os.path.join(self.raiz, '')):
+            return None
+
+        try:
+            informacion = os.stat(ruta)
+        except OSError:
+            return None
+        firma = (informacion.st_mtime_ns, informacion.st_size)
+        guardado = self._cache.get(ruta)
+        if guardado is not None and guardado[0] == firma:
+            return guardado[1]
+
+        clave = (ruta, firma)
+        carga = self._cargando.get(clave)
+        if carga is None:
+            carga = asyncio.get_running_loop().run_in_executor(
+                None, self._cargar, ruta, tipo, informacion.st_mtime_ns
+            )
+            self._cargando[clave] = carga
+            carga.add_done_callback(lambda _: self._cargando.pop(clave, None))
+        try:
+            # shield: si se cierra la conexión, la carga sigue para las demás
+            respuesta = await asyncio.shield(carga)
+        except OSError:
+            return None
+        self._cache[ruta] = (firma, respuesta)
+        return respuesta
+
+    @staticmethod
+    def _leer_precomprimido(ruta, mtime_minimo):
+        """Contenido de una variante precomprimida, o None si no existe o está desfasada."""
+        try:
+            if os.stat(ruta).st_mtime_ns < mtime_minimo:
+                return None
+            with open(ruta, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _cargar(self, ruta, tipo, mtime):
+        with open(ruta, 'rb') as f:
+            cuerpo = f.read()
+        variantes = (self._leer_precomprimido(f"{ruta}.gz", mtime),
+                     self._leer_precomprimido(f"{ruta}.br", mtime))
+        if variantes == (None, None):
+            return Respuesta(cuerpo, tipo)
+        return Respuesta(cuerpo, tipo, variantes=variantes)
+
+
+# ============================================================================
+# SERVIDOR
+# ============================================================================
+
+def _codificaciones_aceptadas(cabecera):
+    """Codificaciones de Accept-Encoding, sin las marcadas con q=0."""
+    aceptadas = set()
+    for parte in cabecera.split(','):
+        nombre, _, parametros = parte.strip().partition(';')
+        if parametros.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        aceptadas.add(nombre.strip().lower())
+    return aceptadas
+
+
+def _coincide_etag(cabecera, etag):
+    """Comparación débil de If-None-Match con el ETag de la respuesta."""
+    if cabecera.strip() == '*':
+        return True
+    valor = etag[2:] if etag.startswith('W/') else etag
+    return any(
+        (parte.strip()[2:] if parte.strip().startswith('W/') else parte.strip()) == valor
+        for parte in cabecera.split(',')
+    )
+
+
+class ServidorDatos:
+    """
+    Servidor HTTP/1.1 asyncio con conexiones persistentes.
+
+    Uso:
+        servidor = ServidorDatos()
+        asyncio.run(servidor.servir('127.0.0.1', 8080))
+    """
+
+    def __init__(self, ruta_datos=uw.OUTPUT_FILE, ruta_estado=uw.ESTADO_FILE, raiz=DIRECTORIO_RAIZ,
+                 recarga=SERVIDOR_RECARGA):
+        self.ruta_datos = ruta_datos
+        self.ruta_estado = ruta_estado
+        self.recarga = recarga
+        self.datos = None
+        self.estaticos = ArchivosEstaticos(raiz)
+        self.peticiones = 0
+        self._firma = None
+
+    def _firma_archivos(self):
+        firma = []
+        for ruta in (self.ruta_datos, self.ruta_estado):
+            try:
+                informacion = os.stat(ruta)
+                firma.append((informacion.st_mtime_ns, informacion.st_size))
+            except OSError:
+                firma.append(None)
+        return tuple(firma)
+
+    async def recargar(self, forzar=False):
+        """
+        Vuelve a cargar los datos si los archivos han cambiado. La carga se
+        hace en un hilo aparte y el conjunto se sustituye de una vez.
+        """
+        firma = self._firma_archivos()
+        if firma == self._firma and not forzar:
+            return
+        try:
+            nuevos = await asyncio.get_running_loop().run_in_executor(
+                None, ConjuntoDatos.desde_archivos, self.ruta_datos, self.ruta_estado
+            )
+        except (OSError, ValueError) as e:
+            print(f"⚠️  No se pudieron cargar los datos de {self.ruta_datos}: {e}")
+            return
+        self.datos = nuevos
+        self._firma = firma
+        print(f"🔄 Datos cargados: {len(nuevos.municipios)} municipios, {len(nuevos.respuestas)} respuestas preparadas")
+
+    async def _vigilar(self, aviso):
+        """Comprueba periódicamente los archivos y recarga cuando cambian o llega SIGHUP."""
+        while True:
+            try:
+                await asyncio.wait_for(aviso.wait(), self.recarga)
+            except asyncio.TimeoutError:
+                pass
+            forzar = aviso.is_set()
+            aviso.clear()
+            await self.recargar(forzar)
+
+    async def responder(self, metodo, objetivo, cabeceras):
+        """
+        Resuelve una petición.
+
+        Args:
+            metodo: Método HTTP
+            objetivo: Ruta y consulta de la petición
+            cabeceras: Diccionario de cabeceras con los nombres en minúsculas
+
+        Returns:
+            Tupla (código, lista de cabeceras, cuerpo)
+        """
+        if metodo not in ('GET', 'HEAD'):
+            return self._completar(405, _respuesta_error('Método no permitido'), cabeceras, metodo,
+                                   [('Allow', 'GET, HEAD')])
+
+        partes = urlsplit(objetivo)
+        ruta = unquote(partes.path)
+        if ruta.startswith('/api/'):
+            datos = self.datos
+            if datos is None:
+                return self._completar(503, _respuesta_error('Datos no disponibles todavía'), cabeceras, metodo)
+            if ruta == '/api/caja':
+                try:
+                    limites = datos.limites_caja(parse_qs(partes.query))
+                except ValueError as e:
+                    return self._completar(400, _respuesta_error(str(e)), cabeceras, metodo)
+                respuesta = datos.caja_guardada(limites)
+                if respuesta is None:
+                    respuesta = await asyncio.get_running_loop().run_in_executor(None, datos.caja, limites)
+                    datos.guardar_caja(limites, respuesta)
+            else:
+                respuesta = datos.respuestas.get(ruta.rstrip('/'))
+        else:
+            respuesta = await self.estaticos.obtener(ruta)
+
+        if respuesta is None:
+            return self._completar(404, _respuesta_error('No encontrado'), cabeceras, metodo)
+        return self._completar(200, respuesta, cabeceras, metodo)
+
+    @staticmethod
+    def _completar(codigo, respuesta, cabeceras, metodo, extra=()):
+        encabezados = [('Content-Type', respuesta.tipo), ('Vary', 'Accept-Encoding'),
+                       ('Access-Control-Allow-Origin', '*'), *extra]
+        if codigo == 200:
+            # Sin max-age: el navegador revalida siempre con If-None-Match
+            encabezados += [('ETag', respuesta.etag), ('Cache-Control', 'no-cache')]
+            if _coincide_etag(cabeceras.get('if-none-match', ''), respuesta.etag):
+                return 304, [('ETag', respuesta.etag), ('Vary', 'Accept-Encoding')], b''
+
+        cuerpo, codificacion = respuesta.variante(_codificaciones_aceptadas(cabeceras.get('accept-encoding', '')))
+        if codificacion is not None:
+            encabezados.append(('Content-Encoding', codificacion))
+        encabezados.append(('Content-Length', str(len(cuerpo))))
+        return codigo, encabezados, b'' if metodo == 'HEAD' else cuerpo
+
+    async def _atender(self, lector, escritor):
+        """Atiende las peticiones de una conexión hasta que se cierra."""
+        try:
+            while True:
+                try:
+                    bloque = await lector.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+
+                lineas = bloque.decode('latin-1').split('\r\n')
+                try:
+                    metodo, objetivo, version = lineas[0].split(' ')
+                except ValueError:
+                    escritor.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                cabeceras = {}
+                for linea in lineas[1:]:
+                    nombre, separador, valor = linea.partition(':')
+                    if separador:
+                        cabeceras[nombre.strip().lower()] = valor.strip()
+
+                conexion = cabeceras.get('connection', '').lower()
+                persistente = conexion != 'close' if version == 'HTTP/1.1' else conexion == 'keep-alive'
+
+                # Las peticiones con cuerpo no se usan: se lee y se descarta.
+                # Un cuerpo por trozos no se decodifica; como no se puede saber
+                # dónde acaba, se rechaza y se cierra la conexión
+                if 'transfer-encoding' in cabeceras:
+                    codigo, encabezados, cuerpo = self._completar(
+                        411, _respuesta_error('Se necesita Content-Length'), cabeceras, metodo
+                    )
+                    persistente = False
+                else:
+                    longitud = cabeceras.get('content-length', '0')
+                    if longitud.isdigit() and int(longitud):
+                        await lector.readexactly(int(longitud))
+                    try:
+                        codigo, encabezados, cuerpo = await self.responder(metodo, objetivo, cabeceras)
+                    except Exception as e:
+                        print(f"❌ Error al atender {metodo} {objetivo}: {e!r}")
+                        codigo, encabezados, cuerpo = self._completar(
+                            500, _respuesta_error('Error interno del servidor'), cabeceras, metodo
+                        )
+
+                self.peticiones += 1
+                cabecera = [f'HTTP/1.1 {codigo} {MENSAJES_HTTP[codigo]}']
+                cabecera += [f'{nombre}: {valor}' for nombre, valor in encabezados]
+                if not persistente:
+                    cabecera.append('Connection: close')
+                escritor.write(('\r\n'.join(cabecera) + '\r\n\r\n').encode('latin-1') + cuerpo)
+                await escritor.drain()
+                if not persistente:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+
+    async def servir(self, host=SERVIDOR_HOST, puerto=SERVIDOR_PUERTO, listo=None):
+        """
+        Carga los datos y atiende peticiones hasta que se cancela la tarea.
+
+        Args:
+            listo: Función opcional a la que se llama con el servidor asyncio
+                   cuando ya acepta conexiones
+        """
+        await self.recargar(forzar=True)
+        aviso = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, aviso.set)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass  # Sin señales (Windows o fuera del hilo principal): solo sondeo
+        vigilancia = asyncio.create_task(self._vigilar(aviso))
+
+        servidor = await asyncio.start_server(self._atender, host, puerto)
+        if listo is not None:
+            listo(servidor)
+        try:
+            async with servidor:
+                await servidor.serve_forever()
+        finally:
+            vigilancia.cancel()
+
+
+# ============================================================================
+# PUNTO DE ENTRADA DEL SCRIPT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor HTTP local de los datos meteorológicos')
+    parser.add_argument('--host', default=SERVIDOR_HOST, help='Dirección en la que escuchar')
+    parser.add_argument('--puerto', type=int, default=SERVIDOR_PUERTO, help='Puerto en el que escuchar')
+    args = parser.parse_args()
+
+    servidor = ServidorDatos()
+
+    def listo(servidor_asyncio):
+        direccion = servidor_asyncio.sockets[0].getsockname()
+        print(f"🌐 Sirviendo {servidor.ruta_datos} en http://{direccion[0]}:{direccion[1]}/ (Ctrl+C para detener)")
+
+    try:
+        asyncio.run(servidor.servir(args.host, args.puerto, listo))
+    except KeyboardInterrupt:
+        print(f"\n⏹️  Servidor detenido ({servidor.peticiones} peticiones atendidas)")
+
+
+if __name__ == "__main__":
+    main()
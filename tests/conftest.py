@@ -0,0 +1,14 @@
+"""
+Configuración común de las pruebas.
+
+Los módulos del proyecto están en la raíz del repositorio (no es un
+paquete instalable), así que se añade al path para poder importarlos.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,154 @@
+"""
+Pruebas del archivo de diferencias entre ejecuciones: tolerancias de
+calcular_delta() y comportamiento de guardar_resultados() en la primera
+ejecución y en las siguientes.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import os
+
+import pytest
+
+import esquema as esquema_mod
+import update_weather as uw
+
+
+TOLERANCIAS = {'temperatura': 0.5, 'sensacion': 0.5, 'humedad': 5, 'viento': 2}
+
+
+def _municipio(codigo='28005', temp=21.0, sensacion=20.0, humedad=48, viento_ms=2.5, descripcion='cielo claro'):
+    """Datos de un municipio tal como se guardan en weather_data.json."""
+    observacion = esquema_mod.ObservacionOWM.desde_respuesta({
+        'main': {'temp': temp, 'feels_like': sensacion, 'humidity': humedad},
+        'wind': {'speed': viento_ms},
+        'weather': [{'description': descripcion, 'icon': '01d'}]
+    })
+    entrada = {'nombre': f'Municipio {codigo}', 'codigo_ine': codigo, 'lat': 40.48, 'lon': -3.36}
+    return uw.construir_datos_municipio(entrada, observacion, uw.calcular_indice_tiempo(observacion))
+
+
+def _con_clima(datos, **clima):
+    return dict(datos, clima=dict(datos['clima'], **clima))
+
+
+def _resultado(procesados):
+    return {'procesados': procesados, 'errores': {}, 'observaciones': [], 'informe_rejilla': None}
+
+
+# ============================================================================
+# TOLERANCIAS
+# ============================================================================
+
+@pytest.mark.parametrize('campo', list(TOLERANCIAS))
+def test_cambio_por_debajo_de_la_tolerancia_no_cuenta(campo):
+    anterior = _municipio()
+    nuevo = _con_clima(anterior, **{campo: anterior['clima'][campo] + TOLERANCIAS[campo] * 0.9})
+    nuevo['indice'] = anterior['indice']
+    delta = uw.calcular_delta({'a': anterior}, {'a': nuevo}, TOLERANCIAS)
+    assert delta == {'cambios': {}, 'nuevos': [], 'eliminados': []}
+
+
+@pytest.mark.parametrize('campo', list(TOLERANCIAS))
+@pytest.mark.parametrize('signo', [1, -1])
+def test_cambio_igual_a_la_tolerancia_cuenta(campo, signo):
+    anterior = _municipio()
+    antes = anterior['clima'][campo]
+    nuevo = _con_clima(anterior, **{campo: antes + signo * TOLERANCIAS[campo]})
+    nuevo['indice'] = anterior['indice']
+    delta = uw.calcular_delta({'a': anterior}, {'a': nuevo}, TOLERANCIAS)
+    assert delta['cambios'] == {'a': {campo: [antes, antes + signo * TOLERANCIAS[campo]]}}
+
+
+def test_cambio_de_indice_cuenta_siempre():
+    anterior = _municipio()
+    nuevo = dict(anterior, indice=dict(anterior['indice'], puntuacion=anterior['indice']['puntuacion'] - 10,
+                                       nivel='amarillo'))
+    cambios = uw.calcular_delta({'a': anterior}, {'a': nuevo}, TOLERANCIAS)['cambios']
+    assert cambios == {'a': {'nivel': [anterior['indice']['nivel'], 'amarillo'],
+                             'puntuacion': [anterior['indice']['puntuacion'], anterior['indice']['puntuacion'] - 10]}}
+
+
+def test_descripcion_e_icono_no_cuentan():
+    anterior = _municipio()
+    nuevo = _con_clima(anterior, descripcion='nubes dispersas', icono='03d')
+    assert uw.calcular_delta({'a': anterior}, {'a': nuevo}, TOLERANCIAS)['cambios'] == {}
+
+
+def test_tolerancias_configurables():
+    anterior = _municipio()
+    nuevo = _con_clima(anterior, temperatura=anterior['clima']['temperatura'] + 0.3)
+    nuevo['indice'] = anterior['indice']
+    assert uw.calcular_delta({'a': anterior}, {'a': nuevo}, TOLERANCIAS)['cambios'] == {}
+    assert 'a' in uw.calcular_delta({'a': anterior}, {'a': nuevo}, dict(TOLERANCIAS, temperatura=0.2))['cambios']
+
+
+def test_municipios_nuevos_y_eliminados():
+    datos = _municipio()
+    delta = uw.calcular_delta({'a': datos, 'b': datos}, {'b': datos, 'c': datos, 'd': datos}, TOLERANCIAS)
+    assert delta == {'cambios': {}, 'nuevos': ['c', 'd'], 'eliminados': ['a']}
+
+
+# ============================================================================
+# PRIMERA EJECUCIÓN Y SIGUIENTES
+# ============================================================================
+
+@pytest.fixture
+def directorio(tmp_path, monkeypatch):
+    """Ejecuta guardar_resultados() en un directorio vacío y sin histórico."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    monkeypatch.setattr(uw, 'HISTORICO_ACTIVO', False)
+    monkeypatch.setattr(uw, 'FORZAR_ESCRITURA', False)
+    return tmp_path
+
+
+def test_primera_ejecucion_todos_nuevos(directorio):
+    procesados = {'28005': _municipio('28005'), '28079': _municipio('28079', temp=25)}
+    estado = uw.guardar_resultados(_resultado(procesados))
+
+    assert estado['cambios_apreciables'] is True
+    assert estado['municipios_modificados'] == 0
+    assert esquema_mod.leer_json(uw.DELTA_FILE) == {'cambios': {}, 'nuevos': ['28005', '28079'], 'eliminados': []}
+    assert esquema_mod.leer_json(uw.OUTPUT_FILE)['municipios'] == procesados
+    assert esquema_mod.leer_json(uw.ESTADO_FILE) == estado
+
+
+def test_salida_anterior_no_valida_cuenta_como_primera_ejecucion(directorio):
+    with open(uw.OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        f.write('[{"type": "Feature"}]')
+    assert uw.cargar_salida_anterior() is None
+    estado = uw.guardar_resultados(_resultado({'28005': _municipio()}))
+    assert estado['cambios_apreciables'] is True
+    assert esquema_mod.leer_json(uw.DELTA_FILE)['nuevos'] == ['28005']
+
+
+def test_sin_cambios_apreciables_se_conserva_la_salida(directorio):
+    uw.guardar_resultados(_resultado({'28005': _municipio()}))
+    with open(uw.OUTPUT_FILE, 'rb') as f:
+        original = f.read()
+    delta_original = esquema_mod.leer_json(uw.DELTA_FILE)
+
+    # Cambio por debajo de las tolerancias configuradas y con el mismo índice
+    tolerancias = uw.TOLERANCIAS_CAMBIO
+    estado = uw.guardar_resultados(_resultado({'28005': _municipio(
+        temp=21 + tolerancias['temperatura'] / 2, humedad=48 + tolerancias['humedad'] // 2
+    )}))
+    assert estado['cambios_apreciables'] is False
+    with open(uw.OUTPUT_FILE, 'rb') as f:
+        assert f.read() == original
+    assert esquema_mod.leer_json(uw.DELTA_FILE) == delta_original
+
+
+def test_cambio_apreciable_reescribe_la_salida(directorio):
+    uw.guardar_resultados(_resultado({'28005': _municipio(), '28079': _municipio('28079')}))
+    humedad = 48 + uw.TOLERANCIAS_CAMBIO['humedad']
+    estado = uw.guardar_resultados(_resultado({'28005': _municipio(humedad=humedad), '28006': _municipio('28006')}))
+
+    assert estado['cambios_apreciables'] is True
+    assert estado['municipios_modificados'] == 1
+    assert esquema_mod.leer_json(uw.DELTA_FILE) == {
+        'cambios': {'28005': {'humedad': [48, humedad]}}, 'nuevos': ['28006'], 'eliminados': ['28079']
+    }
+    assert set(esquema_mod.leer_json(uw.OUTPUT_FILE)['municipios']) == {'28005', '28006'}
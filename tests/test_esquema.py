@@ -0,0 +1,109 @@
+"""
+Pruebas de esquema.py: validación de las respuestas de la API y
+equivalencia de los dos backends de JSON (orjson y el módulo estándar).
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import json
+
+import pytest
+
+import esquema as esquema_mod
+import update_weather as uw
+
+
+BACKENDS = [False] + ([True] if esquema_mod.orjson is not None else [])
+
+
+def _respuesta(**cambios):
+    datos = {
+        'coord': {'lon': -3.70, 'lat': 40.42},
+        'main': {'temp': 21.37, 'feels_like': 20, 'humidity': 48, 'pressure': 1015},
+        'wind': {'speed': 3.6, 'deg': 240},
+        'weather': [{'id': 800, 'description': 'cielo claro', 'icon': '01d'}],
+        'rain': {'1h': 0.25}
+    }
+    datos.update(cambios)
+    return datos
+
+
+def _documento():
+    """Documento con la forma de weather_data.json y valores difíciles."""
+    observacion = esquema_mod.ObservacionOWM.desde_respuesta(_respuesta())
+    municipio = {'nombre': 'Alcalá de Henares', 'codigo_ine': '28005', 'lat': 40.4818, 'lon': -3.3643}
+    datos = uw.construir_datos_municipio(municipio, observacion, uw.calcular_indice_tiempo(observacion))
+    return {
+        'metadata': {'total_municipios': 2, 'version_script': '2.0', 'vacio': {}, 'lista': []},
+        'municipios': {'28005': datos, '28079': dict(datos, nombre='Madrid')},
+        'numeros': [0, -0.0, 1e-05, 1e16, 0.1 + 0.2, 123456789012, 2.5, None, True],
+        'texto': 'ñ "comillas" \\ barra \n salto é 🌦️'
+    }
+
+
+# ============================================================================
+# CODIFICACIÓN JSON
+# ============================================================================
+
+@pytest.mark.parametrize('rapido', BACKENDS)
+@pytest.mark.parametrize('sangria', [None, 2])
+def test_backends_equivalentes_al_decodificar(monkeypatch, rapido, sangria):
+    monkeypatch.setattr(esquema_mod, 'JSON_RAPIDO', rapido)
+    documento = _documento()
+    codificado = esquema_mod.codificar_json(documento, sangria)
+    assert json.loads(codificado) == documento
+    assert esquema_mod.decodificar_json(codificado) == documento
+
+
+@pytest.mark.parametrize('rapido', BACKENDS)
+def test_codificacion_en_flujo_igual_a_la_completa(monkeypatch, rapido):
+    monkeypatch.setattr(esquema_mod, 'JSON_RAPIDO', rapido)
+    documento = _documento()
+    assert b''.join(esquema_mod.codificar_json_en_flujo(documento)) == esquema_mod.codificar_json(documento, 2)
+    assert b''.join(esquema_mod.codificar_json_en_flujo({})) == b'{}'
+
+
+def test_sangria_distinta_de_dos_usa_el_modulo_estandar():
+    documento = _documento()
+    esperado = json.dumps(documento, ensure_ascii=False, indent=1).encode('utf-8')
+    assert esquema_mod.codificar_json(documento, 1) == esperado
+
+
+# ============================================================================
+# RESPUESTAS DE OPENWEATHERMAP
+# ============================================================================
+
+def test_respuesta_valida():
+    observacion = esquema_mod.ObservacionOWM.desde_respuesta(_respuesta(snow={'1h': 0.5}))
+    assert (observacion.temp, observacion.sensacion, observacion.humedad) == (21.37, 20, 48)
+    assert (observacion.viento, observacion.lluvia, observacion.nieve) == (3.6, 0.25, 0.5)
+    assert (observacion.descripcion, observacion.icono) == ('cielo claro', '01d')
+    assert esquema_mod.ObservacionOWM.desde_respuesta(observacion.a_respuesta()) == observacion
+    assert esquema_mod.ObservacionOWM.desde_valor(observacion) is observacion
+
+
+def test_precipitacion_de_la_prevision_en_mm_por_hora():
+    franja = _respuesta(rain={'3h': 1.5})
+    assert esquema_mod.ObservacionOWM.desde_respuesta(franja, '3h').lluvia == 0.5
+    assert esquema_mod.ObservacionOWM.desde_respuesta(franja).lluvia == 0
+
+
+@pytest.mark.parametrize('cambios', [
+    {'main': {'temp': 20, 'humidity': 50}},
+    {'main': {'temp': True, 'feels_like': 20, 'humidity': 50}},
+    {'main': {'temp': float('nan'), 'feels_like': 20, 'humidity': 50}},
+    {'wind': {'speed': '3'}},
+    {'weather': []},
+    {'weather': [{'description': None, 'icon': '01d'}]},
+    {'rain': [0.2]},
+    {'rain': {'1h': float('inf')}},
+])
+def test_respuesta_invalida(cambios):
+    with pytest.raises(esquema_mod.RespuestaInvalida):
+        esquema_mod.ObservacionOWM.desde_respuesta(_respuesta(**cambios))
+
+
+def test_observacion_no_hashable():
+    with pytest.raises(TypeError):
+        hash(esquema_mod.ObservacionOWM.desde_respuesta(_respuesta()))
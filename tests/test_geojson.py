@@ -0,0 +1,117 @@
+"""
+Pruebas de la lectura incremental del GeoJSON (iterar_features).
+
+El resultado tiene que ser el mismo que el de json.load para cualquier
+tamaño de bloque, incluidos los más pequeños, con los que casi todos los
+valores (números, cadenas con escapes, claves) quedan cortados entre dos
+bloques.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import json
+import random
+
+import pytest
+
+import update_weather as uw
+
+
+TAMANOS_BLOQUE = [1, 2, 3, 7, 64, 1 << 16]
+
+
+def _feature(azar, indice):
+    """Feature con un polígono aleatorio y propiedades con valores difíciles."""
+    anillo = [[round(azar.uniform(-4.6, -3.0), azar.randint(0, 9)), round(azar.uniform(39.8, 41.2), 7)]
+              for _ in range(azar.randint(3, 12))]
+    anillo.append(anillo[0])
+    return {
+        'type': 'Feature',
+        'properties': {
+            'NAMEUNIT': f'Municipio "{indice}" [{{raro}}], ñ é 🌦️ \\ /',
+            'NATCODE': f'3413280{indice:04d}',
+            'numeros': [0, -0.0, 2.5, -1e-07, 1.5e+16, 123456789012, True, None],
+            'vacio': {}
+        },
+        'geometry': {'type': 'Polygon', 'coordinates': [anillo]}
+    }
+
+
+def _coleccion(cantidad=40, semilla=11):
+    azar = random.Random(semilla)
+    return {
+        'type': 'FeatureCollection',
+        'name': 'municipios',
+        # Números de primer nivel: cortados por un bloque, raw_decode los
+        # aceptaría como números más cortos
+        'total': 123456789,
+        'escala': -0.000125,
+        'exponente': 1.5e+300,
+        'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'}},
+        'features': [_feature(azar, indice) for indice in range(cantidad)]
+    }
+
+
+def _escribir(tmp_path, texto, nombre='municipios.geojson'):
+    ruta = tmp_path / nombre
+    ruta.write_text(texto, encoding='utf-8')
+    return str(ruta)
+
+
+# ============================================================================
+# PRUEBAS
+# ============================================================================
+
+@pytest.mark.parametrize('tamano_bloque', TAMANOS_BLOQUE)
+@pytest.mark.parametrize('formato', [
+    {'ensure_ascii': False},
+    {'ensure_ascii': True, 'indent': 2},
+    {'ensure_ascii': False, 'separators': (',', ':')},
+])
+def test_igual_que_json_load(tmp_path, tamano_bloque, formato):
+    ruta = _escribir(tmp_path, json.dumps(_coleccion(), **formato))
+    with open(ruta, encoding='utf-8') as f:
+        esperado = json.load(f)['features']
+    assert list(uw.iterar_features(ruta, tamano_bloque)) == esperado
+
+
+@pytest.mark.parametrize('tamano_bloque', TAMANOS_BLOQUE)
+def test_claves_despues_de_features_y_espacios(tmp_path, tamano_bloque):
+    coleccion = _coleccion(5)
+    texto = ('\n { "features" :\r\n [ ' + ' ,\n\t'.join(json.dumps(f) for f in coleccion['features'])
+             + ' ] , "type": "FeatureCollection", "bbox": [1.5, 2.25] }\n')
+    ruta = _escribir(tmp_path, texto)
+    assert list(uw.iterar_features(ruta, tamano_bloque)) == coleccion['features']
+
+
+@pytest.mark.parametrize('tamano_bloque', [1, 1 << 16])
+def test_coleccion_vacia(tmp_path, tamano_bloque):
+    ruta = _escribir(tmp_path, '{"type": "FeatureCollection", "features": [ ]}')
+    assert list(uw.iterar_features(ruta, tamano_bloque)) == []
+
+
+@pytest.mark.parametrize('texto', ['{}', '{"type": "FeatureCollection"}', '{"type": "FeatureCollection", "crs": {}}'])
+def test_sin_features(tmp_path, texto):
+    with pytest.raises(ValueError, match='features'):
+        list(uw.iterar_features(_escribir(tmp_path, texto), 2))
+
+
+@pytest.mark.parametrize('texto', [
+    '',
+    '[1, 2]',
+    '{"features": [{"type": "Feature"} {"type": "Feature"}]}',
+    '{"features": [{"type": "Feature"}, {"type": "Fea',
+    '{"features": [{"type": "Feature"}',
+])
+@pytest.mark.parametrize('tamano_bloque', [1, 1 << 16])
+def test_json_no_valido(tmp_path, texto, tamano_bloque):
+    with pytest.raises(json.JSONDecodeError):
+        list(uw.iterar_features(_escribir(tmp_path, texto), tamano_bloque))
+
+
+def test_lector_se_puede_recorrer_varias_veces(tmp_path):
+    coleccion = _coleccion(3)
+    lector = uw.LectorFeatures(_escribir(tmp_path, json.dumps(coleccion)))
+    assert list(lector) == coleccion['features']
+    assert list(lector) == coleccion['features']
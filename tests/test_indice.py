@@ -0,0 +1,203 @@
+"""
+Paridad del motor de reglas del índice de buen tiempo con la versión
+original.
+
+MotorIndice sustituyó a la cadena if/elif de calcular_indice_tiempo(); la
+versión original se conserva aquí congelada como referencia, para que
+cualquier cambio en reglas_indice.json o en el motor que altere la
+puntuación, el nivel o los consejos de algún caso haga fallar las pruebas.
+
+Se comprueban los límites de todas las bandas (cada valor de CRITERIOS
+±ε) combinados entre sí y una muestra aleatoria con semilla fija.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import itertools
+import random
+
+import update_weather as uw
+
+
+EPSILON = 1e-9
+
+
+# ============================================================================
+# VERSIÓN ORIGINAL (REFERENCIA CONGELADA)
+# ============================================================================
+
+def calcular_indice_clasico(datos_clima, criterios=uw.CRITERIOS):
+    """calcular_indice_tiempo() tal como era antes del motor de reglas."""
+    if not datos_clima:
+        return {
+            'nivel': 'sin-datos',
+            'puntuacion': 0,
+            'mensaje': 'Datos no disponibles',
+            'consejos': ['No hay datos meteorológicos disponibles para este municipio'],
+            'color': '#9ca3af'
+        }
+
+    temp = datos_clima['main']['temp']
+    sensacion = datos_clima['main']['feels_like']
+    viento = datos_clima['wind']['speed'] * 3.6
+
+    lluvia = 0
+    if 'rain' in datos_clima and '1h' in datos_clima['rain']:
+        lluvia = datos_clima['rain']['1h']
+
+    nieve = 0
+    if 'snow' in datos_clima and '1h' in datos_clima['snow']:
+        nieve = datos_clima['snow']['1h']
+
+    puntuacion = 100
+    consejos = []
+
+    if criterios['temp_optima_min'] <= temp <= criterios['temp_optima_max']:
+        pass
+    elif criterios['temp_precaucion_min'] <= temp < criterios['temp_optima_min']:
+        puntuacion -= 20
+        consejos.append('🧥 Hace algo de frío, lleva una chaqueta o abrigo ligero')
+    elif criterios['temp_optima_max'] < temp <= criterios['temp_precaucion_max']:
+        puntuacion -= 20
+        consejos.append('☀️ Hace calor, lleva agua y protección solar (gorra, crema)')
+    elif temp < criterios['temp_precaucion_min']:
+        puntuacion -= 50
+        consejos.append('❄️ Hace mucho frío, abrígate bien con varias capas de ropa')
+    else:
+        puntuacion -= 50
+        consejos.append('🌡️ Hace mucho calor, evita exposición prolongada al sol')
+
+    if abs(sensacion - temp) > 5:
+        puntuacion -= 10
+        if sensacion < temp:
+            consejos.append('🌬️ El viento hace que se sienta más frío de lo que indica la temperatura')
+        else:
+            consejos.append('💧 La humedad hace que se sienta más calor del real')
+
+    if viento < criterios['viento_precaucion']:
+        pass
+    elif viento < criterios['viento_peligroso']:
+        puntuacion -= 25
+        consejos.append(f'💨 Viento moderado ({int(viento)} km/h), sujeta bien tus pertenencias')
+    else:
+        puntuacion -= 60
+        consejos.append(f'⚠️ Viento fuerte ({int(viento)} km/h), peligroso para actividades al aire libre')
+
+    if lluvia == 0:
+        pass
+    elif lluvia < criterios['lluvia_ligera']:
+        puntuacion -= 20
+        consejos.append('🌦️ Lluvia ligera, lleva paraguas o impermeable')
+    elif lluvia < criterios['lluvia_fuerte']:
+        puntuacion -= 40
+        consejos.append('☔ Lluvia moderada, mejor postponer actividades al aire libre')
+    else:
+        puntuacion -= 70
+        consejos.append('⛈️ Lluvia fuerte, no es buen momento para salir')
+
+    if nieve > 0:
+        puntuacion -= 50
+        consejos.append('🌨️ Está nevando, extrema precaución con superficies resbaladizas')
+
+    puntuacion = max(0, puntuacion)
+    if not consejos:
+        consejos.append('✨ Condiciones perfectas para actividades al aire libre')
+
+    if puntuacion >= 70:
+        nivel, color, mensaje = 'verde', '#10b981', 'Excelente para salir'
+    elif puntuacion >= 40:
+        nivel, color, mensaje = 'amarillo', '#f59e0b', 'Aceptable con precauciones'
+    else:
+        nivel, color, mensaje = 'rojo', '#ef4444', 'Mejor quedarse en casa'
+
+    return {'nivel': nivel, 'puntuacion': puntuacion, 'mensaje': mensaje, 'consejos': consejos, 'color': color}
+
+
+# ============================================================================
+# CASOS DE PRUEBA
+# ============================================================================
+
+def _respuesta(temp, sensacion, humedad, viento_kmh, lluvia=None, nieve=None):
+    """Respuesta de /weather con las variables que usa el índice."""
+    datos = {
+        'main': {'temp': temp, 'feels_like': sensacion, 'humidity': humedad},
+        'wind': {'speed': viento_kmh / 3.6},
+        'weather': [{'description': 'cielo claro', 'icon': '01d'}]
+    }
+    if lluvia is not None:
+        datos['rain'] = {'1h': lluvia}
+    if nieve is not None:
+        datos['snow'] = {'1h': nieve}
+    return datos
+
+
+def _alrededor(*limites):
+    return [limite + d for limite in limites for d in (-EPSILON, 0, EPSILON)]
+
+
+def casos_frontera(criterios=uw.CRITERIOS):
+    """Todas las combinaciones de valores en los límites de las bandas."""
+    temperaturas = _alrededor(criterios['temp_precaucion_min'], criterios['temp_optima_min'],
+                              criterios['temp_optima_max'], criterios['temp_precaucion_max']) + [-20, 20, 50]
+    diferencias = _alrededor(-5, 5) + [0]
+    humedades = [0, 100]
+    vientos = _alrededor(criterios['viento_precaucion'], criterios['viento_peligroso']) + [0, 100]
+    lluvias = [None, 0, EPSILON] + _alrededor(criterios['lluvia_ligera'], criterios['lluvia_fuerte'])
+    nieves = [None, 0, EPSILON, 1]
+
+    return [
+        _respuesta(temp, temp + diferencia, humedad, viento, lluvia, nieve)
+        for temp, diferencia, humedad, viento, lluvia, nieve
+        in itertools.product(temperaturas, diferencias, humedades, vientos, lluvias, nieves)
+    ]
+
+
+def casos_aleatorios(cantidad=20000, semilla=20240601):
+    """Muestra aleatoria reproducible de condiciones plausibles y extremas."""
+    azar = random.Random(semilla)
+    casos = []
+    for _ in range(cantidad):
+        temp = azar.uniform(-15, 45)
+        casos.append(_respuesta(
+            temp,
+            temp + azar.uniform(-12, 12),
+            azar.randint(0, 100),
+            azar.uniform(0, 90),
+            azar.choice([None, 0, azar.uniform(0, 12)]),
+            azar.choice([None, None, 0, azar.uniform(0, 3)])
+        ))
+    return casos
+
+
+def _diferencias(casos, obtenidos):
+    esperados = [calcular_indice_clasico(caso) for caso in casos]
+    return [(caso, obtenido, esperado)
+            for caso, obtenido, esperado in zip(casos, obtenidos, esperados) if obtenido != esperado]
+
+
+# ============================================================================
+# PRUEBAS
+# ============================================================================
+
+def test_motor_coincide_en_los_limites_de_las_bandas():
+    casos = casos_frontera()
+    diferencias = _diferencias(casos, uw.obtener_motor_indice().evaluar(casos))
+    assert not diferencias, f"{len(diferencias)} de {len(casos)} casos distintos, p. ej. {diferencias[0]}"
+
+
+def test_motor_coincide_en_una_muestra_aleatoria():
+    casos = casos_aleatorios()
+    diferencias = _diferencias(casos, uw.obtener_motor_indice().evaluar(casos))
+    assert not diferencias, f"{len(diferencias)} de {len(casos)} casos distintos, p. ej. {diferencias[0]}"
+
+
+def test_calcular_indice_tiempo_coincide_con_el_motor_en_bloque():
+    casos = casos_aleatorios(500, semilla=7)
+    assert [uw.calcular_indice_tiempo(caso) for caso in casos] == uw.obtener_motor_indice().evaluar(casos)
+
+
+def test_sin_datos():
+    esperado = calcular_indice_clasico(None)
+    assert uw.calcular_indice_tiempo(None) == esperado
+    assert uw.obtener_motor_indice().evaluar([None, _respuesta(20, 20, 50, 5), {}])[0::2] == [esperado, esperado]
@@ -0,0 +1,168 @@
+"""
+Pruebas del índice espacial: cada búsqueda tiene que dar el mismo
+municipio que recorrer todos los polígonos con el método del rayo.
+
+Los municipios de prueba son las celdas de una rejilla con los vértices
+desplazados al azar (comparten aristas, así que no se solapan), con
+enclaves dentro de huecos, municipios de varias partes, anillos sin
+cerrar y zonas sin municipio.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+import indice_espacial as indice_mod
+
+
+COLUMNAS, FILAS = 9, 7
+LON_MIN, LON_MAX, LAT_MIN, LAT_MAX = -4.6, -3.0, 39.8, 41.2
+
+
+def _clave(feature, indice):
+    return feature['properties']['NATCODE']
+
+
+def _feature(codigo, tipo, coordenadas):
+    return {
+        'type': 'Feature',
+        'properties': {'NAMEUNIT': f'Municipio {codigo}', 'NATCODE': codigo},
+        'geometry': {'type': tipo, 'coordinates': coordenadas}
+    }
+
+
+def _municipios(semilla=5):
+    """Features de prueba sobre una rejilla de vértices desplazados."""
+    azar = random.Random(semilla)
+    paso_x = (LON_MAX - LON_MIN) / COLUMNAS
+    paso_y = (LAT_MAX - LAT_MIN) / FILAS
+    vertices = [[(LON_MIN + i * paso_x + azar.uniform(-0.3, 0.3) * paso_x,
+                  LAT_MIN + j * paso_y + azar.uniform(-0.3, 0.3) * paso_y)
+                 for j in range(FILAS + 1)] for i in range(COLUMNAS + 1)]
+
+    def celda(i, j, cerrar=True):
+        anillo = [vertices[i][j], vertices[i + 1][j], vertices[i + 1][j + 1], vertices[i][j + 1]]
+        return [list(v) for v in anillo + anillo[:1 if cerrar else 0]]
+
+    features = []
+    unidas = {(0, 0): (6, 4), (2, 5): (8, 0)}  # Municipios de dos partes separadas
+    segundas = set(unidas.values())
+    vacias = {(4, 3), (5, 3), (1, 1)}
+    for i in range(COLUMNAS):
+        for j in range(FILAS):
+            codigo = f'34132828{i:02d}{j:d}'
+            if (i, j) in vacias or (i, j) in segundas:
+                continue
+            if (i, j) in unidas:
+                features.append(_feature(codigo, 'MultiPolygon', [[celda(i, j)], [celda(*unidas[(i, j)])]]))
+            elif (i + j) % 4 == 0:
+                # Hueco en el centro de la celda con un enclave dentro
+                cx = sum(v[0] for v in celda(i, j)[:4]) / 4
+                cy = sum(v[1] for v in celda(i, j)[:4]) / 4
+                dx, dy = paso_x * 0.15, paso_y * 0.15
+                hueco = [[cx - dx, cy - dy], [cx - dx, cy + dy], [cx + dx, cy + dy], [cx + dx, cy - dy], [cx - dx, cy - dy]]
+                features.append(_feature(codigo, 'Polygon', [celda(i, j), hueco]))
+                if j % 2 == 0:
+                    features.append(_feature(f'{codigo}9', 'Polygon', [hueco[::-1]]))
+            else:
+                features.append(_feature(codigo, 'Polygon', [celda(i, j, cerrar=(i + j) % 3 != 0)]))
+
+    features.append(_feature('sin-geometria', 'Point', [-3.7, 40.4]))
+    return features
+
+
+def _cruces(anillo, x, y):
+    cruces = 0
+    for (x1, y1), (x2, y2) in zip(anillo, anillo[1:] + anillo[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            cruces += 1
+    return cruces
+
+
+def _fuerza_bruta(features, lat, lon):
+    """Claves de todos los municipios que contienen el punto, recorriéndolos uno a uno."""
+    encontrados = []
+    for indice, feature in enumerate(features):
+        geometria = feature['geometry']
+        if geometria['type'] not in ('Polygon', 'MultiPolygon'):
+            continue
+        poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria['coordinates']
+        if any(sum(_cruces(anillo, lon, lat) for anillo in poligono) % 2 for poligono in poligonos):
+            encontrados.append(_clave(feature, indice))
+    return encontrados
+
+
+def _puntos(features, cantidad=3000, semilla=17):
+    """Puntos al azar (también fuera de la rejilla) y cerca de cada vértice."""
+    azar = random.Random(semilla)
+    latitudes, longitudes = [], []
+    for _ in range(cantidad):
+        latitudes.append(azar.uniform(LAT_MIN - 0.3, LAT_MAX + 0.3))
+        longitudes.append(azar.uniform(LON_MIN - 0.3, LON_MAX + 0.3))
+    for feature in features[:-1]:
+        coordenadas = feature['geometry']['coordinates']
+        anillo = coordenadas[0] if feature['geometry']['type'] == 'Polygon' else coordenadas[0][0]
+        for lon, lat in anillo:
+            latitudes.append(lat + azar.uniform(-1e-6, 1e-6))
+            longitudes.append(lon + azar.uniform(-1e-6, 1e-6))
+    return latitudes, longitudes
+
+
+def _esperados(features, latitudes, longitudes):
+    esperados = []
+    for lat, lon in zip(latitudes, longitudes):
+        encontrados = _fuerza_bruta(features, lat, lon)
+        assert len(encontrados) <= 1, f"Los municipios de prueba se solapan en {lat}, {lon}: {encontrados}"
+        esperados.append(encontrados[0] if encontrados else None)
+    return esperados
+
+
+@pytest.fixture(scope='module')
+def caso():
+    features = _municipios()
+    latitudes, longitudes = _puntos(features)
+    return features, latitudes, longitudes, _esperados(features, latitudes, longitudes)
+
+
+# ============================================================================
+# PRUEBAS
+# ============================================================================
+
+def test_coincide_con_la_fuerza_bruta(caso):
+    features, latitudes, longitudes, esperados = caso
+    indice = indice_mod.IndiceEspacial.construir(iter(features), _clave, 'abc')
+    assert indice.buscar_lote(latitudes, longitudes) == esperados
+    # Hay puntos fuera de todo municipio, en enclaves y en municipios de dos partes
+    assert None in esperados
+    assert {'341328280229', '34132828000', '34132828025'} <= set(esperados)
+
+
+def test_coincide_en_bloques_pequenos(caso, monkeypatch):
+    features, latitudes, longitudes, esperados = caso
+    monkeypatch.setattr(indice_mod, 'MAXIMO_ELEMENTOS_BLOQUE', 7)
+    indice = indice_mod.IndiceEspacial.construir(features, _clave)
+    assert indice.buscar_lote(latitudes, longitudes) == esperados
+
+
+def test_coincide_tras_guardar_y_cargar(caso, tmp_path):
+    features, latitudes, longitudes, esperados = caso
+    ruta = str(tmp_path / 'indice.npz')
+    indice_mod.IndiceEspacial.construir(features, _clave, 'abc').guardar(ruta)
+    assert indice_mod.indice_actualizado('abc', ruta)
+    assert not indice_mod.indice_actualizado('otro', ruta)
+    cargado = indice_mod.IndiceEspacial.cargar(ruta)
+    assert cargado.buscar_lote(latitudes, longitudes) == esperados
+    assert cargado.buscar(latitudes[0], longitudes[0]) == esperados[0]
+
+
+def test_lote_vacio_y_sin_geometrias(caso):
+    features = caso[0]
+    indice = indice_mod.IndiceEspacial.construir(features, _clave)
+    assert indice.buscar_lote([], []) == []
+    assert indice.localizar_lote(np.array([]), np.array([])).tolist() == []
+    with pytest.raises(ValueError):
+        indice_mod.IndiceEspacial.construir([features[-1]], _clave)
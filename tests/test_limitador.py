@@ -0,0 +1,104 @@
+"""
+Pruebas del limitador de tasa (cubo de fichas) de update_weather.py.
+
+Las pruebas de la cota usan un reloj simulado, así que son exactas y no
+dependen de la carga de la máquina: ninguna ventana de 60 segundos puede
+contener más peticiones que el cupo por minuto, y el cupo se aprovecha
+entero.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import bisect
+import threading
+import time
+
+import pytest
+
+import update_weather as uw
+
+
+class RelojSimulado:
+    """Sustituye al módulo time en update_weather: dormir solo adelanta el reloj."""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def monotonic(self):
+        return self.ahora
+
+    def sleep(self, segundos):
+        self.ahora += segundos
+
+
+def _instantes(monkeypatch, peticiones_por_minuto, rafaga, cantidad, pausa=0.0):
+    """Instantes en los que salen `cantidad` peticiones seguidas."""
+    reloj = RelojSimulado()
+    monkeypatch.setattr(uw, 'time', reloj)
+    limitador = uw.LimitadorTasa(peticiones_por_minuto, rafaga)
+    instantes = []
+    for _ in range(cantidad):
+        limitador.adquirir()
+        instantes.append(reloj.ahora)
+        reloj.sleep(pausa)
+    return limitador, instantes
+
+
+def _maximo_en_ventana(instantes, segundos):
+    """Mayor número de instantes dentro de una ventana [t, t + segundos)."""
+    return max(bisect.bisect_left(instantes, t + segundos - 1e-9) - i for i, t in enumerate(instantes))
+
+
+# ============================================================================
+# PRUEBAS
+# ============================================================================
+
+@pytest.mark.parametrize('peticiones_por_minuto, rafaga', [(60, 1), (60, 10), (600, 50), (2, 5)])
+def test_ninguna_ventana_de_un_minuto_supera_el_cupo(monkeypatch, peticiones_por_minuto, rafaga):
+    _, instantes = _instantes(monkeypatch, peticiones_por_minuto, rafaga, 5 * peticiones_por_minuto + 7)
+    assert _maximo_en_ventana(instantes, 60) <= peticiones_por_minuto
+
+
+@pytest.mark.parametrize('pausa', [0.0, 0.37, 2.0])
+def test_cota_del_cubo_en_cualquier_ventana(monkeypatch, pausa):
+    limitador, instantes = _instantes(monkeypatch, 120, 8, 400, pausa)
+    for segundos in (0.5, 3, 10, 60, 90):
+        assert _maximo_en_ventana(instantes, segundos) <= limitador.capacidad + limitador.tasa * segundos + 1e-6
+
+
+def test_el_cupo_se_aprovecha_entero(monkeypatch):
+    limitador, instantes = _instantes(monkeypatch, 60, 10, 60)
+    assert limitador.capacidad + limitador.tasa * 60 == pytest.approx(60)
+    assert instantes[:10] == [instantes[0]] * 10  # La ráfaga sale sin esperar
+    # La ráfaga y lo recargado en un minuto suman el cupo: la petición 60
+    # sale justo al cumplirse el minuto y la 61 ya tiene que esperar
+    assert instantes[-1] - instantes[0] == pytest.approx(60)
+    limitador.adquirir()
+    assert uw.time.monotonic() - instantes[0] == pytest.approx(60 + 1 / limitador.tasa)
+
+
+def test_rafaga_limitada_al_cupo():
+    limitador = uw.LimitadorTasa(10, rafaga=100)
+    assert limitador.capacidad == 9
+    with pytest.raises(ValueError):
+        uw.LimitadorTasa(0)
+
+
+def test_varios_hilos_respetan_la_tasa():
+    limitador = uw.LimitadorTasa(6000, rafaga=5)
+    hilos, por_hilo = 8, 15
+
+    def consumir():
+        for _ in range(por_hilo):
+            limitador.adquirir()
+
+    inicio = time.monotonic()
+    trabajadores = [threading.Thread(target=consumir) for _ in range(hilos)]
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+
+    # time.sleep() nunca duerme menos de lo pedido, así que esta cota es estricta
+    assert time.monotonic() - inicio >= (hilos * por_hilo - limitador.capacidad) / limitador.tasa - 1e-3
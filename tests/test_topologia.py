@@ -0,0 +1,224 @@
+"""
+Pruebas de la topología: los arcos tienen que reconstruir exactamente los
+anillos de entrada y, al simplificar, los municipios vecinos tienen que
+seguir compartiendo la misma frontera (sin huecos ni solapes).
+
+Los municipios de prueba son las celdas de una rejilla cuyas fronteras
+son líneas quebradas compartidas por las dos celdas vecinas, con un
+enclave dentro de un hueco y un municipio de dos partes. Las coordenadas
+caen justo en la rejilla de cuantización, así que sin simplificar la
+reconstrucción debe ser exacta.
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import topologia as topologia_mod
+
+
+CUANTIZACION = 1001
+COLUMNAS, FILAS = 5, 4
+LON_MIN, LAT_MIN, GRADOS = -4.5, 40.0, 1.5
+PASO = GRADOS / (CUANTIZACION - 1)
+PUNTOS_POR_FRONTERA = 8
+
+
+def _clave(feature, indice):
+    return feature['properties']['NATCODE']
+
+
+def _feature(codigo, tipo, coordenadas):
+    return {
+        'type': 'Feature',
+        'properties': {'NAMEUNIT': f'Municipio {codigo}', 'NATCODE': codigo},
+        'geometry': {'type': tipo, 'coordinates': coordenadas}
+    }
+
+
+def _a_grados(anillo):
+    return [[LON_MIN + x * PASO, LAT_MIN + y * PASO] for x, y in anillo]
+
+
+def _municipios(semilla=3):
+    """
+    Features de prueba y, para cada clave, sus anillos en coordenadas de la
+    rejilla de enteros (lista de polígonos, cada uno lista de anillos).
+    """
+    azar = random.Random(semilla)
+    ancho, alto = (CUANTIZACION - 1) // COLUMNAS, (CUANTIZACION - 1) // FILAS
+
+    def nodo(i, j):
+        x = i * ancho + (azar.randint(-30, 30) if 0 < i < COLUMNAS else 0)
+        y = j * alto + (azar.randint(-30, 30) if 0 < j < FILAS else 0)
+        return x, y
+
+    nodos = {(i, j): nodo(i, j) for i in range(COLUMNAS + 1) for j in range(FILAS + 1)}
+
+    def frontera(a, b, horizontal, exterior):
+        # Línea quebrada de a a b; las fronteras exteriores son rectas para
+        # no salirse de la caja
+        (xa, ya), (xb, yb) = a, b
+        puntos = [a]
+        for k in range(1, PUNTOS_POR_FRONTERA + 1):
+            t = k / (PUNTOS_POR_FRONTERA + 1)
+            desvio = 0 if exterior else azar.randint(-6, 6)
+            x, y = round(xa + (xb - xa) * t), round(ya + (yb - ya) * t)
+            puntos.append((x, y + desvio) if horizontal else (x + desvio, y))
+        return puntos + [b]
+
+    horizontales = {(i, j): frontera(nodos[i, j], nodos[i + 1, j], True, j in (0, FILAS))
+                    for i in range(COLUMNAS) for j in range(FILAS + 1)}
+    verticales = {(i, j): frontera(nodos[i, j], nodos[i, j + 1], False, i in (0, COLUMNAS))
+                  for i in range(COLUMNAS + 1) for j in range(FILAS)}
+
+    def celda(i, j):
+        # Sentido antihorario: abajo, derecha, arriba (al revés), izquierda (al revés)
+        abierto = (horizontales[i, j][:-1] + verticales[i + 1, j][:-1]
+                   + horizontales[i, j + 1][::-1][:-1] + verticales[i, j][::-1][:-1])
+        return abierto + abierto[:1]
+
+    # Hueco cuadrado en la celda (2, 1), ocupado por un enclave
+    cx, cy = nodos[2, 1][0] + ancho // 2, nodos[2, 1][1] + alto // 2
+    esquinas = [(cx - 40, cy - 40), (cx - 40, cy + 40), (cx + 40, cy + 40), (cx + 40, cy - 40)]
+    hueco = [(round(x0 + (x1 - x0) * t / 4), round(y0 + (y1 - y0) * t / 4))
+             for (x0, y0), (x1, y1) in zip(esquinas, esquinas[1:] + esquinas[:1]) for t in range(4)]
+    hueco.append(hueco[0])
+
+    features, anillos = [], {}
+    for i in range(COLUMNAS):
+        for j in range(FILAS):
+            codigo = f'3413282{i}{j}'
+            if (i, j) == (4, 3):
+                continue  # Segunda parte del municipio de (0, 0)
+            if (i, j) == (0, 0):
+                anillos[codigo] = [[celda(0, 0)], [celda(4, 3)]]
+                features.append(_feature(codigo, 'MultiPolygon',
+                                         [[_a_grados(celda(0, 0))], [_a_grados(celda(4, 3))]]))
+            elif (i, j) == (2, 1):
+                anillos[codigo] = [[celda(2, 1), hueco]]
+                features.append(_feature(codigo, 'Polygon', [_a_grados(celda(2, 1)), _a_grados(hueco)]))
+            elif (i, j) == (1, 2):
+                # Anillo sin repetir el primer punto al final
+                anillos[codigo] = [[celda(1, 2)]]
+                features.append(_feature(codigo, 'Polygon', [_a_grados(celda(1, 2)[:-1])]))
+            else:
+                anillos[codigo] = [[celda(i, j)]]
+                features.append(_feature(codigo, 'Polygon', [_a_grados(celda(i, j))]))
+
+    anillos['enclave'] = [[hueco[::-1]]]
+    features.append(_feature('enclave', 'Polygon', [_a_grados(hueco[::-1])]))
+    features.append(_feature('sin-geometria', 'Point', [LON_MIN, LAT_MIN]))
+    return features, anillos
+
+
+def _a_rejilla(topologia, geometria):
+    """Anillos decodificados en coordenadas enteras, como lista de polígonos."""
+    sx, sy = topologia['transform']['scale']
+    tx, ty = topologia['transform']['translate']
+    poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria['coordinates']
+    resultado = []
+    for poligono in poligonos:
+        anillos = []
+        for anillo in poligono:
+            coords = np.asarray(anillo)
+            enteros = np.rint((coords - (tx, ty)) / (sx, sy))
+            assert np.allclose(enteros * (sx, sy) + (tx, ty), coords, rtol=0, atol=1e-9)
+            anillos.append([tuple(p) for p in enteros.astype(int).tolist()])
+        resultado.append(anillos)
+    return resultado
+
+
+def _normalizar(anillo):
+    """Anillo abierto y empezando por su punto mínimo (conserva el sentido)."""
+    abierto = anillo[:-1] if anillo[0] == anillo[-1] else anillo
+    inicio = abierto.index(min(abierto))
+    return abierto[inicio:] + abierto[:inicio]
+
+
+def _aristas(anillos_por_clave):
+    aristas = Counter()
+    for poligonos in anillos_por_clave.values():
+        for anillos in poligonos:
+            for anillo in anillos:
+                aristas.update(zip(anillo, anillo[1:]))
+    return aristas
+
+
+def _sin_pareja(aristas):
+    """Aristas que ningún otro anillo recorre en sentido contrario (el borde exterior)."""
+    return {arista for arista in aristas if aristas[arista[::-1]] < aristas[arista]}
+
+
+@pytest.fixture(scope='module')
+def caso():
+    features, anillos = _municipios()
+    topologias = topologia_mod.construir_topologias(features, _clave, [0, 5 * PASO, 40 * PASO], CUANTIZACION)
+    decodificadas = [
+        {clave: _a_rejilla(topologia, geometria)
+         for clave, geometria in topologia_mod.decodificar_topologia(topologia).items()}
+        for topologia in topologias
+    ]
+    return anillos, topologias, decodificadas
+
+
+# ============================================================================
+# PRUEBAS
+# ============================================================================
+
+def test_sin_simplificar_reconstruye_los_anillos(caso):
+    anillos, _, decodificadas = caso
+    assert set(decodificadas[0]) == set(anillos)
+    for clave, poligonos in anillos.items():
+        esperado = [[_normalizar(anillo) for anillo in poligono] for poligono in poligonos]
+        obtenido = [[_normalizar(anillo) for anillo in poligono] for poligono in decodificadas[0][clave]]
+        assert obtenido == esperado, clave
+
+
+def test_fronteras_compartidas_una_sola_vez(caso):
+    anillos, topologias, _ = caso
+    referencias = Counter()
+    for geometria in topologias[0]['objects']['municipios']['geometries']:
+        poligonos = [geometria['arcs']] if geometria['type'] == 'Polygon' else geometria['arcs']
+        for poligono in poligonos:
+            for anillo in poligono:
+                referencias.update(i if i >= 0 else ~i for i in anillo)
+    # Cada arco lo usan uno o dos anillos, y hay arcos compartidos
+    assert set(referencias) == set(range(len(topologias[0]['arcs'])))
+    assert set(referencias.values()) == {1, 2}
+    # Todos los niveles comparten las geometrías
+    assert all(t['objects'] == topologias[0]['objects'] for t in topologias)
+
+
+@pytest.mark.parametrize('nivel', [1, 2])
+def test_simplificado_sin_huecos(caso, nivel):
+    anillos, _, decodificadas = caso
+    simplificadas = decodificadas[nivel]
+    originales = _aristas(decodificadas[0])
+    aristas = _aristas(simplificadas)
+
+    # Se han quitado puntos, y solo puntos que ya estaban en la entrada
+    assert sum(aristas.values()) < sum(originales.values())
+    puntos_originales = {p for arista in originales for p in arista}
+    assert {p for arista in aristas for p in arista} <= puntos_originales
+
+    # Toda arista interior la recorre el vecino en sentido contrario: las que
+    # quedan sin pareja solo pueden estar en el borde exterior del conjunto
+    borde = {p for arista in _sin_pareja(originales) for p in arista}
+    assert {p for arista in _sin_pareja(aristas) for p in arista} <= borde
+
+    for poligonos in simplificadas.values():
+        for anillos_poligono in poligonos:
+            for anillo in anillos_poligono:
+                assert anillo[0] == anillo[-1] and len(anillo) >= 4
+
+
+def test_codificacion_por_diferencias():
+    puntos = [(5, 7), (6, 7), (6, 3), (0, 0), (1000, 999), (5, 7)]
+    codificado = topologia_mod.codificar_arco(puntos)
+    assert [tuple(p) for p in np.cumsum(codificado, axis=0).tolist()] == puntos
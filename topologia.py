@@ -0,0 +1,395 @@
+"""
+Generación de la geometría municipal en formato TopoJSON.
+
+Los límites municipales no cambian entre ejecuciones, así que no tiene
+sentido incluirlos en cada archivo de datos meteorológicos. Este módulo
+convierte el GeoJSON original en una topología compacta que se genera una
+sola vez y que la página web combina con los datos de cada ejecución.
+
+El proceso sigue las mismas ideas que TopoJSON:
+1. Cuantiza las coordenadas a una rejilla de enteros
+2. Detecta los puntos de unión donde se encuentran varios municipios
+3. Corta los anillos en arcos y guarda una sola vez cada frontera compartida
+4. Simplifica cada arco (Douglas-Peucker) manteniendo sus extremos, por lo
+   que las fronteras simplificadas siguen encajando sin huecos
+5. Codifica los arcos con diferencias entre puntos consecutivos
+
+Autor: Sergio Romera Martínez
+Licencia: MIT
+"""
+
+import math
+
+import numpy as np
+
+
+# Número de pasos de la rejilla de cuantización en cada eje. Con 100.000
+# pasos sobre la Comunidad de Madrid la resolución es de unos 2 metros.
+CUANTIZACION_POR_DEFECTO = 100000
+
+
+# ============================================================================
+# CUANTIZACIÓN
+# ============================================================================
+
+def _poligonos(geometry):
+    """Devuelve la lista de polígonos de una geometría Polygon o MultiPolygon."""
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    raise ValueError(f"Tipo de geometría no soportado: {geometry['type']}")
+
+
+def calcular_transformacion(geometrias, cuantizacion):
+    """
+    Calcula la transformación entre coordenadas geográficas y la rejilla
+    de enteros a partir de la caja que envuelve todas las geometrías.
+
+    Las geometrías se recorren una sola vez acumulando la caja anillo a
+    anillo, así que pueden llegar de un iterador sin cargarlas todas.
+
+    Returns:
+        Tupla (escala, traslacion, bbox) en el formato de TopoJSON
+    """
+    x0 = y0 = math.inf
+    x1 = y1 = -math.inf
+    for geometry in geometrias:
+        for poligono in _poligonos(geometry):
+            for anillo in poligono:
+                if not len(anillo):
+                    continue
+                coords = np.asarray(anillo, dtype=np.float64)[:, :2]
+                minimos = coords.min(axis=0)
+                maximos = coords.max(axis=0)
+                x0, y0 = min(x0, minimos[0]), min(y0, minimos[1])
+                x1, y1 = max(x1, maximos[0]), max(y1, maximos[1])
+    if x0 > x1:
+        raise ValueError("No hay ninguna geometría con coordenadas")
+    escala = [
+        (x1 - x0) / (cuantizacion - 1) if x1 > x0 else 1.0,
+        (y1 - y0) / (cuantizacion - 1) if y1 > y0 else 1.0
+    ]
+    return escala, [x0, y0], [x0, y0, x1, y1]
+
+
+def cuantizar_anillo(anillo, escala, traslacion):
+    """
+    Pasa un anillo a coordenadas enteras eliminando los puntos repetidos
+    consecutivos que aparecen al cuantizar.
+
+    Returns:
+        Lista de tuplas (x, y) enteras, cerrada (primer punto igual al
+        último), o None si el anillo degenera en menos de 3 puntos distintos.
+    """
+    puntos = np.asarray(anillo, dtype=np.float64)[:, :2]
+    enteros = np.rint((puntos - traslacion) / escala).astype(np.int64)
+
+    # Eliminar duplicados consecutivos
+    cambia = np.ones(len(enteros), dtype=bool)
+    cambia[1:] = (enteros[1:] != enteros[:-1]).any(axis=1)
+    enteros = enteros[cambia]
+
+    resultado = [tuple(p) for p in enteros.tolist()]
+    if resultado[0] != resultado[-1]:
+        resultado.append(resultado[0])
+    if len(resultado) < 4:
+        return None
+    return resultado
+
+
+# ============================================================================
+# DETECCIÓN DE FRONTERAS COMPARTIDAS
+# ============================================================================
+
+def detectar_uniones(anillos):
+    """
+    Localiza los puntos de unión entre anillos.
+
+    Un punto es de unión cuando aparece en varios anillos con vecinos
+    distintos: es ahí donde una frontera deja de ser compartida por los
+    mismos municipios. Cortar los anillos por estos puntos garantiza que
+    cada tramo de frontera compartida produzca exactamente el mismo arco
+    desde ambos lados.
+
+    Args:
+        anillos: Lista de anillos cuantizados y cerrados
+
+    Returns:
+        Conjunto de puntos de unión
+    """
+    vecinos_vistos = {}
+    uniones = set()
+
+    for anillo in anillos:
+        abierto = anillo[:-1]
+        n = len(abierto)
+        for i, punto in enumerate(abierto):
+            vecinos = frozenset((abierto[i - 1], abierto[(i + 1) % n]))
+            previos = vecinos_vistos.get(punto)
+            if previos is None:
+                vecinos_vistos[punto] = vecinos
+            elif previos != vecinos:
+                uniones.add(punto)
+
+    return uniones
+
+
+def _cortar_anillo(anillo, uniones):
+    """
+    Divide un anillo cerrado en arcos que empiezan y terminan en puntos de
+    unión. Un anillo sin uniones se devuelve como un único arco cerrado que
+    empieza en su punto mínimo, para que el mismo anillo recorrido en
+    cualquier sentido genere siempre la misma clave.
+    """
+    abierto = anillo[:-1]
+    cortes = [i for i, punto in enumerate(abierto) if punto in uniones]
+
+    if not cortes:
+        inicio = abierto.index(min(abierto))
+        rotado = abierto[inicio:] + abierto[:inicio]
+        return [rotado + [rotado[0]]]
+
+    rotado = abierto[cortes[0]:] + abierto[:cortes[0]]
+    posiciones = [c - cortes[0] for c in cortes] + [len(abierto)]
+    rotado.append(rotado[0])
+    return [rotado[a:b + 1] for a, b in zip(posiciones, posiciones[1:])]
+
+
+# ============================================================================
+# SIMPLIFICACIÓN
+# ============================================================================
+
+def simplificar_arco(puntos, tolerancia):
+    """
+    Simplifica un arco con el algoritmo de Douglas-Peucker.
+
+    Los extremos del arco se conservan siempre. Como cada frontera compartida
+    es un único arco, los dos municipios vecinos reciben exactamente la misma
+    línea simplificada y no aparecen huecos ni solapes entre ellos.
+
+    Args:
+        puntos: Lista de puntos (x, y) enteros
+        tolerancia: Distancia máxima permitida, en unidades de la rejilla
+
+    Returns:
+        Lista de puntos simplificada
+    """
+    if tolerancia <= 0 or len(puntos) <= 2:
+        return puntos
+
+    coords = np.asarray(puntos, dtype=np.float64)
+    conservar = np.zeros(len(coords), dtype=bool)
+    conservar[0] = conservar[-1] = True
+
+    pendientes = [(0, len(coords) - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+
+        a = coords[inicio]
+        b = coords[fin]
+        tramo = coords[inicio + 1:fin]
+        ab = b - a
+        longitud = np.hypot(ab[0], ab[1])
+        if longitud == 0:
+            # Arco cerrado: distancia al punto de inicio
+            distancias = np.hypot(tramo[:, 0] - a[0], tramo[:, 1] - a[1])
+        else:
+            distancias = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / longitud
+
+        mayor = int(np.argmax(distancias))
+        if distancias[mayor] > tolerancia:
+            medio = inicio + 1 + mayor
+            conservar[medio] = True
+            pendientes.append((inicio, medio))
+            pendientes.append((medio, fin))
+
+    simplificado = [p for p, c in zip(puntos, conservar) if c]
+
+    # Un arco cerrado necesita al menos 4 puntos para seguir siendo un anillo
+    if simplificado[0] == simplificado[-1] and len(simplificado) < 4:
+        return puntos
+    return simplificado
+
+
+# ============================================================================
+# CONSTRUCCIÓN DE LA TOPOLOGÍA
+# ============================================================================
+
+def construir_topologia(features, clave_municipio, tolerancia=0.0,
+                        cuantizacion=CUANTIZACION_POR_DEFECTO):
+    """
+    Convierte una lista de features GeoJSON en una topología TopoJSON.
+
+    Args:
+        features: Iterable de features con geometría Polygon o MultiPolygon.
+                  Se recorre dos veces, así que puede ser una lista o un
+                  lector que vuelva a leer el archivo en cada pasada
+        clave_municipio: Función (feature, índice) -> identificador que se
+                         guarda en el campo `id` de cada geometría
+        tolerancia: Tolerancia de simplificación en grados (0 no simplifica)
+        cuantizacion: Número de pasos de la rejilla de enteros por eje
+
+    Returns:
+        Diccionario con la topología, con un único objeto `municipios` de
+        tipo GeometryCollection. Las features con geometría no válida se
+        omiten.
+    """
+    return construir_topologias(features, clave_municipio, [tolerancia], cuantizacion)[0]
+
+
+def construir_topologias(features, clave_municipio, tolerancias, cuantizacion=CUANTIZACION_POR_DEFECTO):
+    """
+    Genera varias topologías de los mismos municipios, una por tolerancia de
+    simplificación (niveles de detalle para distintos niveles de zoom).
+
+    Los arcos se detectan una sola vez y cada nivel simplifica los mismos
+    arcos, así que todas las topologías comparten las geometrías (los
+    índices de arcos de cada municipio son iguales) y en todas las fronteras
+    compartidas siguen encajando sin huecos.
+
+    Args:
+        features, clave_municipio, cuantizacion: Como en construir_topologia()
+        tolerancias: Lista de tolerancias en grados (0 no simplifica)
+
+    Returns:
+        Lista de topologías en el mismo orden que `tolerancias`
+    """
+    def geometrias_validas():
+        for feature in features:
+            try:
+                _poligonos(feature['geometry'])
+            except (ValueError, KeyError, TypeError):
+                continue
+            yield feature['geometry']
+
+    # Primera pasada: caja que envuelve todas las geometrías
+    escala, traslacion, bbox = calcular_transformacion(geometrias_validas(), cuantizacion)
+
+    # Segunda pasada: cuantizar todos los anillos conservando la estructura
+    # de cada geometría. De cada feature solo se guardan sus anillos
+    # cuantizados, su clave y su nombre.
+    estructuras = []
+    todos_los_anillos = []
+    for indice, feature in enumerate(features):
+        try:
+            poligonos_feature = _poligonos(feature['geometry'])
+        except (ValueError, KeyError, TypeError):
+            continue
+        poligonos = []
+        for poligono in poligonos_feature:
+            anillos = [cuantizar_anillo(anillo, escala, traslacion) for anillo in poligono if len(anillo)]
+            # Si el anillo exterior degenera se descarta el polígono entero
+            if not anillos or anillos[0] is None:
+                continue
+            anillos = [anillo for anillo in anillos if anillo is not None]
+            poligonos.append(anillos)
+            todos_los_anillos.extend(anillos)
+        nombre = feature['properties'].get('NAMEUNIT', 'Desconocido')
+        estructuras.append((clave_municipio(feature, indice), nombre, poligonos))
+
+    uniones = detectar_uniones(todos_los_anillos)
+
+    arcos = []
+    indice_arcos = {}
+
+    def registrar_arco(puntos):
+        clave = tuple(puntos)
+        if clave in indice_arcos:
+            return indice_arcos[clave]
+        inversa = tuple(reversed(puntos))
+        if inversa in indice_arcos:
+            return ~indice_arcos[inversa]
+        indice_arcos[clave] = len(arcos)
+        arcos.append(puntos)
+        return indice_arcos[clave]
+
+    geometrias = []
+    for clave, nombre, poligonos in estructuras:
+        if not poligonos:
+            continue
+        arcos_poligonos = [
+            [[registrar_arco(arco) for arco in _cortar_anillo(anillo, uniones)] for anillo in anillos]
+            for anillos in poligonos
+        ]
+        geometria = {'id': clave}
+        if len(arcos_poligonos) == 1:
+            geometria['type'] = 'Polygon'
+            geometria['arcs'] = arcos_poligonos[0]
+        else:
+            geometria['type'] = 'MultiPolygon'
+            geometria['arcs'] = arcos_poligonos
+        geometria['properties'] = {'nombre': nombre}
+        geometrias.append(geometria)
+
+    topologias = []
+    for tolerancia in tolerancias:
+        # Tolerancia en unidades de la rejilla (se usa la escala más fina)
+        tolerancia_rejilla = tolerancia / min(escala) if tolerancia > 0 else 0
+        topologias.append({
+            'type': 'Topology',
+            'bbox': [round(v, 7) for v in bbox],
+            'transform': {
+                'scale': [float(v) for v in escala],
+                'translate': [float(v) for v in traslacion]
+            },
+            'objects': {
+                'municipios': {
+                    'type': 'GeometryCollection',
+                    'geometries': geometrias
+                }
+            },
+            'arcs': [codificar_arco(simplificar_arco(arco, tolerancia_rejilla)) for arco in arcos]
+        })
+    return topologias
+
+
+def codificar_arco(puntos):
+    """Codifica un arco con diferencias entre puntos consecutivos (delta encoding)."""
+    codificado = [list(puntos[0])]
+    for (x0, y0), (x1, y1) in zip(puntos, puntos[1:]):
+        codificado.append([x1 - x0, y1 - y0])
+    return codificado
+
+
+def decodificar_topologia(topologia, objeto='municipios'):
+    """
+    Reconstruye las geometrías GeoJSON de un objeto de la topología.
+
+    Es la operación inversa de construir_topologia() (salvo la pérdida de
+    la cuantización y la simplificación) y sirve para comprobar el
+    resultado desde Python.
+
+    Returns:
+        Diccionario {id: geometría GeoJSON}
+    """
+    sx, sy = topologia['transform']['scale']
+    tx, ty = topologia['transform']['translate']
+
+    arcos = []
+    for arco in topologia['arcs']:
+        x = y = 0
+        puntos = []
+        for dx, dy in arco:
+            x += dx
+            y += dy
+            puntos.append([x * sx + tx, y * sy + ty])
+        arcos.append(puntos)
+
+    def anillo(indices):
+        puntos = []
+        for n, i in enumerate(indices):
+            arco = arcos[i] if i >= 0 else arcos[~i][::-1]
+            puntos.extend(arco if n == 0 else arco[1:])
+        return puntos
+
+    geometrias = {}
+    for geometria in topologia['objects'][objeto]['geometries']:
+        if geometria['type'] == 'Polygon':
+            coordenadas = [anillo(a) for a in geometria['arcs']]
+        else:
+            coordenadas = [[anillo(a) for a in poligono] for poligono in geometria['arcs']]
+        geometrias[geometria['id']] = {'type': geometria['type'], 'coordinates': coordenadas}
+    return geometrias
@@ -4,10 +4,11 @@ Este script se ejecuta automáticamente cada 3 horas mediante GitHub Actions.
 
 El script realiza las siguientes operaciones:
 1. Lee el archivo GeoJSON con los límites municipales
-2. Calcula el centroide de cada municipio
+2. Calcula el centroide de cada municipio y genera la geometría simplificada
+   (solo cuando cambian los límites municipales)
 3. Consulta la API de OpenWeatherMap para obtener datos meteorológicos
 4. Evalúa las condiciones climáticas según criterios predefinidos
-5. Genera un archivo JSON con toda la información procesada
+5. Genera un archivo JSON con los datos meteorológicos de cada municipio
 
 Autor: Sergio Romera Martínez
 Licencia: MIT
@@ -16,13 +17,34 @@ Fuentes de datos:
 - Datos geográficos: ESRI/IGN España
 """
 
+import argparse
+import cProfile
+import copy
+import gzip
+import hashlib
 import json
+import math
+import numpy as np
 import requests
+import esquema as esquema_mod
+import historico as historico_mod
+import indice_espacial as indice_espacial_mod
+import metricas as metricas_mod
+import topologia as topologia_mod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+import pstats
+import threading
 import time
 import os
 import sys
 
+try:
+    import brotli
+except ImportError:  # La compresión brotli es opcional
+    brotli = None
+
 
 # ============================================================================
 # CONFIGURACIÓN GLOBAL
@@ -35,8 +57,143 @@ OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
 GEOJSON_FILE = 'data/municipios_madrid.geojson'
 OUTPUT_FILE = 'data/weather_data.json'
 
+# Índice de centroides precalculados, ligado al hash del archivo GeoJSON.
+# Mientras los límites municipales no cambien no hay que recalcularlos.
+CENTROIDES_FILE = 'data/centroides.json'
+VERSION_INDICE_CENTROIDES = 1  # Incrementar si cambia el método de cálculo
+TAMANO_LOTE_CENTROIDES = 256   # Features por lote al calcular centroides
+
+# Geometría de los municipios en formato TopoJSON
+# Se genera una sola vez (cuando cambia el GeoJSON o la configuración) y la
+# página web la combina con los datos meteorológicos de cada ejecución.
+GEOMETRIA_FILE = 'data/municipios_geometria.topojson'
+GEOMETRIA_TOLERANCIA = float(os.environ.get('GEOMETRIA_TOLERANCIA', '0.0002'))  # En grados (~20 m)
+GEOMETRIA_CUANTIZACION = 100000  # Pasos de la rejilla de enteros por eje (~2 m)
+
+# Niveles de detalle de la geometría. La página web carga solo el del zoom
+# actual: cada nivel se usa hasta su zoom máximo de Leaflet, y el último
+# (GEOMETRIA_FILE, sin máximo) para los zooms mayores. Todos simplifican las
+# mismas fronteras compartidas, así que en ninguno aparecen huecos.
+GEOMETRIA_NIVELES = [
+    {'zoom_maximo': 8, 'tolerancia': float(os.environ.get('GEOMETRIA_TOLERANCIA_Z8', '0.002')),      # ~200 m
+     'archivo': 'data/municipios_geometria_z8.topojson'},
+    {'zoom_maximo': 10, 'tolerancia': float(os.environ.get('GEOMETRIA_TOLERANCIA_Z10', '0.0006')),   # ~60 m
+     'archivo': 'data/municipios_geometria_z10.topojson'},
+    {'zoom_maximo': None, 'tolerancia': GEOMETRIA_TOLERANCIA, 'archivo': GEOMETRIA_FILE}
+]
+GEOMETRIA_NIVELES_FILE = 'data/municipios_geometria.niveles.json'  # Lista de niveles para la página web
+
+# Escritura sensible a cambios
+# El archivo principal solo se reescribe cuando algún municipio cambia de
+# forma apreciable respecto a la ejecución anterior. Los cambios se resumen
+# en un archivo de diferencias y las marcas de tiempo, que cambian siempre,
+# se guardan aparte en un pequeño archivo de estado.
+DELTA_FILE = 'data/weather_delta.json'
+ESTADO_FILE = 'data/estado.json'
+FORZAR_ESCRITURA = os.environ.get('FORZAR_ESCRITURA', '0') == '1'
+
+# Diferencia mínima en cada variable para considerar que un municipio ha
+# cambiado. Cualquier cambio de nivel o de puntuación del índice cuenta
+# siempre como cambio; descripción e icono no se tienen en cuenta.
+TOLERANCIAS_CAMBIO = {
+    'temperatura': float(os.environ.get('TOLERANCIA_TEMPERATURA', '0.5')),   # °C
+    'sensacion': float(os.environ.get('TOLERANCIA_SENSACION', '0.5')),       # °C
+    'humedad': float(os.environ.get('TOLERANCIA_HUMEDAD', '5')),             # %
+    'viento': float(os.environ.get('TOLERANCIA_VIENTO', '2')),               # km/h
+}
+
+# Histórico de observaciones (base de datos SQLite local, ver historico.py)
+HISTORICO_ACTIVO = os.environ.get('HISTORICO_ACTIVO', '1') == '1'
+
+# Índice espacial para localizar coordenadas (ver indice_espacial.py). Como
+# la geometría, solo se reconstruye cuando cambia el GeoJSON.
+INDICE_ESPACIAL_ACTIVO = os.environ.get('INDICE_ESPACIAL_ACTIVO', '1') == '1'
+
+# Métricas de rendimiento de la ejecución (tiempos por fase, latencias de la
+# API, errores, reintentos y bytes escritos). No se versionan en git.
+# Con METRICAS_EN_METADATA=1 se incluyen también en la metadata de
+# OUTPUT_FILE (sin contar como cambio apreciable).
+METRICAS_FILE = os.environ.get('METRICAS_FILE', 'data/metricas.json')
+METRICAS_EN_METADATA = os.environ.get('METRICAS_EN_METADATA', '0') == '1'
+
+# Salida columnar compacta
+# Además del archivo principal se genera una versión por columnas (un array
+# por campo y tablas de diccionario para los textos repetidos), minificada.
+SALIDA_COLUMNAR = os.environ.get('SALIDA_COLUMNAR', '1') == '1'
+OUTPUT_FILE_COLUMNAR = 'data/weather_data.columnar.json'
+
+# Variantes precomprimidas (`.gz` y, si está instalado el paquete `brotli`,
+# `.br`) de la salida columnar y de la previsión. Solo las aprovecha un
+# servidor que las entregue con Content-Encoding, como servidor.py; GitHub
+# Pages no lo hace, así que por defecto no se generan ni se versionan.
+SALIDA_PRECOMPRIMIDA = os.environ.get('SALIDA_PRECOMPRIMIDA', '0') == '1'
+
+# Tabla de reglas del índice de buen tiempo (se distribuye junto al script)
+REGLAS_INDICE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reglas_indice.json')
+
+# Dirección base de la API de OpenWeatherMap (configurable para pruebas locales)
+OPENWEATHER_API_BASE = os.environ.get('OPENWEATHER_API_BASE', 'https://api.openweathermap.org/data/2.5')
+
+# Caché en disco de respuestas de la API
+# Permite que dos ejecuciones seguidas (por ejemplo un lanzamiento manual y
+# el cron) reutilicen las respuestas sin volver a consultar la red.
+CACHE_FILE = '.cache/openweather_respuestas.json'
+CACHE_TTL_SEGUNDOS = int(os.environ.get('OPENWEATHER_CACHE_TTL', '900'))    # 0 desactiva la caché
+CACHE_MAX_ENTRADAS = int(os.environ.get('OPENWEATHER_CACHE_MAX', '2000'))
+CACHE_DECIMALES = 3  # Redondeo de lat/lon para la clave (~100 metros)
+
+# Punto de control de la ejecución en curso
+# Cada municipio completado se añade al archivo en el momento, de modo que
+# si la ejecución se interrumpe (fallo, timeout del workflow) la siguiente
+# retoma los municipios ya consultados sin volver a pedirlos, siempre que el
+# GeoJSON sea el mismo y el punto de control no tenga más de
+# PUNTO_CONTROL_VIGENCIA segundos. Se borra al terminar con éxito.
+PUNTO_CONTROL_FILE = '.cache/punto_control.jsonl'
+PUNTO_CONTROL_VIGENCIA = int(os.environ.get('PUNTO_CONTROL_VIGENCIA', '3600'))  # 0 lo desactiva
+VERSION_PUNTO_CONTROL = 2  # 2: cada municipio guarda el instante de su consulta
+
+# Límites de consulta a la API
+# El plan gratuito de OpenWeatherMap permite 60 llamadas por minuto. Si se
+# contrata un plan superior basta con ajustar la variable de entorno.
+PETICIONES_POR_MINUTO = int(os.environ.get('OPENWEATHER_PETICIONES_POR_MINUTO', '60'))
+
+# Número máximo de peticiones en vuelo a la vez (1 equivale al modo secuencial)
+PETICIONES_CONCURRENTES = int(os.environ.get('OPENWEATHER_CONCURRENCIA', '8'))
+
+# Municipios que pueden tener su consulta en curso a la vez. Acota la memoria
+# del proceso: solo se leen del GeoJSON los municipios de la ventana.
+VENTANA_CONSULTAS = int(os.environ.get('VENTANA_CONSULTAS', '64'))
+
+# Peticiones que pueden salir de golpe sin esperar a que se recargue el cubo.
+# La tasa de recarga se descuenta de la ráfaga para que en cualquier ventana
+# de 60 segundos nunca se superen PETICIONES_POR_MINUTO llamadas.
+RAFAGA_PETICIONES = int(os.environ.get('OPENWEATHER_RAFAGA', '1'))
+
+# Reintentos ante errores transitorios (429, 5xx, timeouts y errores de red).
+# Si la API indica cuánto esperar (cabecera Retry-After) se respeta, hasta un
+# máximo de REINTENTO_ESPERA_MAXIMA segundos; si no, la espera se duplica en
+# cada intento. Cada reintento consume cupo del limitador como una petición más.
+REINTENTOS_MAXIMOS = int(os.environ.get('OPENWEATHER_REINTENTOS', '2'))
+REINTENTO_ESPERA_BASE = 1.0      # Segundos antes del primer reintento
+REINTENTO_ESPERA_MAXIMA = 30.0
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+# Modo rejilla (deduplicación espacial)
+# Muchos municipios pequeños tienen centroides a pocos kilómetros, por debajo
+# de la resolución del modelo meteorológico. Con un tamaño de celda mayor que
+# 0 los centroides se agrupan en una rejilla lat/lon, se hace una sola consulta
+# por celda y los valores se interpolan a cada municipio por distancia inversa
+# (IDW). Con 0 se hace una consulta por municipio.
+REJILLA_TAMANO_CELDA = float(os.environ.get('REJILLA_TAMANO_CELDA', '0'))   # En grados
+REJILLA_VECINOS_IDW = 4          # Celdas más cercanas que intervienen en la interpolación
+REJILLA_POTENCIA_IDW = 2         # Exponente de la distancia en la ponderación
+# Municipios que se consultan también directamente para medir el error que
+# introduce la interpolación frente a la consulta individual
+REJILLA_MUESTRA_VALIDACION = int(os.environ.get('REJILLA_MUESTRA_VALIDACION', '5'))
+
 # Criterios para evaluar las condiciones meteorológicas
-# Estos valores pueden ajustarse según las preferencias del usuario
+# Estos valores pueden ajustarse según las preferencias del usuario. La tabla
+# de reglas del índice (reglas_indice.json) hace referencia a ellos por nombre.
 CRITERIOS = {
     'temp_optima_min': 15,      # Temperatura mínima ideal en °C
     'temp_optima_max': 25,      # Temperatura máxima ideal en °C
@@ -49,280 +206,2157 @@ CRITERIOS = {
 }
 
 
+# ============================================================================
+# FUNCIONES DE LECTURA DEL GEOJSON
+# ============================================================================
+
+def iterar_features(ruta, tamano_bloque=1 << 16):
+    """
+    Lee un archivo GeoJSON de forma incremental, devolviendo las features
+    de una en una.
+    
+    El archivo se lee por bloques y cada feature se decodifica en cuanto
+    está completa en el búfer, así que la memoria necesaria depende del
+    tamaño de la feature más grande y no del tamaño del archivo. Esto
+    permite procesar archivos con miles de municipios (por ejemplo, todos
+    los de España) sin cargarlos enteros.
+    
+    Args:
+        ruta: Ruta del archivo GeoJSON (FeatureCollection)
+        tamano_bloque: Número de caracteres que se leen en cada bloque
+        
+    Yields:
+        Diccionarios con cada feature del archivo, en orden
+        
+    Raises:
+        json.JSONDecodeError: Si el archivo no tiene formato JSON válido
+        ValueError: Si el archivo no contiene la clave 'features'
+    """
+    decodificador = json.JSONDecoder()
+    
+    with open(ruta, 'r', encoding='utf-8') as f:
+        bufer = ''
+        pos = 0
+        fin_archivo = False
+        
+        def leer_mas():
+            # Descarta lo ya consumido y añade un bloque nuevo (que crece con
+            # el búfer para que una feature enorme no se decodifique
+            # muchas veces)
+            nonlocal bufer, pos, fin_archivo
+            bloque = f.read(max(tamano_bloque, len(bufer) - pos))
+            bufer = bufer[pos:] + bloque
+            pos = 0
+            if not bloque:
+                fin_archivo = True
+        
+        def siguiente_caracter():
+            # Salta los espacios y devuelve el siguiente carácter sin consumirlo
+            nonlocal pos
+            while True:
+                while pos < len(bufer) and bufer[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(bufer):
+                    return bufer[pos]
+                if fin_archivo:
+                    return ''
+                leer_mas()
+        
+        def esperar(caracteres):
+            nonlocal pos
+            caracter = siguiente_caracter()
+            if caracter not in caracteres or not caracter:
+                raise json.JSONDecodeError(f"Se esperaba uno de {caracteres!r}", bufer, pos)
+            pos += 1
+            return caracter
+        
+        def decodificar_valor():
+            # Decodifica el siguiente valor completo, leyendo más bloques si el
+            # búfer termina a mitad de él
+            nonlocal pos
+            siguiente_caracter()
+            while True:
+                try:
+                    valor, fin = decodificador.raw_decode(bufer, pos)
+                    # Un número cortado por el final del búfer (por ejemplo
+                    # "2." de "2.5") se decodifica como uno más corto, así que
+                    # solo se acepta si lo sigue un carácter que no lo continúe
+                    if fin_archivo or (fin < len(bufer) and bufer[fin] not in '0123456789.eE+-'):
+                        pos = fin
+                        return valor
+                except json.JSONDecodeError:
+                    if fin_archivo:
+                        raise
+                leer_mas()
+        
+        esperar('{')
+        if siguiente_caracter() == '}':
+            raise ValueError("El archivo GeoJSON no contiene la clave 'features'")
+        
+        while True:
+            clave = decodificar_valor()
+            esperar(':')
+            
+            if clave != 'features':
+                # Otras claves de primer nivel (type, crs, name...) se descartan
+                decodificar_valor()
+            else:
+                esperar('[')
+                if siguiente_caracter() == ']':
+                    pos += 1
+                else:
+                    while True:
+                        yield decodificar_valor()
+                        if esperar(',]') == ']':
+                            break
+                return
+            
+            if esperar(',}') == '}':
+                raise ValueError("El archivo GeoJSON no contiene la clave 'features'")
+
+
+class LectorFeatures:
+    """
+    Iterable que vuelve a leer el archivo GeoJSON de forma incremental cada
+    vez que se recorre. Permite pasar el archivo a procesos que necesitan
+    varias pasadas (como la generación de la topología) sin cargarlo entero.
+    """
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+    
+    def __iter__(self):
+        return iterar_features(self.ruta)
+
+
+def calcular_hash_archivo(ruta):
+    """Calcula el hash SHA-256 del contenido de un archivo leyéndolo por bloques."""
+    resumen = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            resumen.update(bloque)
+    return resumen.hexdigest()
+
+
 # ============================================================================
 # FUNCIONES DE PROCESAMIENTO GEOMÉTRICO
 # ============================================================================
 
+def _anillos_geometria(geometry):
+    """
+    Recorre todos los anillos de una geometría GeoJSON.
+    
+    Devuelve tuplas (anillo, signo) donde el signo es +1 para los anillos
+    exteriores de cada polígono y -1 para los huecos, que restan superficie.
+    
+    Raises:
+        ValueError: Si el tipo de geometría no es soportado
+    """
+    geom_type = geometry['type']
+    coords = geometry['coordinates']
+    
+    if geom_type == 'Polygon':
+        poligonos = [coords]
+    elif geom_type == 'MultiPolygon':
+        poligonos = coords
+    else:
+        raise ValueError(f"Tipo de geometría no soportado: {geom_type}")
+    
+    for poligono in poligonos:
+        for n, anillo in enumerate(poligono):
+            yield anillo, (1 if n == 0 else -1)
+
+
+def calcular_centroides(geometrias):
+    """
+    Calcula en bloque el centroide de superficie de una lista de geometrías.
+    
+    A diferencia del promedio de vértices, el centroide se pondera por el
+    área de cada anillo (fórmula del polígono de Gauss) y tiene en cuenta
+    todos los polígonos de un MultiPolygon y sus huecos, de modo que los
+    municipios con enclaves o exclaves obtienen un punto representativo.
+    
+    Todas las coordenadas se concatenan en un único array de NumPy y las
+    sumas por anillo y por geometría se hacen de forma vectorizada, sin
+    bucles de Python sobre los vértices.
+    
+    Args:
+        geometrias: Lista de diccionarios con geometrías GeoJSON
+        
+    Returns:
+        Array de NumPy de forma (n, 2) con (longitud, latitud) de cada centroide
+        
+    Raises:
+        ValueError: Si alguna geometría no es de un tipo soportado o está vacía
+    """
+    anillos = []
+    signos = []
+    geometria_de_anillo = []
+    for indice, geometry in enumerate(geometrias):
+        for anillo, signo in _anillos_geometria(geometry):
+            if len(anillo) == 0:
+                continue
+            anillos.append(np.asarray(anillo, dtype=np.float64)[:, :2])
+            signos.append(signo)
+            geometria_de_anillo.append(indice)
+    
+    total = len(geometrias)
+    if total == 0:
+        return np.empty((0, 2))
+    
+    anillos_por_geometria = np.bincount(geometria_de_anillo, minlength=total) if anillos else np.zeros(total)
+    if (anillos_por_geometria == 0).any():
+        raise ValueError("Geometría sin coordenadas")
+    
+    longitudes = np.array([len(anillo) for anillo in anillos])
+    inicios = np.concatenate(([0], np.cumsum(longitudes)[:-1]))
+    coords = np.concatenate(anillos)
+    
+    # Trabajar relativo al centro de los datos mejora la precisión numérica
+    origen = coords.mean(axis=0)
+    x = coords[:, 0] - origen[0]
+    y = coords[:, 1] - origen[1]
+    
+    # Índice del vértice siguiente dentro de cada anillo (el último enlaza con
+    # el primero, así que también funciona con anillos sin cerrar)
+    siguiente = np.arange(len(coords)) + 1
+    siguiente[inicios + longitudes - 1] = inicios
+    x_sig = x[siguiente]
+    y_sig = y[siguiente]
+    
+    cruz = x * y_sig - x_sig * y
+    area_anillo = np.add.reduceat(cruz, inicios) / 2
+    momento_x = np.add.reduceat((x + x_sig) * cruz, inicios) / 6
+    momento_y = np.add.reduceat((y + y_sig) * cruz, inicios) / 6
+    
+    # La orientación de los anillos no es fiable en todos los ficheros: se
+    # normaliza para que los exteriores sumen y los huecos resten
+    orientacion = np.sign(area_anillo) * np.array(signos)
+    geometria_de_anillo = np.array(geometria_de_anillo)
+    area = np.bincount(geometria_de_anillo, np.abs(area_anillo) * np.array(signos), minlength=total)
+    suma_x = np.bincount(geometria_de_anillo, momento_x * orientacion, minlength=total)
+    suma_y = np.bincount(geometria_de_anillo, momento_y * orientacion, minlength=total)
+    
+    # Geometrías degeneradas (área nula): se recurre al promedio de vértices
+    vertice_geometria = np.repeat(geometria_de_anillo, longitudes)
+    num_vertices = np.bincount(vertice_geometria, minlength=total)
+    media_x = np.bincount(vertice_geometria, x, minlength=total) / num_vertices
+    media_y = np.bincount(vertice_geometria, y, minlength=total) / num_vertices
+    
+    con_area = np.abs(area) > 1e-15
+    area_segura = np.where(con_area, area, 1)
+    centroide_x = np.where(con_area, suma_x / area_segura, media_x)
+    centroide_y = np.where(con_area, suma_y / area_segura, media_y)
+    
+    return np.column_stack((centroide_x + origen[0], centroide_y + origen[1]))
+
+
 def calcular_centroide(geometry):
     """
-    Calcula el centroide (centro geométrico) de una geometría GeoJSON.
+    Calcula el centroide (centro geométrico) de una geometría GeoJSON.
+    
+    Esta función maneja tanto polígonos simples (Polygon) como polígonos
+    múltiples (MultiPolygon). Es un atajo de calcular_centroides() para una
+    sola geometría.
+    
+    Args:
+        geometry: Diccionario con la geometría en formato GeoJSON
+        
+    Returns:
+        Tupla (longitud, latitud) del centroide
+        
+    Raises:
+        ValueError: Si el tipo de geometría no es soportado
+    """
+    lon_centro, lat_centro = calcular_centroides([geometry])[0]
+    return float(lon_centro), float(lat_centro)
+
+
+def clave_municipio(codigo_ine, indice):
+    """
+    Identificador con el que se cruzan los datos meteorológicos y la
+    geometría. Es el código INE (NATCODE) o, si falta, uno derivado de la
+    posición del municipio en el GeoJSON.
+    """
+    return codigo_ine or f"sin-codigo-{indice}"
+
+
+def leer_indice_centroides(hash_geojson, ruta_indice=CENTROIDES_FILE):
+    """
+    Lee el índice de centroides si corresponde al archivo GeoJSON actual.
+    
+    El índice se identifica por el hash del contenido del GeoJSON y guarda,
+    además del centroide, el nombre y el código de cada municipio. Así, en
+    una ejecución normal (límites sin cambios) no hace falta ni siquiera
+    interpretar el GeoJSON.
+    
+    Returns:
+        Lista de entradas del índice (diccionarios con nombre, codigo_ine,
+        lon y lat, o con un mensaje de error), o None si el índice no existe
+        o no corresponde al GeoJSON actual.
+    """
+    try:
+        with open(ruta_indice, 'r', encoding='utf-8') as f:
+            indice = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    
+    if (indice.get('hash_geojson') != hash_geojson
+            or indice.get('version') != VERSION_INDICE_CENTROIDES):
+        return None
+    return indice['municipios']
+
+
+def _entradas_indice(features):
+    """
+    Calcula en bloque los centroides de un lote de features y devuelve sus
+    entradas del índice (ver leer_indice_centroides).
+    """
+    try:
+        calculados = calcular_centroides([f['geometry'] for f in features])
+        centroides = [(float(lon), float(lat)) for lon, lat in calculados]
+        errores = [None] * len(features)
+    except Exception:
+        # Alguna geometría no es válida: se calcula una a una para aislar el error
+        centroides = []
+        errores = []
+        for feature in features:
+            try:
+                centroides.append(calcular_centroide(feature['geometry']))
+                errores.append(None)
+            except Exception as e:
+                centroides.append(None)
+                errores.append(e)
+    
+    entradas = []
+    for feature, centroide, error in zip(features, centroides, errores):
+        entrada = {
+            'nombre': feature['properties'].get('NAMEUNIT', 'Desconocido'),
+            'codigo_ine': feature['properties'].get('NATCODE', '')
+        }
+        if centroide is not None:
+            entrada['lon'] = round(centroide[0], 7)
+            entrada['lat'] = round(centroide[1], 7)
+        else:
+            entrada['error'] = str(error)
+        entradas.append(entrada)
+    return entradas
+
+
+def iterar_centroides(features, tamano_lote=TAMANO_LOTE_CENTROIDES):
+    """
+    Calcula los centroides de un flujo de features por lotes.
+    
+    Las features se agrupan en lotes de `tamano_lote` para aprovechar el
+    cálculo vectorizado, y cada lote se libera en cuanto se han calculado
+    sus centroides, así que la memoria no depende del tamaño del archivo.
+    
+    Args:
+        features: Iterable de features GeoJSON (por ejemplo, iterar_features())
+        tamano_lote: Número de features que se procesan juntas
+        
+    Yields:
+        Entradas del índice de centroides, una por feature y en orden
+    """
+    lote = []
+    for feature in features:
+        lote.append(feature)
+        if len(lote) >= tamano_lote:
+            yield from _entradas_indice(lote)
+            lote = []
+    if lote:
+        yield from _entradas_indice(lote)
+
+
+def guardar_indice_centroides(municipios, hash_geojson, ruta_indice=CENTROIDES_FILE):
+    """
+    Guarda el índice de centroides en disco para las siguientes ejecuciones.
+    
+    Args:
+        municipios: Lista de entradas del índice, una por municipio y en el
+                    mismo orden que en el GeoJSON
+        hash_geojson: Hash SHA-256 del archivo GeoJSON
+        ruta_indice: Ruta del índice de centroides
+    """
+    indice = {
+        'version': VERSION_INDICE_CENTROIDES,
+        'hash_geojson': hash_geojson,
+        'municipios': municipios
+    }
+    
+    try:
+        ruta_temporal = f"{ruta_indice}.tmp"
+        with open(ruta_temporal, 'w', encoding='utf-8') as f:
+            json.dump(indice, f, ensure_ascii=False, indent=1)
+        os.replace(ruta_temporal, ruta_indice)
+        metricas_ejecucion.registrar_escritura(ruta_indice, os.path.getsize(ruta_indice))
+        print(f"✅ Índice de centroides guardado en: {ruta_indice}")
+    except OSError as e:
+        print(f"⚠️  No se pudo guardar el índice de centroides: {e}")
+
+
+# ============================================================================
+# FUNCIONES DE GENERACIÓN DE LA GEOMETRÍA
+# ============================================================================
+
+def _parametros_geometria(hash_geojson, tolerancia):
+    """Parámetros con los que se genera un nivel de geometría; si cambian, se regenera."""
+    return {
+        'hash_geojson': hash_geojson,
+        'tolerancia': tolerancia,
+        'cuantizacion': GEOMETRIA_CUANTIZACION
+    }
+
+
+def _manifiesto_niveles():
+    """Lista de niveles de detalle que lee la página web."""
+    return {
+        'niveles': [
+            {'zoom_maximo': nivel['zoom_maximo'], 'archivo': os.path.basename(nivel['archivo'])}
+            for nivel in GEOMETRIA_NIVELES
+        ]
+    }
+
+
+def geometria_actualizada(hash_geojson, niveles=GEOMETRIA_NIVELES, ruta_niveles=GEOMETRIA_NIVELES_FILE):
+    """
+    Comprueba si los archivos de geometría de todos los niveles ya
+    corresponden al GeoJSON actual y a la configuración de simplificación
+    vigente.
+    """
+    try:
+        if esquema_mod.leer_json(ruta_niveles) != _manifiesto_niveles():
+            return False
+        for nivel in niveles:
+            topologia = esquema_mod.leer_json(nivel['archivo'])
+            if topologia.get('metadata') != _parametros_geometria(hash_geojson, nivel['tolerancia']):
+                return False
+    except (FileNotFoundError, ValueError):
+        return False
+    return True
+
+
+def generar_geometria(features, hash_geojson, niveles=GEOMETRIA_NIVELES, ruta_niveles=GEOMETRIA_NIVELES_FILE):
+    """
+    Genera los archivos TopoJSON con la geometría cuantizada y simplificada
+    de los municipios, uno por nivel de detalle, y la lista de niveles.
+    
+    La geometría se publica aparte de los datos meteorológicos porque solo
+    cambia cuando cambian los límites municipales. Cada geometría lleva
+    como `id` la misma clave que los datos de weather_data.json, y la página
+    web une ambos archivos al cargar.
+    
+    Args:
+        features: Iterable de features que se pueda recorrer dos veces (una
+                  lista o un LectorFeatures)
+        hash_geojson: Hash SHA-256 del archivo GeoJSON
+        niveles: Niveles de detalle (ver GEOMETRIA_NIVELES)
+        ruta_niveles: Ruta de la lista de niveles para la página web
+    """
+    tolerancias = [nivel['tolerancia'] for nivel in niveles]
+    print(f"🗺️  Generando geometría simplificada en {len(niveles)} niveles de detalle "
+          f"(tolerancias {', '.join(f'{t}°' for t in tolerancias)})...")
+    
+    topologias = topologia_mod.construir_topologias(
+        features,
+        lambda feature, indice: clave_municipio(feature['properties'].get('NATCODE', ''), indice),
+        tolerancias,
+        cuantizacion=GEOMETRIA_CUANTIZACION
+    )
+    
+    for nivel, topologia in zip(niveles, topologias):
+        topologia['metadata'] = _parametros_geometria(hash_geojson, nivel['tolerancia'])
+        ruta = nivel['archivo']
+        ruta_temporal = f"{ruta}.tmp"
+        with open(ruta_temporal, 'w', encoding='utf-8') as f:
+            json.dump(topologia, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(ruta_temporal, ruta)
+        metricas_ejecucion.registrar_escritura(ruta, os.path.getsize(ruta))
+        
+        vertices = sum(len(arco) for arco in topologia['arcs'])
+        hasta = f"zoom ≤ {nivel['zoom_maximo']}" if nivel['zoom_maximo'] is not None else "zoom mayor"
+        print(f"✅ Geometría ({hasta}) guardada en: {ruta} ({len(topologia['arcs'])} arcos, "
+              f"{vertices} vértices, {os.path.getsize(ruta) // 1024} KB)")
+    
+    # La lista de niveles se escribe la última: si existe, todos los niveles
+    # están completos
+    ruta_temporal = f"{ruta_niveles}.tmp"
+    with open(ruta_temporal, 'w', encoding='utf-8') as f:
+        json.dump(_manifiesto_niveles(), f, ensure_ascii=False, indent=2)
+    os.replace(ruta_temporal, ruta_niveles)
+    metricas_ejecucion.registrar_escritura(ruta_niveles, os.path.getsize(ruta_niveles))
+
+
+def generar_indice_espacial(features, hash_geojson, ruta=indice_espacial_mod.INDICE_ESPACIAL_FILE):
+    """
+    Construye y guarda el índice espacial de los municipios, con las mismas
+    claves que los datos de weather_data.json.
+    
+    Args:
+        features: Iterable de features (se recorre una sola vez)
+        hash_geojson: Hash SHA-256 del archivo GeoJSON
+        ruta: Ruta del archivo del índice
+    """
+    print("🧭 Generando índice espacial de los municipios...")
+    
+    indice = indice_espacial_mod.IndiceEspacial.construir(
+        features,
+        lambda feature, indice: clave_municipio(feature['properties'].get('NATCODE', ''), indice),
+        hash_geojson
+    )
+    indice.guardar(ruta)
+    metricas_ejecucion.registrar_escritura(ruta, os.path.getsize(ruta))
+    
+    print(f"✅ Índice espacial guardado en: {ruta} ({len(indice.claves)} municipios, "
+          f"{len(indice.cajas)} polígonos, {os.path.getsize(ruta) // 1024} KB)")
+
+
+# ============================================================================
+# FUNCIONES DE CONSULTA A LA API
+# ============================================================================
+
+_sesion_http = None
+_cerrojo_sesion = threading.Lock()
+
+
+def obtener_sesion_http():
+    """
+    Devuelve la sesión HTTP compartida por todas las consultas a la API.
+    
+    La sesión mantiene las conexiones abiertas (keep-alive), de modo que
+    solo la primera petición paga el coste del handshake TCP+TLS. El tamaño
+    del pool se ajusta al número de peticiones concurrentes para que ningún
+    hilo tenga que abrir conexiones nuevas.
+    """
+    global _sesion_http
+    
+    with _cerrojo_sesion:
+        if _sesion_http is None:
+            tamano_pool = max(1, PETICIONES_CONCURRENTES)
+            adaptador = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                      pool_maxsize=tamano_pool)
+            sesion = requests.Session()
+            sesion.mount('https://', adaptador)
+            sesion.mount('http://', adaptador)
+            _sesion_http = sesion
+    
+    return _sesion_http
+
+
+# Métricas de la ejecución en curso (ver metricas.py)
+metricas_ejecucion = metricas_mod.MetricasEjecucion()
+
+
+class CacheRespuestas:
+    """
+    Caché persistente de respuestas de OpenWeatherMap.
+    
+    Las entradas se indexan por latitud y longitud redondeadas, caducan
+    pasados `ttl` segundos y se descartan por antigüedad de uso (LRU) cuando
+    se supera `max_entradas`. La caché lleva la cuenta de aciertos y fallos
+    para poder informar de su eficacia al final de cada ejecución.
+    
+    Es segura para usarse desde varios hilos a la vez.
+    """
+    
+    def __init__(self, ruta, ttl, max_entradas, decimales=CACHE_DECIMALES):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.decimales = decimales
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._cerrojo = threading.Lock()
+    
+    def _clave(self, lat, lon):
+        return f"{lat:.{self.decimales}f},{lon:.{self.decimales}f}"
+    
+    def cargar(self):
+        """
+        Carga la caché desde disco descartando las entradas caducadas.
+        Un archivo ausente o corrupto equivale a empezar con la caché vacía.
+        """
+        try:
+            entradas = esquema_mod.leer_json(self.ruta)
+        except (FileNotFoundError, ValueError):
+            return
+        
+        ahora = time.time()
+        with self._cerrojo:
+            # El archivo se guarda del menos al más recientemente usado. Las
+            # respuestas se validan al cargarlas, igual que las de la API
+            for clave, entrada in entradas.items():
+                if ahora - entrada['guardado'] < self.ttl:
+                    try:
+                        datos = esquema_mod.ObservacionOWM.desde_respuesta(entrada['datos'])
+                    except esquema_mod.RespuestaInvalida:
+                        continue
+                    self._entradas[clave] = {'guardado': entrada['guardado'], 'datos': datos}
+    
+    def guardar_en_disco(self):
+        """
+        Escribe la caché en disco de forma atómica (archivo temporal y
+        renombrado) para que una ejecución interrumpida no la corrompa.
+        """
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        
+        with self._cerrojo:
+            entradas = {
+                clave: {'guardado': entrada['guardado'], 'datos': entrada['datos'].a_respuesta()}
+                for clave, entrada in self._entradas.items()
+            }
+        
+        ruta_temporal = f"{self.ruta}.tmp"
+        with open(ruta_temporal, 'wb') as f:
+            f.write(esquema_mod.codificar_json(entradas))
+        os.replace(ruta_temporal, self.ruta)
+        metricas_ejecucion.registrar_escritura(self.ruta, os.path.getsize(self.ruta))
+    
+    def obtener(self, lat, lon):
+        """
+        Devuelve la respuesta guardada para el punto, o None si no existe
+        o ha caducado.
+        """
+        clave = self._clave(lat, lon)
+        with self._cerrojo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and time.time() - entrada['guardado'] < self.ttl:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada['datos']
+            
+            if entrada is not None:
+                del self._entradas[clave]
+            self.fallos += 1
+            return None
+    
+    def guardar(self, lat, lon, datos):
+        """Guarda una ObservacionOWM y expulsa las menos usadas si se supera el límite."""
+        clave = self._clave(lat, lon)
+        with self._cerrojo:
+            self._entradas[clave] = {'guardado': time.time(), 'datos': datos}
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+
+class PuntoControl:
+    """
+    Registro incremental de los municipios completados en la ejecución en
+    curso, en formato JSON Lines.
+    
+    La primera línea identifica la ejecución (hash del GeoJSON e instante de
+    inicio) y cada una de las siguientes guarda los datos y la observación
+    de un municipio, con el instante (`ts`) de la ejecución que lo consultó,
+    para que al reanudar se registre en el histórico con ese instante y no
+    con el de la ejecución que lo reutiliza. Cada línea se vuelca al archivo en cuanto se añade, y
+    si el proceso muere a mitad de una línea, al reanudar se descarta esa
+    línea incompleta y las posteriores.
+    
+    consultar_municipios() anota los municipios en cuanto se puntúan, y
+    los puntúa antes de esperar a cualquier respuesta pendiente de la API:
+    una interrupción solo puede perder los municipios cuyas respuestas ya
+    habían llegado y se estaban puntuando en ese instante (como mucho
+    VENTANA_CONSULTAS), nunca los que esperaban a la red.
+    
+    Es el único resultado que se escribe a medida que avanza la ejecución:
+    OUTPUT_FILE se escribe al terminar, porque decidir si hay cambios
+    apreciables necesita todos los municipios.
+    """
+    
+    def __init__(self, ruta, hash_geojson, vigencia=PUNTO_CONTROL_VIGENCIA):
+        self.ruta = ruta
+        self.hash_geojson = hash_geojson
+        self.vigencia = vigencia
+        self.inicio = int(time.time())  # Instante de esta ejecución
+        self._archivo = None
+    
+    def cargar(self):
+        """
+        Lee los municipios completados por una ejecución anterior
+        interrumpida y deja el archivo abierto para seguir añadiendo.
+        
+        Returns:
+            Diccionario {clave: {'datos', 'observacion', 'ts'}} (vacío si no
+            hay punto de control válido para este GeoJSON)
+        """
+        completados = {}
+        valido = 0  # Bytes hasta la última línea completa y válida
+        try:
+            with open(self.ruta, 'rb') as f:
+                cabecera = esquema_mod.decodificar_json(f.readline())
+                if (cabecera.get('version') == VERSION_PUNTO_CONTROL
+                        and cabecera.get('hash_geojson') == self.hash_geojson
+                        and time.time() - cabecera['inicio'] < self.vigencia):
+                    valido = f.tell()
+                    for linea in f:
+                        if not linea.endswith(b'\n'):
+                            break
+                        registro = esquema_mod.decodificar_json(linea)
+                        completados[registro['clave']] = registro
+                        valido = f.tell()
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass  # Ausente o ilegible: se conserva lo leído hasta la última línea válida
+        
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        if valido:
+            self._archivo = open(self.ruta, 'r+b')
+            self._archivo.truncate(valido)
+            self._archivo.seek(valido)
+        else:
+            completados = {}
+            self._archivo = open(self.ruta, 'wb')
+            self._escribir({'version': VERSION_PUNTO_CONTROL, 'hash_geojson': self.hash_geojson,
+                            'inicio': time.time()})
+        return completados
+    
+    def _escribir(self, registro):
+        self._archivo.write(esquema_mod.codificar_json(registro) + b'\n')
+        self._archivo.flush()
+    
+    def registrar(self, clave, datos, observacion):
+        """
+        Añade un municipio completado. Si no se puede escribir, se avisa y se
+        deja de anotar: la ejecución sigue, solo que no se podrá reanudar.
+        """
+        if self._archivo is None:
+            return
+        try:
+            self._escribir({'clave': clave, 'datos': datos, 'observacion': observacion, 'ts': self.inicio})
+        except OSError as e:
+            print(f"⚠️  No se pudo escribir el punto de control ({e}); la ejecución no se podrá reanudar")
+            self.cerrar()
+    
+    def cerrar(self):
+        if self._archivo is not None:
+            archivo, self._archivo = self._archivo, None
+            try:
+                archivo.close()
+            except OSError:
+                pass  # Lo ya volcado sigue siendo válido para reanudar
+    
+    def eliminar(self):
+        """Borra el punto de control tras una ejecución terminada con éxito."""
+        self.cerrar()
+        try:
+            os.remove(self.ruta)
+        except FileNotFoundError:
+            pass
+
+
+class LimitadorTasa:
+    """
+    Limitador de tasa basado en un cubo de fichas (token bucket).
+    
+    El cubo contiene como máximo `rafaga` fichas y se recarga de forma
+    continua. Cada petición consume una ficha; si no quedan, la petición
+    reserva la siguiente y espera exactamente el tiempo que tarda en
+    recargarse. La tasa de recarga se calcula para que la ráfaga inicial
+    más lo recargado en un minuto sumen el cupo por minuto del proveedor,
+    de modo que el cupo se aprovecha entero sin llegar a superarse.
+    
+    Es seguro usarlo desde varios hilos a la vez.
+    """
+    
+    def __init__(self, peticiones_por_minuto, rafaga=1):
+        if peticiones_por_minuto < 1:
+            raise ValueError(f"El cupo por minuto debe ser positivo: {peticiones_por_minuto}")
+        
+        # La ráfaga no puede consumir el cupo entero o el cubo nunca se recargaría
+        self.capacidad = max(1, min(rafaga, peticiones_por_minuto - 1))
+        recarga_por_minuto = max(1, peticiones_por_minuto - self.capacidad)
+        self.tasa = recarga_por_minuto / 60  # Fichas por segundo
+        
+        self._fichas = float(self.capacidad)
+        self._ultima_recarga = time.monotonic()
+        self._cerrojo = threading.Lock()
+    
+    def adquirir(self):
+        """
+        Bloquea hasta que la petición puede salir respetando el cupo.
+        
+        Las fichas pueden quedar en negativo: cada llamada reserva su turno
+        dentro del cerrojo y duerme fuera de él, así que las peticiones
+        salen en orden de llegada y sin esperas activas.
+        """
+        with self._cerrojo:
+            ahora = time.monotonic()
+            transcurrido = ahora - self._ultima_recarga
+            self._fichas = min(self.capacidad, self._fichas + transcurrido * self.tasa)
+            self._ultima_recarga = ahora
+            self._fichas -= 1
+            espera = -self._fichas / self.tasa if self._fichas < 0 else 0
+        
+        if espera > 0:
+            time.sleep(espera)
+
+
+def _espera_reintento(intento, respuesta=None):
+    """
+    Segundos que hay que esperar antes del reintento número `intento`
+    (empezando en 0). Si la respuesta trae cabecera Retry-After en segundos
+    se respeta; si no, la espera se duplica en cada intento.
+    """
+    espera = REINTENTO_ESPERA_BASE * (2 ** intento)
+    if respuesta is not None:
+        try:
+            espera = float(respuesta.headers.get('Retry-After', espera))
+        except ValueError:
+            pass  # Retry-After con fecha HTTP: se usa la espera exponencial
+    return min(max(espera, 0.0), REINTENTO_ESPERA_MAXIMA)
+
+
+def obtener_datos_clima(lat, lon, nombre_municipio, limitador=None):
+    """
+    Consulta la API de OpenWeatherMap para obtener datos meteorológicos
+    de un punto geográfico específico.
+    
+    La función realiza una petición HTTP a la API de OpenWeatherMap usando
+    las coordenadas proporcionadas. Los datos se obtienen en unidades métricas
+    (temperatura en Celsius, velocidad del viento en m/s) y en español.
+    
+    Los errores transitorios (429, 5xx, timeouts y errores de red) se
+    reintentan hasta REINTENTOS_MAXIMOS veces. La latencia y el resultado de
+    cada intento se anotan en las métricas de la ejecución.
+    
+    Args:
+        lat: Latitud del punto a consultar (float)
+        lon: Longitud del punto a consultar (float)
+        nombre_municipio: Nombre del municipio (string, solo para logging)
+        limitador: LimitadorTasa en el que esperar turno antes de cada
+                   intento, o None para no limitar
+        
+    Returns:
+        ObservacionOWM con los datos meteorológicos ya validados, o None si
+        ocurre algún error en la petición o la respuesta no tiene la forma
+        esperada.
+        
+    Nota:
+        La función incluye un timeout de 10 segundos para evitar bloqueos
+        indefinidos en caso de problemas de red.
+    """
+    params = {
+        'lat': lat,
+        'lon': lon,
+        'appid': OPENWEATHER_API_KEY,
+        'units': 'metric',  # Obtener temperatura en Celsius y viento en m/s
+        'lang': 'es'        # Descripciones del clima en español
+    }
+    datos = consultar_api('weather', params, nombre_municipio, limitador)
+    if datos is None:
+        return None
+    
+    # La forma de la respuesta se comprueba una sola vez, aquí: una respuesta
+    # incompleta cuenta como error y no llega a la caché ni al índice
+    try:
+        return esquema_mod.ObservacionOWM.desde_respuesta(datos)
+    except esquema_mod.RespuestaInvalida as e:
+        metricas_ejecucion.contar('respuestas_invalidas')
+        print(f"⚠️  Respuesta no válida al consultar {nombre_municipio}: {e}")
+        return None
+
+
+def consultar_api(recurso, params, nombre_municipio, limitador=None):
+    """
+    Hace una petición GET a un recurso de la API de OpenWeatherMap (por
+    ejemplo 'weather' o 'forecast') con los reintentos y las métricas
+    descritos en obtener_datos_clima(). La usan también otros scripts del
+    proyecto, como prevision.py.
+    
+    Args:
+        recurso: Ruta del recurso bajo OPENWEATHER_API_BASE
+        params: Parámetros de la consulta, incluida la clave de la API
+        nombre_municipio: Nombre del municipio (solo para logging)
+        limitador: LimitadorTasa en el que esperar turno antes de cada
+                   intento, o None para no limitar
+    
+    Returns:
+        La respuesta JSON decodificada, o None si la petición ha fallado
+    """
+    url = f"{OPENWEATHER_API_BASE}/{recurso}"
+    
+    for intento in range(REINTENTOS_MAXIMOS + 1):
+        ultimo_intento = intento == REINTENTOS_MAXIMOS
+        if limitador is not None:
+            limitador.adquirir()
+        inicio = time.perf_counter()
+        
+        try:
+            response = obtener_sesion_http().get(url, params=params, timeout=10)
+            metricas_ejecucion.registrar_peticion(time.perf_counter() - inicio, response.status_code)
+            
+            if response.status_code in CODIGOS_REINTENTABLES and not ultimo_intento:
+                metricas_ejecucion.contar('reintentos')
+                time.sleep(_espera_reintento(intento, response))
+                continue
+            
+            response.raise_for_status()  # Lanza excepción si el código de respuesta indica error
+            return esquema_mod.decodificar_json(response.content)
+        
+        except requests.exceptions.Timeout:
+            metricas_ejecucion.registrar_peticion(time.perf_counter() - inicio, 'timeout')
+            if not ultimo_intento:
+                metricas_ejecucion.contar('reintentos')
+                time.sleep(_espera_reintento(intento))
+                continue
+            print(f"⚠️  Timeout al consultar {nombre_municipio} - la API tardó más de 10 segundos")
+            return None
+        
+        except requests.exceptions.HTTPError as e:
+            print(f"⚠️  Error HTTP al consultar {nombre_municipio}: {e}")
+            return None
+        
+        except requests.exceptions.RequestException as e:
+            # Solo los fallos de conexión son transitorios
+            if isinstance(e, requests.exceptions.ConnectionError):
+                metricas_ejecucion.registrar_peticion(time.perf_counter() - inicio, 'error_red')
+                if not ultimo_intento:
+                    metricas_ejecucion.contar('reintentos')
+                    time.sleep(_espera_reintento(intento))
+                    continue
+            print(f"⚠️  Error de red al consultar {nombre_municipio}: {e}")
+            return None
+        
+        except ValueError as e:
+            # El cuerpo no es JSON válido (no se reintenta)
+            print(f"⚠️  Respuesta no válida al consultar {nombre_municipio}: {e}")
+            return None
+
+
+def obtener_datos_clima_limitado(limitador, lat, lon, nombre_municipio, cache=None):
+    """
+    Variante de obtener_datos_clima que consulta primero la caché y, si no
+    hay respuesta válida, espera turno en el limitador de tasa antes de
+    lanzar la petición (y antes de cada reintento). Es la función que
+    ejecutan los hilos del modo concurrente. Los aciertos de caché no
+    consumen cupo de la API.
+    """
+    if cache is not None:
+        datos_clima = cache.obtener(lat, lon)
+        if datos_clima is not None:
+            return datos_clima
+    
+    datos_clima = obtener_datos_clima(lat, lon, nombre_municipio, limitador)
+    
+    if datos_clima and cache is not None:
+        cache.guardar(lat, lon, datos_clima)
+    return datos_clima
+
+
+def consultar_en_orden(municipios, ejecutor, limitador, cache, ventana=VENTANA_CONSULTAS, omitidos=None):
+    """
+    Lanza las consultas de un flujo de municipios manteniendo como máximo
+    `ventana` pendientes a la vez, y los devuelve en el orden de entrada.
+    
+    Los municipios se van leyendo del iterable a medida que se libera sitio
+    en la ventana, de modo que la memoria no depende del total.
+    
+    Args:
+        municipios: Iterable de entradas del índice de centroides
+        ejecutor: Grupo de hilos en el que lanzar las consultas
+        limitador: LimitadorTasa compartido
+        cache: CacheRespuestas o None
+        ventana: Número máximo de municipios con la consulta en curso
+        omitidos: Claves de los municipios que no hay que consultar (los ya
+                  completados de una ejecución reanudada), o None
+        
+    Yields:
+        Tuplas (municipio, futuro); el futuro es None para los municipios
+        cuyo centroide no se pudo calcular y para los omitidos
+    """
+    pendientes = deque()
+    for posicion, municipio in enumerate(municipios):
+        futuro = None
+        if omitidos and (municipio.get('clave') or clave_municipio(municipio['codigo_ine'], posicion)) in omitidos:
+            pass
+        elif 'error' not in municipio:
+            futuro = ejecutor.submit(obtener_datos_clima_limitado, limitador, municipio['lat'],
+                                     municipio['lon'], municipio['nombre'], cache)
+        pendientes.append((municipio, futuro))
+        if len(pendientes) >= ventana:
+            yield pendientes.popleft()
+    while pendientes:
+        yield pendientes.popleft()
+
+
+# ============================================================================
+# FUNCIONES DE DEDUPLICACIÓN ESPACIAL (MODO REJILLA)
+# ============================================================================
+
+# Variables meteorológicas que se interpolan: atributo de ObservacionOWM y
+# nombre en el informe de validación (su ruta en la respuesta de la API)
+VARIABLES_INTERPOLADAS = [
+    ('temp', 'main.temp'),
+    ('sensacion', 'main.feels_like'),
+    ('humedad', 'main.humidity'),
+    ('viento', 'wind.speed'),
+    ('lluvia', 'rain.1h'),
+    ('nieve', 'snow.1h'),
+]
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """
+    Distancia aproximada en kilómetros entre dos puntos cercanos.
+    
+    Usa la proyección equirectangular, más que suficiente para distancias
+    de decenas de kilómetros como las que hay entre municipios vecinos.
+    """
+    lat_media = math.radians((lat1 + lat2) / 2)
+    dx = (lon2 - lon1) * 111.32 * math.cos(lat_media)
+    dy = (lat2 - lat1) * 110.57
+    return math.hypot(dx, dy)
+
+
+def agrupar_en_rejilla(puntos, tamano_celda):
+    """
+    Agrupa puntos (lon, lat) en las celdas de una rejilla regular.
+    
+    Args:
+        puntos: Lista de tuplas (longitud, latitud)
+        tamano_celda: Lado de la celda en grados
+        
+    Returns:
+        Lista de celdas, cada una como diccionario con:
+        - lat, lon: punto de consulta (media de los puntos de la celda)
+        - miembros: índices de los puntos que pertenecen a la celda
+        Las celdas se devuelven en el orden en que aparece su primer punto.
+    """
+    celdas = {}
+    for indice, (lon, lat) in enumerate(puntos):
+        clave = (math.floor(lon / tamano_celda), math.floor(lat / tamano_celda))
+        celdas.setdefault(clave, []).append(indice)
+    
+    resultado = []
+    for miembros in celdas.values():
+        resultado.append({
+            'lon': sum(puntos[i][0] for i in miembros) / len(miembros),
+            'lat': sum(puntos[i][1] for i in miembros) / len(miembros),
+            'miembros': miembros
+        })
+    return resultado
+
+
+def interpolar_idw(lat, lon, consultas, vecinos=REJILLA_VECINOS_IDW,
+                   potencia=REJILLA_POTENCIA_IDW):
+    """
+    Interpola los datos meteorológicos en un punto por distancia inversa
+    ponderada (IDW) a partir de los puntos consultados más cercanos.
+    
+    Args:
+        lat, lon: Coordenadas del punto a estimar
+        consultas: Lista de tuplas (lat, lon, observacion) con las
+                   respuestas de la API en los puntos de consulta
+        vecinos: Número de puntos de consulta más cercanos a utilizar
+        potencia: Exponente aplicado a la distancia en los pesos
+        
+    Returns:
+        ObservacionOWM como la de una respuesta de la API, de modo que el
+        resto del proceso no distingue entre datos consultados e
+        interpolados. Las variables no numéricas
+        (descripción e icono) se toman del punto de consulta más cercano.
+        Devuelve None si no hay ningún punto de consulta disponible.
+    """
+    if not consultas:
+        return None
+    
+    cercanos = sorted(
+        ((distancia_km(lat, lon, c_lat, c_lon), datos) for c_lat, c_lon, datos in consultas),
+        key=lambda cercano: cercano[0]
+    )[:vecinos]
+    
+    # Si el punto coincide con uno de consulta se usa su valor sin ponderar
+    if cercanos[0][0] < 1e-6:
+        pesos = [1.0]
+        cercanos = cercanos[:1]
+    else:
+        pesos = [1 / distancia ** potencia for distancia, _ in cercanos]
+    suma_pesos = sum(pesos)
+    
+    valores = {}
+    for atributo, _ in VARIABLES_INTERPOLADAS:
+        valores[atributo] = sum(peso * getattr(datos, atributo)
+                                for peso, (_, datos) in zip(pesos, cercanos)) / suma_pesos
+    
+    mas_cercano = cercanos[0][1]
+    return esquema_mod.ObservacionOWM(
+        valores['temp'],
+        valores['sensacion'],
+        round(valores['humedad']),
+        valores['viento'],
+        # Sin precipitación el valor es 0, como cuando la API omite el campo
+        valores['lluvia'] if valores['lluvia'] > 0 else 0,
+        valores['nieve'] if valores['nieve'] > 0 else 0,
+        mas_cercano.descripcion,
+        mas_cercano.icono
+    )
+
+
+def consultar_por_rejilla(ejecutor, limitador, cache, centroides, nombres):
+    """
+    Obtiene los datos meteorológicos de todos los municipios haciendo una
+    sola consulta por celda de la rejilla e interpolando después.
+    
+    Además consulta directamente una pequeña muestra de municipios para
+    medir el error que introduce la interpolación frente a la consulta
+    individual.
+    
+    Args:
+        ejecutor: Grupo de hilos en el que lanzar las consultas
+        limitador: LimitadorTasa compartido
+        cache: CacheRespuestas o None
+        centroides: Lista de tuplas (lon, lat), o None para los municipios
+                    cuyo centroide no se pudo calcular
+        nombres: Nombres de los municipios (para el registro)
+        
+    Returns:
+        Tupla (resultados, informe):
+        - resultados: lista de Future ya resueltos, uno por municipio y en el
+          mismo orden que `centroides`, con los datos interpolados (o None)
+        - informe: diccionario con el número de consultas y el error medido
+    """
+    validos = [i for i, c in enumerate(centroides) if c is not None]
+    celdas = agrupar_en_rejilla([centroides[i] for i in validos], REJILLA_TAMANO_CELDA)
+    
+    futuros_celdas = [
+        ejecutor.submit(obtener_datos_clima_limitado, limitador, celda['lat'], celda['lon'],
+                        f"celda {n} ({len(celda['miembros'])} municipios)", cache)
+        for n, celda in enumerate(celdas, 1)
+    ]
+    
+    # Muestra de validación repartida uniformemente entre los municipios
+    tamano_muestra = min(REJILLA_MUESTRA_VALIDACION, len(validos))
+    muestra = [validos[(k * len(validos)) // tamano_muestra] for k in range(tamano_muestra)]
+    futuros_muestra = {
+        i: ejecutor.submit(obtener_datos_clima_limitado, limitador, centroides[i][1],
+                           centroides[i][0], nombres[i], cache)
+        for i in muestra
+    }
+    
+    consultas = [
+        (celda['lat'], celda['lon'], futuro.result())
+        for celda, futuro in zip(celdas, futuros_celdas)
+    ]
+    consultas = [c for c in consultas if c[2]]
+    
+    resultados = []
+    for centroide in centroides:
+        futuro = Future()
+        if centroide is None:
+            futuro.set_result(None)
+        else:
+            lon, lat = centroide
+            futuro.set_result(interpolar_idw(lat, lon, consultas))
+        resultados.append(futuro)
+    
+    # Error de la interpolación en la muestra frente a la consulta directa
+    errores = {nombre: [] for _, nombre in VARIABLES_INTERPOLADAS}
+    for i, futuro in futuros_muestra.items():
+        directo = futuro.result()
+        interpolado = resultados[i].result()
+        if not directo or not interpolado:
+            continue
+        for atributo, nombre in VARIABLES_INTERPOLADAS:
+            errores[nombre].append(abs(getattr(directo, atributo) - getattr(interpolado, atributo)))
+    
+    informe = {
+        'tamano_celda_grados': REJILLA_TAMANO_CELDA,
+        'consultas_celdas': len(celdas),
+        'consultas_validacion': len(futuros_muestra),
+        'municipios': len(validos),
+        'error_validacion': {
+            variable: {
+                'medio': round(sum(valores) / len(valores), 3),
+                'maximo': round(max(valores), 3)
+            }
+            for variable, valores in errores.items() if valores
+        }
+    }
+    return resultados, informe
+
+
+# ============================================================================
+# FUNCIONES DE EVALUACIÓN DEL CLIMA
+# ============================================================================
+
+def extraer_variables(observaciones):
+    """
+    Extrae en arrays las variables meteorológicas que usa el índice a partir
+    de una lista de ObservacionOWM (respuestas de /weather o franjas de
+    /forecast, con la precipitación ya en mm/h).
+    
+    Returns:
+        Diccionario {variable: array de NumPy} con temp, sensacion, viento
+        (en km/h), lluvia y nieve (en mm/h, 0 si no hay precipitación) y
+        diferencia_sensacion (sensación térmica menos temperatura)
+    """
+    n = len(observaciones)
+    temp = np.fromiter((o.temp for o in observaciones), np.float64, n)
+    sensacion = np.fromiter((o.sensacion for o in observaciones), np.float64, n)
+    # El viento llega en m/s y se convierte a km/h para facilitar la interpretación
+    viento = np.fromiter((o.viento for o in observaciones), np.float64, n) * 3.6
+    lluvia = np.fromiter((o.lluvia for o in observaciones), np.float64, n)
+    nieve = np.fromiter((o.nieve for o in observaciones), np.float64, n)
+    
+    return {
+        'temp': temp,
+        'sensacion': sensacion,
+        'viento': viento,
+        'lluvia': lluvia,
+        'nieve': nieve,
+        'diferencia_sensacion': sensacion - temp
+    }
+
+
+class MotorIndice:
+    """
+    Motor de puntuación del índice de buen tiempo basado en una tabla de
+    reglas declarativa (ver reglas_indice.json).
+    
+    El sistema funciona con una puntuación de 0 a 100 puntos, donde 100
+    representa condiciones perfectas para actividades al aire libre. Cada
+    factor (temperatura, sensación térmica, viento, lluvia y nieve) compara
+    su variable con una lista de bandas y aplica la penalización y el
+    consejo de la primera que encaja.
+    
+    Clasificación final (con las reglas por defecto):
+    - Verde (70-100 puntos): Condiciones óptimas
+    - Amarillo (40-69 puntos): Condiciones aceptables con precauciones
+    - Rojo (0-39 puntos): Condiciones adversas
+    
+    Todas las comparaciones se hacen de forma vectorizada con NumPy sobre
+    arrays con muchos puntos a la vez (todos los municipios, o todas las
+    franjas de una previsión), así que volver a puntuar con otros criterios
+    cuesta milisegundos.
+    """
+    
+    def __init__(self, reglas, criterios=CRITERIOS):
+        """
+        Args:
+            reglas: Diccionario con la tabla de reglas
+            criterios: Valores a los que pueden hacer referencia los límites
+                       de las bandas por su nombre
+        """
+        self.reglas = reglas
+        self.puntuacion_inicial = reglas['puntuacion_inicial']
+        self.factores = []
+        for factor in reglas['factores']:
+            bandas = []
+            for banda in factor['bandas']:
+                bandas.append({
+                    'desde': self._resolver_limite(banda.get('desde'), criterios),
+                    'hasta': self._resolver_limite(banda.get('hasta'), criterios),
+                    'incluye_desde': banda.get('incluye_desde', True),
+                    'incluye_hasta': banda.get('incluye_hasta', True),
+                    'penalizacion': banda['penalizacion'],
+                    'consejo': banda.get('consejo')
+                })
+            self.factores.append({
+                'nombre': factor['nombre'],
+                'variable': factor['variable'],
+                'bandas': bandas,
+                'penalizaciones': np.array([b['penalizacion'] for b in bandas])
+            })
+        self.niveles = reglas['niveles']
+    
+    @classmethod
+    def desde_archivo(cls, ruta, criterios=CRITERIOS):
+        """Crea el motor a partir de un archivo JSON con la tabla de reglas."""
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), criterios)
+    
+    @staticmethod
+    def _resolver_limite(limite, criterios):
+        if limite is None or isinstance(limite, (int, float)):
+            return limite
+        return criterios[limite]
+    
+    def _clasificar_bandas(self, factor, valores):
+        """
+        Devuelve, para cada valor, el índice de la primera banda del factor
+        que lo contiene. Los valores que no encajan en ninguna (por ejemplo
+        NaN) reciben la última banda, igual que la rama `else` de una cadena
+        if/elif.
+        """
+        asignada = np.full(len(valores), len(factor['bandas']) - 1)
+        pendiente = np.ones(len(valores), dtype=bool)
+        for n, banda in enumerate(factor['bandas']):
+            encaja = pendiente.copy()
+            if banda['desde'] is not None:
+                encaja &= (valores >= banda['desde']) if banda['incluye_desde'] else (valores > banda['desde'])
+            if banda['hasta'] is not None:
+                encaja &= (valores <= banda['hasta']) if banda['incluye_hasta'] else (valores < banda['hasta'])
+            asignada[encaja] = n
+            pendiente &= ~encaja
+        return asignada
+    
+    def puntuar(self, variables):
+        """
+        Puntúa en bloque todos los puntos.
+        
+        Args:
+            variables: Diccionario {variable: array} como el que devuelve
+                       extraer_variables()
+            
+        Returns:
+            Diccionario con:
+            - puntuacion: array de enteros de 0 a 100
+            - nivel: array con el índice de nivel en la tabla `niveles`
+            - bandas: lista con el array de bandas aplicadas en cada factor
+        """
+        bandas = [self._clasificar_bandas(f, variables[f['variable']]) for f in self.factores]
+        penalizacion = sum(f['penalizaciones'][b] for f, b in zip(self.factores, bandas))
+        puntuacion = np.maximum(self.puntuacion_inicial - penalizacion, 0)
+        
+        nivel = np.full(len(puntuacion), len(self.niveles) - 1)
+        for n in reversed(range(len(self.niveles))):
+            minimo = self.niveles[n]['minimo']
+            if minimo is not None:
+                nivel[puntuacion >= minimo] = n
+        
+        return {'puntuacion': puntuacion, 'nivel': nivel, 'bandas': bandas}
+    
+    def evaluar(self, lista_datos_clima):
+        """
+        Calcula el índice completo (nivel, puntuación, mensaje, consejos y
+        color) de una lista de ObservacionOWM (o de respuestas de
+        OpenWeatherMap sin validar, que se validan aquí). Las entradas
+        vacías (None) reciben el índice de "sin datos".
+        
+        Returns:
+            Lista de diccionarios con el mismo formato que
+            calcular_indice_tiempo(), en el mismo orden que la entrada
+        """
+        resultados = [None] * len(lista_datos_clima)
+        con_datos = [i for i, datos in enumerate(lista_datos_clima) if datos]
+        
+        for i, datos in enumerate(lista_datos_clima):
+            if not datos:
+                resultados[i] = copy.deepcopy(self.reglas['sin_datos'])
+        if not con_datos:
+            return resultados
+        
+        variables = extraer_variables([
+            esquema_mod.ObservacionOWM.desde_valor(lista_datos_clima[i]) for i in con_datos
+        ])
+        puntos = self.puntuar(variables)
+        
+        # Pasar los arrays a listas de Python una sola vez es mucho más
+        # rápido que acceder elemento a elemento a los arrays de NumPy
+        puntuaciones = puntos['puntuacion'].tolist()
+        niveles = puntos['nivel'].tolist()
+        consejos_por_factor = []
+        for factor, bandas in zip(self.factores, puntos['bandas']):
+            plantillas = [banda['consejo'] for banda in factor['bandas']]
+            valores = variables[factor['variable']].tolist()
+            consejos_por_factor.append([
+                plantillas[b].format(valor=int(v)) if plantillas[b] else None
+                for b, v in zip(bandas.tolist(), valores)
+            ])
+        
+        for fila, i in enumerate(con_datos):
+            consejos = [c[fila] for c in consejos_por_factor if c[fila]]
+            if not consejos:
+                consejos.append(self.reglas['consejo_sin_penalizaciones'])
+            
+            nivel = self.niveles[niveles[fila]]
+            resultados[i] = {
+                'nivel': nivel['nivel'],
+                'puntuacion': puntuaciones[fila],
+                'mensaje': nivel['mensaje'],
+                'consejos': consejos,
+                'color': nivel['color']
+            }
+        
+        return resultados
+
+
+_motor_indice = None
+
+
+def obtener_motor_indice():
+    """Devuelve el motor de puntuación con las reglas y criterios por defecto."""
+    global _motor_indice
+    if _motor_indice is None:
+        _motor_indice = MotorIndice.desde_archivo(REGLAS_INDICE_FILE, CRITERIOS)
+    return _motor_indice
+
+
+def calcular_indice_tiempo(datos_clima):
+    """
+    Calcula un índice de calidad del tiempo basado en múltiples variables
+    meteorológicas y genera recomendaciones para el usuario.
+    
+    Es un atajo de MotorIndice.evaluar() para un solo punto; para puntuar
+    muchos puntos a la vez conviene usar el motor directamente.
+    
+    Args:
+        datos_clima: ObservacionOWM, o diccionario con la respuesta de
+                     OpenWeatherMap
+        
+    Returns:
+        Diccionario con las siguientes claves:
+        - nivel: 'verde', 'amarillo', 'rojo' o 'sin-datos'
+        - puntuacion: Valor numérico de 0 a 100
+        - mensaje: Texto breve describiendo la condición general
+        - consejos: Lista de strings con recomendaciones específicas
+        - color: Código hexadecimal del color para visualización
+    """
+    return obtener_motor_indice().evaluar([datos_clima])[0]
+
+
+# ============================================================================
+# FUNCIONES DE ESCRITURA DE RESULTADOS
+# ============================================================================
+
+# Columnas numéricas de la salida columnar, como ruta dentro de los datos
+# de cada municipio
+COLUMNAS_NUMERICAS = [
+    ('lat', ('coordenadas', 'lat')),
+    ('lon', ('coordenadas', 'lon')),
+    ('temperatura', ('clima', 'temperatura')),
+    ('sensacion', ('clima', 'sensacion')),
+    ('humedad', ('clima', 'humedad')),
+    ('viento', ('clima', 'viento')),
+    ('puntuacion', ('indice', 'puntuacion')),
+]
+
+
+class _Diccionario:
+    """Tabla de valores distintos que asigna a cada uno un código entero."""
+    
+    def __init__(self):
+        self.valores = []
+        self._codigos = {}
+    
+    def codigo(self, valor):
+        clave = json.dumps(valor, sort_keys=True, ensure_ascii=False)
+        if clave not in self._codigos:
+            self._codigos[clave] = len(self.valores)
+            self.valores.append(valor)
+        return self._codigos[clave]
+
+
+def calcular_delta(anteriores, nuevos, tolerancias=TOLERANCIAS_CAMBIO):
+    """
+    Compara los datos de dos ejecuciones municipio a municipio.
+    
+    Args:
+        anteriores: Diccionario {clave: datos del municipio} de la ejecución
+                    anterior
+        nuevos: Diccionario {clave: datos del municipio} de esta ejecución
+        tolerancias: Diferencia mínima por variable de `clima` para que un
+                     cambio se considere apreciable
+        
+    Returns:
+        Diccionario con:
+        - cambios: {clave: {campo: [antes, después]}} con los municipios cuyo
+          índice (nivel o puntuación) ha cambiado o que superan alguna tolerancia
+        - nuevos: claves que no estaban en la ejecución anterior
+        - eliminados: claves que ya no aparecen
+    """
+    cambios = {}
+    for clave, nuevo in nuevos.items():
+        anterior = anteriores.get(clave)
+        if anterior is None:
+            continue
+        
+        diferencias = {}
+        for campo, tolerancia in tolerancias.items():
+            antes = anterior['clima'][campo]
+            despues = nuevo['clima'][campo]
+            if abs(despues - antes) >= tolerancia:
+                diferencias[campo] = [antes, despues]
+        for campo in ('nivel', 'puntuacion'):
+            antes = anterior['indice'][campo]
+            despues = nuevo['indice'][campo]
+            if antes != despues:
+                diferencias[campo] = [antes, despues]
+        
+        if diferencias:
+            cambios[clave] = diferencias
+    
+    return {
+        'cambios': cambios,
+        'nuevos': [clave for clave in nuevos if clave not in anteriores],
+        'eliminados': [clave for clave in anteriores if clave not in nuevos]
+    }
+
+
+def cargar_salida_anterior(ruta=OUTPUT_FILE):
+    """
+    Lee el archivo principal de la ejecución anterior.
+    
+    Returns:
+        El contenido del archivo, o None si no existe, no es válido o tiene
+        un formato anterior (lista de features en lugar de diccionario)
+    """
+    try:
+        anterior = esquema_mod.leer_json(ruta)
+    except (FileNotFoundError, ValueError):
+        return None
+    
+    if not isinstance(anterior, dict) or not isinstance(anterior.get('municipios'), dict):
+        return None
+    return anterior
+
+
+def construir_salida_columnar(datos_finales):
+    """
+    Convierte la salida principal (un diccionario por municipio) en una
+    representación por columnas.
+    
+    Cada campo se guarda como un único array con un valor por municipio, en
+    el orden de `claves`. Los textos que se repiten entre municipios
+    (descripción, icono, consejos y la terna nivel/color/mensaje del índice)
+    se sustituyen por códigos enteros que apuntan a `diccionarios`. Así los
+    nombres de campo y los consejos aparecen una sola vez en el archivo.
+    
+    Args:
+        datos_finales: Diccionario con `metadata` y `municipios` tal y como
+                       se escribe en OUTPUT_FILE
+        
+    Returns:
+        Diccionario con `metadata`, `claves`, `columnas` y `diccionarios`
+    """
+    municipios = datos_finales['municipios']
+    claves = list(municipios)
+    
+    descripciones = _Diccionario()
+    iconos = _Diccionario()
+    consejos = _Diccionario()
+    niveles = _Diccionario()
+    
+    columnas = {
+        'nombre': [municipios[c]['nombre'] for c in claves],
+        'codigo_ine': [municipios[c]['codigo_ine'] for c in claves],
+    }
+    for columna, (grupo, campo) in COLUMNAS_NUMERICAS:
+        columnas[columna] = [municipios[c][grupo][campo] for c in claves]
+    
+    columnas['descripcion'] = [descripciones.codigo(municipios[c]['clima']['descripcion']) for c in claves]
+    columnas['icono'] = [iconos.codigo(municipios[c]['clima']['icono']) for c in claves]
+    columnas['nivel'] = [
+        niveles.codigo({
+            'nivel': municipios[c]['indice']['nivel'],
+            'color': municipios[c]['indice']['color'],
+            'mensaje': municipios[c]['indice']['mensaje']
+        })
+        for c in claves
+    ]
+    columnas['consejos'] = [
+        [consejos.codigo(consejo) for consejo in municipios[c]['indice']['consejos']]
+        for c in claves
+    ]
+    
+    return {
+        'metadata': datos_finales['metadata'],
+        'claves': claves,
+        'columnas': columnas,
+        'diccionarios': {
+            'descripcion': descripciones.valores,
+            'icono': iconos.valores,
+            'nivel': niveles.valores,
+            'consejos': consejos.valores
+        }
+    }
+
+
+def _escribir_en_flujo(ruta, bloques):
+    """
+    Escribe una secuencia de bloques de bytes en un archivo temporal a
+    medida que se generan y lo renombra sobre el destino al terminar, de
+    modo que el documento completo nunca está entero en memoria y el
+    destino tiene siempre o la versión anterior o la nueva completa. Si
+    algo falla, el temporal se borra y la excepción se propaga.
+    
+    Returns:
+        Bytes escritos
+    """
+    ruta_temporal = f"{ruta}.tmp"
+    escritos = 0
+    try:
+        with open(ruta_temporal, 'wb') as f:
+            for bloque in bloques:
+                f.write(bloque)
+                escritos += len(bloque)
+        os.replace(ruta_temporal, ruta)
+    except BaseException:
+        try:
+            os.remove(ruta_temporal)
+        except OSError:
+            pass
+        raise
+    metricas_ejecucion.registrar_escritura(ruta, escritos)
+    return escritos
+
+
+def _escribir_atomico(ruta, contenido):
+    """Escribe bytes en un archivo temporal y lo renombra sobre el destino."""
+    _escribir_en_flujo(ruta, (contenido,))
+
+
+def escribir_con_variantes(ruta, contenido, precomprimir=SALIDA_PRECOMPRIMIDA):
+    """
+    Escribe un archivo y, si se piden, sus variantes precomprimidas (`.gz`
+    y, si brotli está disponible, `.br`). Si no se piden, se borran las de
+    ejecuciones anteriores para que un servidor no entregue datos antiguos.
     
-    Esta función maneja tanto polígonos simples (Polygon) como polígonos
-    múltiples (MultiPolygon). El centroide se calcula como el promedio
-    aritmético de todas las coordenadas que componen el polígono.
+    La compresión gzip se hace con la fecha fijada a cero para que el mismo
+    contenido produzca siempre los mismos bytes.
     
-    Args:
-        geometry: Diccionario con la geometría en formato GeoJSON
-        
     Returns:
-        Tupla (longitud, latitud) del centroide
-        
-    Raises:
-        ValueError: Si el tipo de geometría no es soportado
+        Diccionario {ruta: tamaño en bytes} de los archivos escritos
     """
-    geom_type = geometry['type']
-    coords = geometry['coordinates']
-    
-    # Para polígonos simples, tomamos el anillo exterior (primer elemento)
-    if geom_type == 'Polygon':
-        ring = coords[0]
-    # Para multipolígonos, tomamos el anillo exterior del primer polígono
-    elif geom_type == 'MultiPolygon':
-        ring = coords[0][0]
-    else:
-        raise ValueError(f"Tipo de geometría no soportado: {geom_type}")
+    archivos = {ruta: contenido}
+    if precomprimir:
+        archivos[f"{ruta}.gz"] = gzip.compress(contenido, compresslevel=9, mtime=0)
+        if brotli is not None:
+            archivos[f"{ruta}.br"] = brotli.compress(contenido, quality=11)
     
-    # Calcular el promedio de todas las coordenadas
-    # Nota: en GeoJSON las coordenadas están en formato [longitud, latitud]
-    longitudes = [coord[0] for coord in ring]
-    latitudes = [coord[1] for coord in ring]
-    
-    lon_centro = sum(longitudes) / len(longitudes)
-    lat_centro = sum(latitudes) / len(latitudes)
+    for destino, datos in archivos.items():
+        _escribir_atomico(destino, datos)
+    for destino in (f"{ruta}.gz", f"{ruta}.br"):
+        if destino not in archivos and os.path.exists(destino):
+            os.remove(destino)
+    return {destino: len(datos) for destino, datos in archivos.items()}
+
+
+def escribir_salida_columnar(datos_finales, ruta=OUTPUT_FILE_COLUMNAR):
+    """
+    Escribe la salida columnar minificada (y sus variantes precomprimidas
+    con SALIDA_PRECOMPRIMIDA=1).
     
-    return lon_centro, lat_centro
+    Returns:
+        Diccionario {ruta: tamaño en bytes} de los archivos escritos
+    """
+    contenido = esquema_mod.codificar_json(construir_salida_columnar(datos_finales))
+    return escribir_con_variantes(ruta, contenido)
+
+
+def eliminar_salida_columnar(ruta=OUTPUT_FILE_COLUMNAR):
+    """
+    Borra los archivos columnares de ejecuciones anteriores cuando el modo
+    está desactivado, para que la página web no muestre datos antiguos.
+    """
+    for destino in (ruta, f"{ruta}.gz", f"{ruta}.br"):
+        if os.path.exists(destino):
+            os.remove(destino)
 
 
 # ============================================================================
-# FUNCIONES DE CONSULTA A LA API
+# FUNCIÓN PRINCIPAL DE PROCESAMIENTO
 # ============================================================================
 
-def obtener_datos_clima(lat, lon, nombre_municipio):
+def preparar_municipios():
     """
-    Consulta la API de OpenWeatherMap para obtener datos meteorológicos
-    de un punto geográfico específico.
+    Comprueba el GeoJSON y prepara la lista de municipios a procesar.
     
-    La función realiza una petición HTTP a la API de OpenWeatherMap usando
-    las coordenadas proporcionadas. Los datos se obtienen en unidades métricas
-    (temperatura en Celsius, velocidad del viento en m/s) y en español.
+    El GeoJSON solo se lee (de forma incremental) si ha cambiado desde la
+    última ejecución: en ese caso se regeneran la geometría y el índice
+    espacial, y los centroides se calculan a medida que se leen las
+    features. Si no ha cambiado se reutilizan los archivos ya generados.
     
-    Args:
-        lat: Latitud del punto a consultar (float)
-        lon: Longitud del punto a consultar (float)
-        nombre_municipio: Nombre del municipio (string, solo para logging)
-        
     Returns:
-        Diccionario con los datos meteorológicos en formato de OpenWeatherMap,
-        o None si ocurre algún error en la petición.
-        
-    Nota:
-        La función incluye un timeout de 10 segundos para evitar bloqueos
-        indefinidos en caso de problemas de red.
+        Tupla (hash_geojson, municipios, total_municipios, indice_nuevo).
+        Si el índice está al día, municipios es su lista de entradas e
+        indice_nuevo es None. Si hay que regenerarlo, municipios es un
+        iterador, total_municipios es None e indice_nuevo es una lista vacía
+        que consultar_municipios() va llenando para guardarla al final.
     """
-    url = "https://api.openweathermap.org/data/2.5/weather"
-    
-    params = {
-        'lat': lat,
-        'lon': lon,
-        'appid': OPENWEATHER_API_KEY,
-        'units': 'metric',  # Obtener temperatura en Celsius y viento en m/s
-        'lang': 'es'        # Descripciones del clima en español
-    }
+    print(f"📂 Leyendo archivo GeoJSON: {GEOJSON_FILE}")
     
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()  # Lanza excepción si el código de respuesta indica error
-        return response.json()
+        hash_geojson = calcular_hash_archivo(GEOJSON_FILE)
+    except FileNotFoundError:
+        print(f"❌ ERROR: No se encontró el archivo {GEOJSON_FILE}")
+        print("   Asegúrate de que el archivo existe en la ubicación correcta")
+        sys.exit(1)
     
-    except requests.exceptions.Timeout:
-        print(f"⚠️  Timeout al consultar {nombre_municipio} - la API tardó más de 10 segundos")
-        return None
+    # Las geometrías solo se leen si los límites municipales han cambiado
+    # desde la última ejecución, y siempre de forma incremental
+    if not geometria_actualizada(hash_geojson):
+        try:
+            with metricas_ejecucion.fase('geometria'):
+                generar_geometria(LectorFeatures(GEOJSON_FILE), hash_geojson)
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"❌ ERROR: El archivo GeoJSON no tiene formato válido")
+            print(f"   Detalle del error: {e}")
+            sys.exit(1)
+        except Exception as e:
+            print(f"❌ ERROR al generar la geometría de los municipios: {e}")
+            sys.exit(1)
     
-    except requests.exceptions.HTTPError as e:
-        print(f"⚠️  Error HTTP al consultar {nombre_municipio}: {e}")
-        return None
+    # El índice espacial no es imprescindible para el mapa: si falla, se avisa
+    # y la ejecución continúa
+    if INDICE_ESPACIAL_ACTIVO and not indice_espacial_mod.indice_actualizado(hash_geojson):
+        try:
+            with metricas_ejecucion.fase('indice_espacial'):
+                generar_indice_espacial(LectorFeatures(GEOJSON_FILE), hash_geojson)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  No se pudo generar el índice espacial: {e}")
+    
+    municipios = leer_indice_centroides(hash_geojson)
+    indice_nuevo = None
+    if municipios is not None:
+        total_municipios = len(municipios)
+        print(f"✅ Límites municipales sin cambios: se reutiliza el índice {CENTROIDES_FILE}")
+        print(f"📍 Total de municipios a procesar: {total_municipios}")
+    else:
+        # Los centroides se calculan por lotes a medida que se leen las
+        # features y el índice se guarda al terminar
+        indice_nuevo = []
+        municipios = iterar_centroides(iterar_features(GEOJSON_FILE))
+        total_municipios = None
+        print("📐 Los centroides se calcularán a medida que se lea el GeoJSON")
+    
+    return hash_geojson, municipios, total_municipios, indice_nuevo
+
+
+def crear_punto_control(hash_geojson, ruta=PUNTO_CONTROL_FILE):
+    """
+    Crea el punto de control de la ejecución y carga los municipios ya
+    completados por una ejecución interrumpida.
     
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️  Error de red al consultar {nombre_municipio}: {e}")
+    Returns:
+        Tupla (punto_control, completados), o (None, {}) si está desactivado
+        o no se puede usar. En el modo rejilla no se usa: la interpolación
+        necesita las consultas de todas las celdas a la vez.
+    """
+    if PUNTO_CONTROL_VIGENCIA <= 0 or REJILLA_TAMANO_CELDA > 0:
+        return None, {}
+    punto_control = PuntoControl(ruta, hash_geojson)
+    try:
+        completados = punto_control.cargar()
+    except OSError as e:
+        print(f"⚠️  No se pudo abrir el punto de control ({e}); la ejecución no se podrá reanudar")
+        return None, {}
+    if completados:
+        print(f"↩️  Reanudando la ejecución interrumpida: {len(completados)} municipios ya completados")
+    return punto_control, completados
+
+
+def crear_cache(ruta=CACHE_FILE):
+    """Crea y carga la caché de respuestas, o devuelve None si está desactivada."""
+    if CACHE_TTL_SEGUNDOS <= 0:
         return None
+    cache = CacheRespuestas(ruta, CACHE_TTL_SEGUNDOS, CACHE_MAX_ENTRADAS)
+    cache.cargar()
+    return cache
 
 
-# ============================================================================
-# FUNCIONES DE EVALUACIÓN DEL CLIMA
-# ============================================================================
+def construir_datos_municipio(municipio, datos_clima, indice):
+    """
+    Datos de un municipio tal como se guardan en OUTPUT_FILE. La geometría no
+    se incluye: está en GEOMETRIA_FILE con la misma clave.
+    
+    Args:
+        municipio: Entrada del índice de centroides
+        datos_clima: ObservacionOWM de su centroide
+        indice: Resultado de calcular_indice_tiempo()
+    """
+    return {
+        'nombre': municipio['nombre'],
+        'codigo_ine': municipio['codigo_ine'],
+        'coordenadas': {
+            'lat': round(municipio['lat'], 6),
+            'lon': round(municipio['lon'], 6)
+        },
+        'clima': {
+            'temperatura': round(datos_clima.temp, 1),
+            'sensacion': round(datos_clima.sensacion, 1),
+            'humedad': datos_clima.humedad,
+            'viento': round(datos_clima.viento * 3.6, 1),
+            'descripcion': datos_clima.descripcion,
+            'icono': datos_clima.icono
+        },
+        'indice': indice
+    }
 
-def calcular_indice_tiempo(datos_clima):
+
+def construir_observacion(clave, datos_clima, indice):
+    """Registro de una observación para el histórico, con la precipitación incluida."""
+    return {
+        'codigo_ine': clave,
+        'temperatura': datos_clima.temp,
+        'sensacion': datos_clima.sensacion,
+        'humedad': datos_clima.humedad,
+        'viento': datos_clima.viento * 3.6,
+        'lluvia': datos_clima.lluvia,
+        'puntuacion': indice['puntuacion'],
+        'nivel': indice['nivel']
+    }
+
+
+def consultar_municipios(municipios, limitador, cache=None, total_municipios=None,
+                         indice_nuevo=None, concurrencia=PETICIONES_CONCURRENTES, detallado=True,
+                         punto_control=None, completados=None):
     """
-    Calcula un índice de calidad del tiempo basado en múltiples variables
-    meteorológicas y genera recomendaciones para el usuario.
+    Consulta el tiempo de cada municipio y calcula su índice de buen tiempo.
     
-    El sistema funciona con una puntuación de 0 a 100 puntos, donde 100
-    representa condiciones perfectas para actividades al aire libre. Se
-    evalúan múltiples factores: temperatura, sensación térmica, viento,
-    precipitación y nieve. Cada factor adverso reduce la puntuación.
+    Las peticiones a la API se lanzan en un grupo de hilos acotado y el
+    limitador reparte el cupo por minuto entre ellos. Los resultados se
+    recogen en el orden original de los municipios, por lo que la salida y
+    la contabilidad de errores son idénticas al modo secuencial.
     
-    Clasificación final:
-    - Verde (70-100 puntos): Condiciones óptimas
-    - Amarillo (40-69 puntos): Condiciones aceptables con precauciones
-    - Rojo (0-39 puntos): Condiciones adversas
+    El índice se calcula por bloques, con una sola evaluación del motor de
+    reglas por bloque: se acumulan las respuestas que ya han llegado y el
+    bloque se puntúa y se anota en el punto de control antes de esperar a
+    una respuesta pendiente (o al reunir VENTANA_CONSULTAS). Así ningún
+    municipio completado queda sin anotar mientras se espera a la red.
     
     Args:
-        datos_clima: Diccionario con datos meteorológicos de OpenWeatherMap
+        municipios: Iterable de entradas del índice de centroides. Si una
+                    entrada trae `clave` se usa como clave del municipio;
+                    si no, se calcula con clave_municipio()
+        limitador: LimitadorTasa con el cupo de peticiones
+        cache: CacheRespuestas o None
+        total_municipios: Total para mostrar el progreso, o None si no se conoce
+        indice_nuevo: Lista a la que se añade cada entrada recorrida (para
+                      guardar el índice de centroides al terminar), o None
+        concurrencia: Número de peticiones simultáneas
+        detallado: Si es False no se muestra una línea por municipio
+        punto_control: PuntoControl en el que anotar cada municipio
+                       completado, o None
+        completados: Municipios ya completados por una ejecución
+                     interrumpida ({clave: registro}); no se vuelven a
+                     consultar y sus datos se usan tal cual
         
     Returns:
-        Diccionario con las siguientes claves:
-        - nivel: 'verde', 'amarillo', 'rojo' o 'sin-datos'
-        - puntuacion: Valor numérico de 0 a 100
-        - mensaje: Texto breve describiendo la condición general
-        - consejos: Lista de strings con recomendaciones específicas
-        - color: Código hexadecimal del color para visualización
+        Diccionario con `procesados` (datos por clave de municipio),
+        `errores` (nombre por clave de los municipios sin datos),
+        `observaciones` (registros para el histórico) e `informe_rejilla`
     """
+    municipios_procesados = {}
+    municipios_con_error = {}
+    observaciones = []  # Registro para el histórico, con la precipitación incluida
+    informe_rejilla = None
     
-    # Manejo del caso sin datos disponibles
-    if not datos_clima:
-        return {
-            'nivel': 'sin-datos',
-            'puntuacion': 0,
-            'mensaje': 'Datos no disponibles',
-            'consejos': ['No hay datos meteorológicos disponibles para este municipio'],
-            'color': '#9ca3af'
-        }
+    with ThreadPoolExecutor(max_workers=max(1, concurrencia)) as ejecutor:
+        def leer_geojson(entradas):
+            # Los errores de formato del GeoJSON (leído de forma incremental)
+            # solo pueden surgir al avanzar este iterador
+            try:
+                yield from entradas
+            except (json.JSONDecodeError, ValueError) as e:
+                print(f"❌ ERROR: El archivo GeoJSON no tiene formato válido")
+                print(f"   Detalle del error: {e}")
+                ejecutor.shutdown(wait=False, cancel_futures=True)
+                sys.exit(1)
+        
+        municipios = leer_geojson(municipios)
+        
+        # Las consultas se lanzan a medida que llegan los municipios, con una
+        # ventana acotada de consultas en curso (los errores de cálculo del
+        # centroide se contabilizan al llegar a cada municipio en orden)
+        if REJILLA_TAMANO_CELDA > 0:
+            # El modo rejilla necesita todos los centroides antes de agrupar
+            municipios = list(municipios)
+            total_municipios = len(municipios)
+            centroides = [
+                (municipio['lon'], municipio['lat']) if 'error' not in municipio else None
+                for municipio in municipios
+            ]
+            futuros, informe_rejilla = consultar_por_rejilla(
+                ejecutor, limitador, cache, centroides, [m['nombre'] for m in municipios]
+            )
+            resultados = zip(municipios, futuros)
+        else:
+            resultados = consultar_en_orden(municipios, ejecutor, limitador, cache, omitidos=completados)
+        
+        # Los municipios con la respuesta ya disponible se acumulan en orden
+        # y se puntúan juntos con una sola llamada al motor de reglas; los
+        # mensajes de progreso se muestran al puntuar el bloque
+        ventana = []
+        
+        def puntuar_ventana():
+            con_datos = [entrada for entrada in ventana if entrada[3] == 'datos' and entrada[4] is not None]
+            try:
+                with metricas_ejecucion.fase('puntuacion'):
+                    indices = obtener_motor_indice().evaluar([entrada[4] for entrada in con_datos])
+                indices = dict(zip((entrada[0] for entrada in con_datos), indices))
+            except Exception as e:
+                # Un error del motor (por ejemplo, reglas_indice.json mal
+                # formado) afecta a todo el bloque
+                print(f"❌ ERROR al calcular el índice de buen tiempo: {e}")
+                indices = {}
+            
+            for idx, municipio, clave, tipo, valor in ventana:
+                nombre = municipio['nombre']
+                if detallado:
+                    progreso = f"{idx}/{total_municipios}" if total_municipios is not None else idx
+                    print(f"[{progreso}] Procesando: {nombre}")
+                
+                if tipo == 'completado':
+                    municipios_procesados[clave] = valor['datos']
+                    # En el histórico, con el instante de la ejecución que lo consultó
+                    observaciones.append(dict(valor['observacion'], ts=valor['ts']))
+                    if detallado:
+                        print(f"    ↩️  Completado en la ejecución interrumpida")
+                    continue
+                
+                if tipo == 'error' or valor is None:
+                    municipios_con_error[clave] = nombre
+                    if detallado:
+                        print(f"    ✗ Error inesperado: {valor}" if tipo == 'error'
+                              else f"    ✗ Error al obtener datos meteorológicos")
+                    continue
+                
+                if idx not in indices:
+                    municipios_con_error[clave] = nombre
+                    if detallado:
+                        print(f"    ✗ Error al calcular el índice")
+                    continue
+                
+                try:
+                    indice = indices[idx]
+                    municipio_data = construir_datos_municipio(municipio, valor, indice)
+                    observacion = construir_observacion(clave, valor, indice)
+                    municipios_procesados[clave] = municipio_data
+                    observaciones.append(observacion)
+                    if punto_control is not None:
+                        punto_control.registrar(clave, municipio_data, observacion)
+                    if detallado:
+                        print(f"    ✓ Completado - Nivel: {indice['nivel']} ({indice['puntuacion']} pts)")
+                
+                except Exception as e:
+                    municipios_con_error[clave] = nombre
+                    if detallado:
+                        print(f"    ✗ Error inesperado: {e}")
+            ventana.clear()
+        
+        for idx, (municipio, futuro) in enumerate(resultados, 1):
+            if indice_nuevo is not None:
+                indice_nuevo.append(municipio)
+            
+            # Clave a partir del código INE (campo NATCODE del IGN/ESRI)
+            clave = municipio.get('clave') or clave_municipio(municipio['codigo_ine'], idx - 1)
+            
+            if completados and clave in completados:
+                ventana.append((idx, municipio, clave, 'completado', completados[clave]))
+            else:
+                if ventana and futuro is not None and not futuro.done():
+                    # Antes de esperar a la red se puntúa y se anota lo que
+                    # ya ha llegado
+                    puntuar_ventana()
+                try:
+                    if 'error' in municipio:
+                        raise ValueError(municipio['error'])
+                    # Esperar a que llegue la respuesta de la API para este punto
+                    with metricas_ejecucion.fase('espera_api'):
+                        ventana.append((idx, municipio, clave, 'datos', futuro.result() or None))
+                except Exception as e:
+                    ventana.append((idx, municipio, clave, 'error', e))
+            
+            if len(ventana) >= max(1, VENTANA_CONSULTAS):
+                puntuar_ventana()
+        puntuar_ventana()
     
-    # ========================================================================
-    # EXTRACCIÓN DE VARIABLES METEOROLÓGICAS
-    # ========================================================================
+    return {
+        'procesados': municipios_procesados,
+        'errores': municipios_con_error,
+        'observaciones': observaciones,
+        'informe_rejilla': informe_rejilla
+    }
+
+
+def guardar_cache(cache):
+    """
+    Guarda la caché de respuestas para la próxima ejecución. Un fallo aquí
+    no debe impedir que se generen los datos de esta ejecución.
+    """
+    if cache is None:
+        return
+    try:
+        cache.guardar_en_disco()
+    except OSError as e:
+        print(f"⚠️  No se pudo guardar la caché de respuestas: {e}")
+
+
+def _metadata_comparable(metadata):
+    """Metadata sin las métricas, que cambian en cada ejecución."""
+    return {clave: valor for clave, valor in metadata.items() if clave != 'metricas'}
+
+
+def guardar_metricas(ruta=METRICAS_FILE):
+    """Guarda las métricas de la ejecución en JSON. Un fallo aquí no es grave."""
+    try:
+        _escribir_atomico(ruta, esquema_mod.codificar_json(metricas_ejecucion.resumen(), sangria=2))
+        print(f"✅ Métricas de la ejecución guardadas en: {ruta}")
+    except Exception as e:
+        print(f"⚠️  No se pudieron guardar las métricas de la ejecución: {e}")
+
+
+def guardar_resultados(resultado):
+    """
+    Escribe los archivos de salida a partir del resultado de
+    consultar_municipios(): datos principales y delta (solo si hay cambios
+    apreciables), salida columnar, estado de la ejecución e histórico.
     
-    # Variables principales (siempre presentes)
-    temp = datos_clima['main']['temp']
-    sensacion = datos_clima['main']['feels_like']
-    humedad = datos_clima['main']['humidity']
-    viento_ms = datos_clima['wind']['speed']
-    viento = viento_ms * 3.6  # Convertir de m/s a km/h para facilitar interpretación
+    Returns:
+        Diccionario con el estado de la ejecución (el de ESTADO_FILE), o
+        None si no se pudo escribir el archivo principal. En ese caso no se
+        modifica ningún archivo: los de la ejecución anterior quedan
+        intactos y el histórico no se actualiza.
+    """
+    municipios_procesados = resultado['procesados']
+    municipios_con_error = resultado['errores']
+    informe_rejilla = resultado['informe_rejilla']
     
-    # Variables opcionales (solo presentes si hay precipitación)
-    lluvia = 0
-    if 'rain' in datos_clima and '1h' in datos_clima['rain']:
-        lluvia = datos_clima['rain']['1h']
+    print()
+    print("-" * 70)
+    print("💾 Guardando datos procesados...")
     
-    nieve = 0
-    if 'snow' in datos_clima and '1h' in datos_clima['snow']:
-        nieve = datos_clima['snow']['1h']
+    # Crear estructura del archivo JSON de salida con metadata. Las marcas de
+    # tiempo y el informe del modo rejilla cambian en cada ejecución, así que
+    # van al archivo de estado y no al principal.
+    datos_finales = {
+        'metadata': {
+            'total_municipios': len(municipios_procesados),
+            'municipios_con_error': len(municipios_con_error),
+            'fuente_clima': 'OpenWeatherMap',
+            'fuente_geodatos': 'ESRI/IGN España',
+            'version_script': '2.0'
+        },
+        'municipios': municipios_procesados
+    }
+    if METRICAS_EN_METADATA:
+        # Instantánea tomada antes de escribir los archivos de esta ejecución
+        datos_finales['metadata']['metricas'] = metricas_ejecucion.resumen()
     
-    # ========================================================================
-    # SISTEMA DE PUNTUACIÓN Y GENERACIÓN DE CONSEJOS
-    # ========================================================================
+    instante_ejecucion = datetime.now()
+    estado = {
+        'ultima_actualizacion': instante_ejecucion.isoformat(),
+        'ultima_actualizacion_formateada': instante_ejecucion.strftime('%d/%m/%Y a las %H:%M'),
+        'total_municipios': len(municipios_procesados),
+        'municipios_con_error': len(municipios_con_error)
+    }
+    if informe_rejilla is not None:
+        estado['rejilla'] = informe_rejilla
     
-    puntuacion = 100  # Comenzamos con puntuación perfecta
-    consejos = []     # Lista de recomendaciones para el usuario
-    
-    # Evaluación de temperatura
-    # El rango óptimo de temperatura es el más cómodo para actividades al aire libre
-    if CRITERIOS['temp_optima_min'] <= temp <= CRITERIOS['temp_optima_max']:
-        # Temperatura perfecta, no hay penalización
-        pass
-    elif CRITERIOS['temp_precaucion_min'] <= temp < CRITERIOS['temp_optima_min']:
-        # Temperatura fresca pero tolerable
-        puntuacion -= 20
-        consejos.append('🧥 Hace algo de frío, lleva una chaqueta o abrigo ligero')
-    elif CRITERIOS['temp_optima_max'] < temp <= CRITERIOS['temp_precaucion_max']:
-        # Temperatura cálida pero manejable
-        puntuacion -= 20
-        consejos.append('☀️ Hace calor, lleva agua y protección solar (gorra, crema)')
-    elif temp < CRITERIOS['temp_precaucion_min']:
-        # Temperatura fría que requiere precauciones importantes
-        puntuacion -= 50
-        consejos.append('❄️ Hace mucho frío, abrígate bien con varias capas de ropa')
-    else:  # temp > temp_precaucion_max
-        # Temperatura muy alta que puede ser peligrosa
-        puntuacion -= 50
-        consejos.append('🌡️ Hace mucho calor, evita exposición prolongada al sol')
-    
-    # Evaluación de sensación térmica
-    # Si la sensación térmica difiere significativamente de la temperatura real,
-    # el usuario debe saberlo porque afecta cómo se sentirá al estar fuera
-    diferencia_termica = abs(sensacion - temp)
-    if diferencia_termica > 5:
-        puntuacion -= 10
-        if sensacion < temp:
-            consejos.append('🌬️ El viento hace que se sienta más frío de lo que indica la temperatura')
-        else:
-            consejos.append('💧 La humedad hace que se sienta más calor del real')
-    
-    # Evaluación del viento
-    # El viento puede hacer incómodas o peligrosas las actividades al aire libre
-    if viento < CRITERIOS['viento_precaucion']:
-        # Viento suave o brisa, ideal
-        pass
-    elif viento < CRITERIOS['viento_peligroso']:
-        # Viento moderado que requiere tomar precauciones
-        puntuacion -= 25
-        consejos.append(f'💨 Viento moderado ({int(viento)} km/h), sujeta bien tus pertenencias')
+    # Comparar con la ejecución anterior para decidir si hay que reescribir
+    anterior = cargar_salida_anterior()
+    if anterior is None:
+        delta = {'cambios': {}, 'nuevos': list(municipios_procesados), 'eliminados': []}
+        hay_cambios = True
     else:
-        # Viento fuerte que puede ser peligroso
-        puntuacion -= 60
-        consejos.append(f'⚠️ Viento fuerte ({int(viento)} km/h), peligroso para actividades al aire libre')
-    
-    # Evaluación de precipitación (lluvia)
-    # Cualquier cantidad de lluvia afecta negativamente las actividades al aire libre
-    if lluvia == 0:
-        # Sin lluvia, perfecto
-        pass
-    elif lluvia < CRITERIOS['lluvia_ligera']:
-        # Llovizna o lluvia muy ligera
-        puntuacion -= 20
-        consejos.append('🌦️ Lluvia ligera, lleva paraguas o impermeable')
-    elif lluvia < CRITERIOS['lluvia_fuerte']:
-        # Lluvia moderada que dificulta las actividades
-        puntuacion -= 40
-        consejos.append('☔ Lluvia moderada, mejor postponer actividades al aire libre')
-    else:
-        # Lluvia fuerte, muy desaconsejable salir
-        puntuacion -= 70
-        consejos.append('⛈️ Lluvia fuerte, no es buen momento para salir')
-    
-    # Evaluación de nieve
-    # La presencia de nieve siempre requiere precauciones especiales
-    if nieve > 0:
-        puntuacion -= 50
-        consejos.append('🌨️ Está nevando, extrema precaución con superficies resbaladizas')
+        delta = calcular_delta(anterior['municipios'], municipios_procesados)
+        hay_cambios = (bool(delta['cambios'] or delta['nuevos'] or delta['eliminados'])
+                       or _metadata_comparable(anterior['metadata']) != _metadata_comparable(datos_finales['metadata']))
+    hay_cambios = hay_cambios or FORZAR_ESCRITURA
     
-    # ========================================================================
-    # CLASIFICACIÓN FINAL Y GENERACIÓN DE MENSAJE
-    # ========================================================================
+    estado['cambios_apreciables'] = hay_cambios
+    estado['municipios_modificados'] = len(delta['cambios'])
     
-    # Asegurar que la puntuación no sea negativa
-    puntuacion = max(0, puntuacion)
-    
-    # Si no hay consejos específicos, las condiciones son perfectas
-    if not consejos:
-        consejos.append('✨ Condiciones perfectas para actividades al aire libre')
-    
-    # Determinar el nivel de recomendación según la puntuación final
-    if puntuacion >= 70:
-        nivel = 'verde'
-        color = '#10b981'  # Verde brillante
-        mensaje_general = 'Excelente para salir'
-    elif puntuacion >= 40:
-        nivel = 'amarillo'
-        color = '#f59e0b'  # Naranja/Amarillo
-        mensaje_general = 'Aceptable con precauciones'
+    if hay_cambios:
+        # Guardar en archivo JSON con formato legible
+        # El archivo principal se codifica municipio a municipio mientras se
+        # escribe, sin generar antes el documento entero
+        try:
+            _escribir_en_flujo(OUTPUT_FILE, esquema_mod.codificar_json_en_flujo(datos_finales, sangria=2))
+        except Exception as e:
+            print(f"❌ ERROR al guardar el archivo: {e}")
+            print(f"   Se conserva {OUTPUT_FILE} de la ejecución anterior")
+            return None
+        
+        try:
+            _escribir_atomico(DELTA_FILE, esquema_mod.codificar_json(delta, sangria=1))
+            print(f"✅ Datos guardados correctamente en: {OUTPUT_FILE}")
+            print(f"✅ Cambios respecto a la ejecución anterior en: {DELTA_FILE} "
+                  f"({len(delta['cambios'])} modificados, {len(delta['nuevos'])} nuevos, "
+                  f"{len(delta['eliminados'])} eliminados)")
+        except Exception as e:
+            print(f"✅ Datos guardados correctamente en: {OUTPUT_FILE}")
+            print(f"⚠️  No se pudo guardar el archivo de diferencias: {e}")
+        
+        # La salida columnar es un complemento: si falla, el archivo principal
+        # ya está escrito y la página web lo usará
+        try:
+            if SALIDA_COLUMNAR:
+                with metricas_ejecucion.fase('salida_columnar'):
+                    tamanos = escribir_salida_columnar(datos_finales)
+                for destino, tamano in tamanos.items():
+                    print(f"✅ Salida columnar guardada en: {destino} ({tamano / 1024:.1f} KB)")
+            else:
+                eliminar_salida_columnar()
+        except Exception as e:
+            print(f"⚠️  No se pudo generar la salida columnar: {e}")
     else:
-        nivel = 'rojo'
-        color = '#ef4444'  # Rojo
-        mensaje_general = 'Mejor quedarse en casa'
+        print(f"ℹ️  Ningún municipio ha cambiado más allá de las tolerancias: "
+              f"se conserva {OUTPUT_FILE}")
     
-    return {
-        'nivel': nivel,
-        'puntuacion': puntuacion,
-        'mensaje': mensaje_general,
-        'consejos': consejos,
-        'color': color
-    }
+    try:
+        _escribir_atomico(ESTADO_FILE, esquema_mod.codificar_json(estado, sangria=2))
+        print(f"✅ Estado de la ejecución guardado en: {ESTADO_FILE}")
+    except Exception as e:
+        print(f"⚠️  No se pudo guardar el estado de la ejecución: {e}")
+    
+    # Añadir las observaciones de esta ejecución al histórico. Se registran
+    # siempre, aunque no haya cambios apreciables respecto a la anterior.
+    if HISTORICO_ACTIVO:
+        try:
+            with metricas_ejecucion.fase('historico'), historico_mod.HistoricoObservaciones() as historico:
+                guardadas = historico.registrar_ejecucion(instante_ejecucion, resultado['observaciones'])
+            print(f"✅ {guardadas} observaciones añadidas al histórico: {historico_mod.HISTORICO_FILE}")
+        except Exception as e:
+            print(f"⚠️  No se pudo actualizar el histórico: {e}")
+    
+    return estado
 
 
-# ============================================================================
-# FUNCIÓN PRINCIPAL DE PROCESAMIENTO
-# ============================================================================
+def mostrar_resumen(resultado, cache=None, metricas=None):
+    """
+    Muestra el resumen final de la ejecución.
+    
+    Args:
+        metricas: Resumen de métricas que mostrar (por ejemplo, el combinado
+                  de los fragmentos); por defecto, el de esta ejecución
+    """
+    municipios_con_error = list(resultado['errores'].values())
+    informe_rejilla = resultado['informe_rejilla']
+    
+    print()
+    print("=" * 70)
+    print("✅ PROCESO COMPLETADO EXITOSAMENTE")
+    print("=" * 70)
+    print(f"📊 Municipios procesados correctamente: {len(resultado['procesados'])}")
+    if cache is not None:
+        print(f"🗃️  Caché de respuestas: {cache.aciertos} aciertos, {cache.fallos} fallos")
+    if informe_rejilla is not None:
+        print(f"🔲 Modo rejilla: {informe_rejilla['consultas_celdas']} consultas para "
+              f"{informe_rejilla['municipios']} municipios "
+              f"(celda de {informe_rejilla['tamano_celda_grados']}°)")
+        for variable, error in informe_rejilla['error_validacion'].items():
+            print(f"   Error de interpolación en {variable}: medio {error['medio']}, "
+                  f"máximo {error['maximo']} ({informe_rejilla['consultas_validacion']} municipios de control)")
+    if metricas is None:
+        metricas = metricas_ejecucion.resumen()
+    peticiones = metricas['peticiones']
+    if peticiones['total']:
+        latencia = peticiones['latencia_ms']
+        if latencia['p50'] is not None:
+            detalle = f"p50 {latencia['p50']} ms, p95 {latencia['p95']} ms, p99 {latencia['p99']} ms"
+        else:
+            detalle = f"media {latencia['media']} ms, máxima {latencia['maxima']} ms"
+        print(f"🌐 Peticiones a la API: {peticiones['total']} ({detalle}), "
+              f"{metricas['contadores'].get('reintentos', 0)} reintentos, "
+              f"{peticiones['timeouts']} timeouts, {peticiones['errores_http']} errores HTTP")
+    print("⏱️  Tiempo por fase: " + ", ".join(
+        f"{fase} {segundos:.2f} s" for fase, segundos in metricas['fases_segundos'].items()
+    ))
+    if municipios_con_error:
+        print(f"⚠️  Municipios con errores: {len(municipios_con_error)}")
+        print(f"   Municipios afectados: {', '.join(municipios_con_error[:5])}")
+        if len(municipios_con_error) > 5:
+            print(f"   ... y {len(municipios_con_error) - 5} más")
+    print(f"⏰ Hora de finalización: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
 
 def procesar_municipios():
     """
@@ -330,15 +2364,22 @@ def procesar_municipios():
     
     Esta función realiza las siguientes operaciones en secuencia:
     1. Valida la presencia de la API key
-    2. Lee el archivo GeoJSON con los municipios
+    2. Lee el archivo GeoJSON con los municipios de forma incremental (solo
+       si ha cambiado desde la última ejecución; si no, se usan el índice de
+       centroides y la geometría ya generados)
     3. Para cada municipio:
        - Calcula su centroide
-       - Consulta los datos meteorológicos
+       - Consulta los datos meteorológicos (en paralelo y respetando
+         el cupo de peticiones por minuto de la API)
        - Evalúa las condiciones y genera recomendaciones
+       - Lo anota en el punto de control, para poder reanudar la
+         ejecución si se interrumpe
     4. Guarda todos los datos procesados en un archivo JSON
     
     El proceso incluye manejo de errores robusto y logging detallado
     para facilitar la detección y resolución de problemas.
+    
+    Para repartir el trabajo entre varios procesos, ver fragmentos.py.
     """
     
     print("=" * 70)
@@ -363,152 +2404,85 @@ def procesar_municipios():
     # LECTURA DEL ARCHIVO GEOJSON
     # ========================================================================
     
-    print(f"📂 Leyendo archivo GeoJSON: {GEOJSON_FILE}")
-    
-    try:
-        with open(GEOJSON_FILE, 'r', encoding='utf-8') as f:
-            geojson = json.load(f)
-    except FileNotFoundError:
-        print(f"❌ ERROR: No se encontró el archivo {GEOJSON_FILE}")
-        print("   Asegúrate de que el archivo existe en la ubicación correcta")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"❌ ERROR: El archivo GeoJSON no tiene formato válido")
-        print(f"   Detalle del error: {e}")
-        sys.exit(1)
-    
-    # Validar estructura básica del GeoJSON
-    if 'features' not in geojson:
-        print("❌ ERROR: El archivo GeoJSON no contiene la clave 'features'")
-        sys.exit(1)
-    
-    total_municipios = len(geojson['features'])
-    print(f"✅ Archivo GeoJSON cargado correctamente")
-    print(f"📍 Total de municipios a procesar: {total_municipios}")
+    metricas_ejecucion.reiniciar()
+    with metricas_ejecucion.fase('preparacion'):
+        hash_geojson, municipios, total_municipios, indice_nuevo = preparar_municipios()
     print()
     
     # ========================================================================
     # PROCESAMIENTO DE CADA MUNICIPIO
     # ========================================================================
     
-    municipios_procesados = []
-    municipios_con_error = []
-    
     print("🔄 Iniciando procesamiento de municipios...")
+    print(f"   Concurrencia: {PETICIONES_CONCURRENTES} peticiones, "
+          f"cupo: {PETICIONES_POR_MINUTO} peticiones/minuto")
     print("-" * 70)
     
-    for idx, feature in enumerate(geojson['features'], 1):
-        # Extraer información del municipio
-        properties = feature['properties']
-        geometry = feature['geometry']
-        
-        # Obtener el nombre del municipio (campo NAMEUNIT del IGN/ESRI)
-        nombre = properties.get('NAMEUNIT', 'Desconocido')
-        codigo_ine = properties.get('NATCODE', '')
-        
-        print(f"[{idx}/{total_municipios}] Procesando: {nombre}")
-        
-        try:
-            # Calcular el centroide del municipio
-            lon_centro, lat_centro = calcular_centroide(geometry)
-            
-            # Consultar datos meteorológicos para este punto
-            datos_clima = obtener_datos_clima(lat_centro, lon_centro, nombre)
-            
-            if datos_clima:
-                # Calcular el índice de buen tiempo
-                indice = calcular_indice_tiempo(datos_clima)
-                
-                # Preparar datos estructurados en formato GeoJSON válido
-                # Cada municipio debe ser un Feature GeoJSON completo
-                municipio_data = {
-                    'type': 'Feature',
-                    'properties': {
-                        'nombre': nombre,
-                        'codigo_ine': codigo_ine,
-                        'coordenadas': {
-                            'lat': round(lat_centro, 6),
-                            'lon': round(lon_centro, 6)
-                        },
-                        'clima': {
-                            'temperatura': round(datos_clima['main']['temp'], 1),
-                            'sensacion': round(datos_clima['main']['feels_like'], 1),
-                            'humedad': datos_clima['main']['humidity'],
-                            'viento': round(datos_clima['wind']['speed'] * 3.6, 1),
-                            'descripcion': datos_clima['weather'][0]['description'],
-                            'icono': datos_clima['weather'][0]['icon']
-                        },
-                        'indice': indice
-                    },
-                    'geometry': geometry  # Geometría original del municipio
-                }
-                
-                municipios_procesados.append(municipio_data)
-                print(f"    ✓ Completado - Nivel: {indice['nivel']} ({indice['puntuacion']} pts)")
-            else:
-                municipios_con_error.append(nombre)
-                print(f"    ✗ Error al obtener datos meteorológicos")
-        
-        except Exception as e:
-            municipios_con_error.append(nombre)
-            print(f"    ✗ Error inesperado: {e}")
-        
-        # Pausa entre llamadas a la API para respetar los límites de tasa
-        # OpenWeatherMap permite 60 llamadas por minuto en el plan gratuito
-        time.sleep(1)
+    limitador = LimitadorTasa(PETICIONES_POR_MINUTO, RAFAGA_PETICIONES)
+    cache = crear_cache()
+    punto_control, completados = crear_punto_control(hash_geojson)
+    
+    try:
+        with metricas_ejecucion.fase('consultas'):
+            resultado = consultar_municipios(municipios, limitador, cache, total_municipios, indice_nuevo,
+                                             punto_control=punto_control, completados=completados)
+    finally:
+        if punto_control is not None:
+            punto_control.cerrar()
+    
+    with metricas_ejecucion.fase('escritura'):
+        if indice_nuevo is not None:
+            guardar_indice_centroides(indice_nuevo, hash_geojson)
+        guardar_cache(cache)
     
     # ========================================================================
     # GENERACIÓN DEL ARCHIVO DE SALIDA
     # ========================================================================
     
-    print()
-    print("-" * 70)
-    print("💾 Guardando datos procesados...")
-    
-    # Crear estructura del archivo JSON de salida con metadata
-    datos_finales = {
-        'metadata': {
-            'ultima_actualizacion': datetime.now().isoformat(),
-            'ultima_actualizacion_formateada': datetime.now().strftime('%d/%m/%Y a las %H:%M'),
-            'total_municipios': len(municipios_procesados),
-            'municipios_con_error': len(municipios_con_error),
-            'fuente_clima': 'OpenWeatherMap',
-            'fuente_geodatos': 'ESRI/IGN España',
-            'version_script': '2.0'
-        },
-        'municipios': municipios_procesados
-    }
+    with metricas_ejecucion.fase('escritura'):
+        estado = guardar_resultados(resultado)
+    guardar_metricas()
     
-    # Guardar en archivo JSON con formato legible
-    try:
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(datos_finales, f, ensure_ascii=False, indent=2)
-        print(f"✅ Datos guardados correctamente en: {OUTPUT_FILE}")
-    except Exception as e:
-        print(f"❌ ERROR al guardar el archivo: {e}")
+    if estado is None:
+        # Lo consultado sigue en el punto de control: la próxima ejecución
+        # lo reutiliza en lugar de repetir las consultas
+        if punto_control is not None:
+            print(f"↩️  Los municipios consultados se conservan en {PUNTO_CONTROL_FILE}; "
+                  f"la próxima ejecución los reutilizará")
         sys.exit(1)
+    if punto_control is not None:
+        punto_control.eliminar()
     
     # ========================================================================
     # RESUMEN FINAL
     # ========================================================================
     
-    print()
-    print("=" * 70)
-    print("✅ PROCESO COMPLETADO EXITOSAMENTE")
-    print("=" * 70)
-    print(f"📊 Municipios procesados correctamente: {len(municipios_procesados)}")
-    if municipios_con_error:
-        print(f"⚠️  Municipios con errores: {len(municipios_con_error)}")
-        print(f"   Municipios afectados: {', '.join(municipios_con_error[:5])}")
-        if len(municipios_con_error) > 5:
-            print(f"   ... y {len(municipios_con_error) - 5} más")
-    print(f"⏰ Hora de finalización: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 70)
+    mostrar_resumen(resultado, cache)
 
 
 # ============================================================================
 # PUNTO DE ENTRADA DEL SCRIPT
 # ============================================================================
 
+def main():
+    parser = argparse.ArgumentParser(description='Actualiza los datos meteorológicos de los municipios')
+    parser.add_argument('--profile', nargs='?', const='data/perfil.prof', metavar='RUTA',
+                        help='Ejecuta con cProfile y guarda las estadísticas (por defecto en data/perfil.prof)')
+    args = parser.parse_args()
+    
+    if not args.profile:
+        procesar_municipios()
+        return
+    
+    perfil = cProfile.Profile()
+    try:
+        perfil.runcall(procesar_municipios)
+    finally:
+        perfil.dump_stats(args.profile)
+        print()
+        print(f"📈 Perfil de la ejecución guardado en: {args.profile} (funciones con más tiempo acumulado)")
+        pstats.Stats(perfil).sort_stats('cumulative').print_stats(25)
+
+
 if __name__ == "__main__":
-    procesar_municipios()
+    main()